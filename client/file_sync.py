@@ -1,17 +1,34 @@
 import os
 import argparse
+import asyncio
+import ctypes
+import ctypes.util
+import fnmatch
 import hashlib
+import itertools
+import httpx
 import json
 import requests
 import socket
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 import logging
+import mmap
+import queue
+import re
+import select
 import shutil
+import sqlite3
+import struct
 import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import closing
+from functools import partial
 from pathlib import Path
-from typing import Optional, List, Dict, Any
-from collections import Counter
+from typing import Optional, List, Dict, Any, Iterable, Iterator, Callable
+from collections import Counter, defaultdict
 
 # Handle TOML compatibility for Python 3.10 vs 3.11+
 if sys.version_info >= (3, 11):
@@ -22,12 +39,51 @@ else:
     except ImportError:
         tomllib = None
 
+# Faster non-cryptographic and tree hashes are optional extras
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+# HTTP/2 support for the async client needs the optional h2 package (the http2 extra)
+try:
+    import h2
+except ImportError:
+    h2 = None
+
 CONFIG_DIR = Path.home() / ".config" / "filizer"
 CONFIG_FILE = CONFIG_DIR / "cli-conf.toml"
+HASH_CACHE_FILE = CONFIG_DIR / "hash-cache.db"
+ACTION_JOURNAL_FILE = CONFIG_DIR / "actions.db"
+SNAPSHOT_FILE = CONFIG_DIR / "snapshots.db"
+DEFERRED_FILE = CONFIG_DIR / "deferred-actions.jsonl"
+# Default read size when hashing; large enough to keep per-chunk Python overhead negligible
+HASH_BUFFER_SIZE = 1024 * 1024
+# The most hashes the server accepts in one batch lookup (MAX_LOOKUP_BATCH in server/main.py)
+MAX_LOOKUP_BATCH = 10000
+# The most records the server accepts in one bulk insert (MAX_BULK_INSERT in server/main.py)
+MAX_BULK_INSERT = 10000
 
-from common.models import DuplicateStatus, FileModel, VERSION, MIN_SERVER_VERSION
+from common.models import ActionStatus, DuplicateStatus, FileModel, DirectoryModel, DEFAULT_HASH_ALGO, VERSION, MIN_SERVER_VERSION
 import semver
 
+# Hash constructors by the name stored in FileModel.hash_algo
+HASH_ALGORITHMS: Dict[str, Callable[[], Any]] = {
+    "md5": hashlib.md5,
+    "sha256": hashlib.sha256,
+    "blake2b": hashlib.blake2b,
+}
+if xxhash:
+    HASH_ALGORITHMS["xxh3_128"] = xxhash.xxh3_128
+    HASH_ALGORITHMS["xxh64"] = xxhash.xxh64
+if blake3:
+    HASH_ALGORITHMS["blake3"] = blake3.blake3
+
 def setup_logging(level: str, log_file: Optional[str]) -> None:
     """Configures logging with a dynamic level and optional file output."""
     numeric_level = getattr(logging, level.upper(), logging.INFO)
@@ -56,6 +112,23 @@ def init_config():
         'level = "INFO"\n'
         'force = false\n'
         'exclude = [".git", "node_modules", "__pycache__", ".venv"]\n'
+        'batch_size = 0\n'
+        'submit_batch_size = 0\n'
+        'workers = 1\n'
+        'queue_depth = 1024\n'
+        'pool = "thread"\n'
+        'hash_algo = "md5"\n'
+        "\n"
+        "# What to do instead of prompting: ask | skip | continue | delete | confirm.\n"
+        "# confirm queues the deletion for --review; ask becomes confirm without a terminal.\n"
+        "[policy]\n"
+        'previously_scanned = "ask"\n'
+        'marked_for_deletion = "ask"\n'
+        'rm = "ask"\n'
+        "\n"
+        "# [[policy.rules]]\n"
+        '# pattern = "/mnt/archive/*"\n'
+        '# rm = "skip"\n'
     )
 
     try:
@@ -75,18 +148,509 @@ def load_config() -> dict:
             print(f"Warning: Failed to load config: {e}")
     return {}
 
+_read_buffers = threading.local()
+
+def _read_buffer(size: int) -> memoryview:
+    """Returns this thread's reusable read buffer, so hashing never allocates per chunk."""
+    buffer = getattr(_read_buffers, "buffer", None)
+    if buffer is None or len(buffer) != size:
+        buffer = _read_buffers.buffer = memoryview(bytearray(size))
+    return buffer
+
+def _fadvise(fd: int, advice_name: str) -> None:
+    """Applies a posix_fadvise hint where the platform supports it."""
+    advice = getattr(os, advice_name, None)
+    if advice is None or not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, advice)
+    except OSError:
+        pass
+
+def get_file_hash(file_path: Path, algo: str = DEFAULT_HASH_ALGO,
+                  buffer_size: int = HASH_BUFFER_SIZE, mmap_threshold: int = 0,
+                  fadvise: bool = True) -> Optional[str]:
+    """Generates a hex digest with the named algorithm using chunked reading for memory efficiency.
+
+    Files are read with readinto into a reused per-thread buffer of buffer_size bytes,
+    or memory-mapped when mmap_threshold is set and the file is at least that large.
+    With fadvise, the kernel is told the read is sequential and the file's pages are
+    dropped afterwards so a scan does not evict other processes' page cache.
+    """
+    hasher = HASH_ALGORITHMS[algo]()
+    try:
+        with open(file_path, "rb", buffering=0) as f:
+            fd = f.fileno()
+            if fadvise:
+                _fadvise(fd, "POSIX_FADV_SEQUENTIAL")
+            try:
+                if mmap_threshold and os.fstat(fd).st_size >= mmap_threshold:
+                    with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mapped:
+                        if hasattr(mapped, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+                            mapped.madvise(mmap.MADV_SEQUENTIAL)
+                        hasher.update(mapped)
+                else:
+                    buffer = _read_buffer(buffer_size)
+                    while read := f.readinto(buffer):
+                        hasher.update(buffer[:read])
+            finally:
+                if fadvise:
+                    _fadvise(fd, "POSIX_FADV_DONTNEED")
+        return hasher.hexdigest()
+    except (PermissionError, OSError, ValueError) as e:
+        logging.debug(f"Could not hash {file_path}: {e}")
+        return None
+
 def get_md5(file_path: Path) -> Optional[str]:
     """Generates an MD5 hash using chunked reading for memory efficiency."""
-    hash_md5 = hashlib.md5()
+    return get_file_hash(file_path, "md5")
+
+def get_partial_hash(file_path: Path, chunk_size: int, algo: str = DEFAULT_HASH_ALGO) -> Optional[str]:
+    """Hashes only the first and last chunk_size bytes of a file."""
+    hasher = HASH_ALGORITHMS[algo]()
     try:
         with open(file_path, "rb") as f:
-            while chunk := f.read(4096):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
+            hasher.update(f.read(chunk_size))
+            f.seek(-chunk_size, os.SEEK_END)
+            hasher.update(f.read(chunk_size))
+        return hasher.hexdigest()
     except (PermissionError, OSError) as e:
-        logging.debug(f"Could not hash {file_path}: {e}")
+        logging.debug(f"Could not partially hash {file_path}: {e}")
         return None
 
+MARKER_FILE = "MARKED_FOR_DELETION"
+
+class ExcludeRules:
+    """Exclusion patterns: exact names, name globs ("*.tmp") and globs on the path
+    relative to the scan root when the pattern contains a slash ("build/cache*").
+
+    Exact names are a set lookup and each kind of glob is compiled into one regex,
+    so a check costs the same however many patterns there are.
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.names = set()
+        name_globs, path_globs = [], []
+        for pattern in patterns:
+            if "/" in pattern:
+                path_globs.append(pattern.strip("/"))
+            elif any(char in pattern for char in "*?["):
+                name_globs.append(pattern)
+            else:
+                self.names.add(pattern)
+        self._name_re = re.compile("|".join(map(fnmatch.translate, name_globs))) if name_globs else None
+        self._path_re = re.compile("|".join(map(fnmatch.translate, path_globs))) if path_globs else None
+
+    def matches(self, name: str, rel_dir: str = "") -> bool:
+        """Whether the entry name inside rel_dir (relative to the scan root, "" for the root) is excluded."""
+        if name in self.names or (self._name_re and self._name_re.match(name)):
+            return True
+        return bool(self._path_re and self._path_re.match(f"{rel_dir}/{name}" if rel_dir else name))
+
+class ScannedPath(Path):
+    """A walked file's path that remembers the stat result of its directory entry.
+
+    stat() (and so exists(), is_file(), the hash cache and build_file_model) answers
+    from that result instead of another syscall. Derived paths do not inherit it.
+    """
+
+    def __init__(self, *args, stat_result: Optional[os.stat_result] = None):
+        super().__init__(*args)
+        self._stat_result = stat_result
+
+    def stat(self, *, follow_symlinks: bool = True) -> os.stat_result:
+        if self._stat_result is not None and follow_symlinks:
+            return self._stat_result
+        return super().stat(follow_symlinks=follow_symlinks)
+
+def scan_directory(directory: Path, root: Path,
+                   excludes: ExcludeRules) -> tuple[List[ScannedPath], List[str], bool]:
+    """Lists directory in a single pass over os.scandir.
+
+    Returns its regular files (stat'ed once each, through the entry), the names of the
+    subdirectories to descend into and whether a MARKED_FOR_DELETION file is present.
+    Excluded names, symlinked directories, unreadable entries and the marker itself
+    are left out.
+    """
+    rel_dir = str(directory.relative_to(root)) if directory != root else ""
+    files, subdirs, marked = [], [], False
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.name == MARKER_FILE:
+                marked = True
+                continue
+            if excludes.matches(entry.name, rel_dir):
+                continue
+            try:
+                # File types come from the listing; only symlinks need a stat to resolve
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                elif entry.is_file():
+                    files.append(ScannedPath(entry.path, stat_result=entry.stat()))
+            except OSError as e:
+                logging.debug(f"Could not stat {entry.path}: {e}")
+    return files, subdirs, marked
+
+def get_file_sizes(paths: Iterable[Path]) -> Dict[Path, int]:
+    """Maps each path to its size in walk order, using -1 for files that cannot be stat'ed."""
+    sizes = {}
+    for file_path in paths:
+        try:
+            sizes[file_path] = file_path.stat().st_size
+        except OSError:
+            sizes[file_path] = -1
+    return sizes
+
+def select_size_candidates(sizes: Dict[Path, int], remote_sizes: set[int], partial_size: int,
+                           hash_algo: str = DEFAULT_HASH_ALGO) -> tuple[List[Path], int]:
+    """Returns the paths that may have a duplicate, in walk order, and how many were ruled out.
+
+    A file can only be a duplicate if its size is already on the server or is shared
+    with another local file. Local-only collisions are further split by a partial
+    hash of partial_size bytes from each end before any file is fully hashed.
+    """
+    by_size: Dict[int, List[Path]] = defaultdict(list)
+    for file_path, size in sizes.items():
+        by_size[size].append(file_path)
+
+    candidates = set()
+    for size, group in by_size.items():
+        # Unreadable files are passed through so the hashing stage reports the failure
+        if size < 0 or size in remote_sizes:
+            candidates.update(group)
+        elif len(group) < 2:
+            continue
+        elif partial_size <= 0 or size <= 2 * partial_size:
+            candidates.update(group)
+        else:
+            by_partial: Dict[Optional[str], List[Path]] = defaultdict(list)
+            for file_path in group:
+                by_partial[get_partial_hash(file_path, partial_size, hash_algo)].append(file_path)
+            for partial_hash, subgroup in by_partial.items():
+                if partial_hash is None or len(subgroup) > 1:
+                    candidates.update(subgroup)
+
+    return [p for p in sizes if p in candidates], len(sizes) - len(candidates)
+
+class HashCache:
+    """On-disk map from (device, inode, size, mtime) to a previously computed digest.
+
+    Entries are kept per hash algorithm; the instance reads and writes those of
+    hash_algo. The connection is shared by the hashing workers, so every access is
+    serialized by a lock. With rehash set, lookups always miss but fresh hashes
+    are still stored.
+    """
+
+    COMMIT_INTERVAL = 1000
+    SCHEMA_VERSION = 2
+
+    def __init__(self, db_path: Path = HASH_CACHE_FILE, rehash: bool = False,
+                 hash_algo: str = DEFAULT_HASH_ALGO):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.rehash = rehash
+        self.hash_algo = hash_algo
+        self.scan_id = time.time_ns()
+        self._lock = threading.Lock()
+        self._uncommitted = 0
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # It is only a cache, so an outdated layout is simply rebuilt
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] != self.SCHEMA_VERSION:
+            self._conn.execute("DROP TABLE IF EXISTS hashes")
+            self._conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            "dev INTEGER NOT NULL, ino INTEGER NOT NULL, hash_algo TEXT NOT NULL, "
+            "size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, digest TEXT NOT NULL, "
+            "path TEXT NOT NULL, scan_id INTEGER NOT NULL, "
+            "PRIMARY KEY (dev, ino, hash_algo), UNIQUE (path, hash_algo))"
+        )
+        self._conn.commit()
+
+    def _written(self) -> None:
+        self._uncommitted += 1
+        if self._uncommitted >= self.COMMIT_INTERVAL:
+            self._conn.commit()
+            self._uncommitted = 0
+
+    def lookup(self, file_path: Path, st: os.stat_result) -> Optional[str]:
+        """Returns the cached digest if the file's identity and metadata are unchanged."""
+        if self.rehash:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT digest FROM hashes WHERE dev = ? AND ino = ? AND hash_algo = ? "
+                "AND size = ? AND mtime_ns = ?",
+                (st.st_dev, st.st_ino, self.hash_algo, st.st_size, st.st_mtime_ns),
+            ).fetchone()
+            if row:
+                # Refresh the path too, so renamed files keep their entry
+                self._conn.execute(
+                    "UPDATE OR REPLACE hashes SET path = ?, scan_id = ? "
+                    "WHERE dev = ? AND ino = ? AND hash_algo = ?",
+                    (str(file_path), self.scan_id, st.st_dev, st.st_ino, self.hash_algo),
+                )
+                self._written()
+        return row[0] if row else None
+
+    def store(self, file_path: Path, st: os.stat_result, digest: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO hashes "
+                "(dev, ino, hash_algo, size, mtime_ns, digest, path, scan_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (st.st_dev, st.st_ino, self.hash_algo, st.st_size, st.st_mtime_ns,
+                 digest, str(file_path), self.scan_id),
+            )
+            self._written()
+
+    def evict_missing(self, root: Path) -> int:
+        """Drops entries under root that this scan did not see and that no longer exist."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT path FROM hashes WHERE scan_id != ?", (self.scan_id,)
+            ).fetchall()
+            missing = [
+                (path,) for (path,) in rows
+                if Path(path).is_relative_to(root) and not os.path.lexists(path)
+            ]
+            self._conn.executemany("DELETE FROM hashes WHERE path = ?", missing)
+            self._conn.commit()
+            self._uncommitted = 0
+        return len(missing)
+
+    def commit(self) -> None:
+        with self._lock:
+            self._conn.commit()
+            self._uncommitted = 0
+
+    def close(self) -> None:
+        self.commit()
+        self._conn.close()
+
+def get_cached_md5(file_path: Path, cache: Optional[HashCache],
+                   hasher: Callable[[Path], Optional[str]] = get_md5) -> Optional[str]:
+    """Returns the file's digest from the cache, hashing and storing it on a miss."""
+    if cache is None:
+        return hasher(file_path)
+    try:
+        st = file_path.stat()
+    except OSError as e:
+        logging.debug(f"Could not stat {file_path}: {e}")
+        return None
+    if md5_hash := cache.lookup(file_path, st):
+        return md5_hash
+    md5_hash = hasher(file_path)
+    if md5_hash:
+        cache.store(file_path, st, md5_hash)
+    return md5_hash
+
+class Manifest:
+    """Local SQLite store of the records of offline scans, uploaded later by sync_manifest.
+
+    Holds one row per (host, full_path) with the fields of its FileModel, plus the roots
+    that were scanned so a sync knows which server records it is responsible for.
+    """
+
+    COMMIT_INTERVAL = 1000
+    SCHEMA_VERSION = 1
+    COLUMNS = ("host", "full_path", "name", "size", "kind", "md5", "hash_algo", "parent_dir", "mtime")
+
+    def __init__(self, db_path: Path):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.scan_id = time.time_ns()
+        self._uncommitted = 0
+        self._conn = sqlite3.connect(str(db_path))
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Unlike the hash cache this is the only copy of the scan, so never drop it
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (0, self.SCHEMA_VERSION):
+            raise ValueError(f"{db_path} is a manifest of unsupported version {version}")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "host TEXT NOT NULL, full_path TEXT NOT NULL, name TEXT NOT NULL, "
+            "size INTEGER NOT NULL, kind TEXT NOT NULL, md5 TEXT NOT NULL, hash_algo TEXT NOT NULL, "
+            "parent_dir TEXT NOT NULL, mtime REAL, scan_id INTEGER NOT NULL, "
+            "PRIMARY KEY (host, full_path))"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS roots (host TEXT NOT NULL, path TEXT NOT NULL, "
+                           "PRIMARY KEY (host, path))")
+        self._conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+        self._conn.commit()
+
+    def add_root(self, host: str, root: Path) -> None:
+        self._conn.execute("INSERT OR IGNORE INTO roots (host, path) VALUES (?, ?)", (host, str(root)))
+
+    def roots(self, host: str) -> List[Path]:
+        return [Path(path) for (path,) in self._conn.execute("SELECT path FROM roots WHERE host = ?", (host,))]
+
+    def hosts(self) -> List[str]:
+        return [host for (host,) in self._conn.execute("SELECT DISTINCT host FROM roots")]
+
+    def add(self, file_model: FileModel) -> None:
+        values = [getattr(file_model, column) for column in self.COLUMNS]
+        self._conn.execute(
+            f"INSERT OR REPLACE INTO files ({', '.join(self.COLUMNS)}, scan_id) "
+            f"VALUES ({', '.join('?' * len(self.COLUMNS))}, ?)",
+            (*values, self.scan_id),
+        )
+        self._uncommitted += 1
+        if self._uncommitted >= self.COMMIT_INTERVAL:
+            self.commit()
+
+    def evict_missing(self, host: str, root: Path) -> int:
+        """Drops rows under root that this scan did not record."""
+        rows = self._conn.execute(
+            "SELECT full_path FROM files WHERE host = ? AND scan_id != ?", (host, self.scan_id)
+        ).fetchall()
+        missing = [(host, path) for (path,) in rows if Path(path).is_relative_to(root)]
+        self._conn.executemany("DELETE FROM files WHERE host = ? AND full_path = ?", missing)
+        self.commit()
+        return len(missing)
+
+    def load_remote(self, rows: Iterable[Dict[str, Any]]) -> None:
+        """Replaces the temporary copy of the server's records that delta() compares against.
+
+        Records marked vanished are left out: a file restored at their path is uploaded
+        again to clear the mark, and they are already known to be gone.
+        """
+        self._conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS remote ("
+            "full_path TEXT PRIMARY KEY, md5 TEXT, hash_algo TEXT, size INTEGER, mtime REAL)"
+        )
+        self._conn.execute("DELETE FROM remote")
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO remote VALUES (?, ?, ?, ?, ?)",
+            ((row["full_path"], row.get("md5"), row.get("hash_algo") or DEFAULT_HASH_ALGO,
+              row.get("size"), row.get("mtime")) for row in rows if not row.get("vanished_at")),
+        )
+
+    def delta(self, host: str) -> Iterator[FileModel]:
+        """Yields the records of host that are missing from or differ on the server."""
+        columns = ", ".join(f"f.{column}" for column in self.COLUMNS)
+        cursor = self._conn.execute(
+            f"SELECT {columns} FROM files f LEFT JOIN remote r ON r.full_path = f.full_path "
+            "WHERE f.host = ? AND (r.full_path IS NULL OR r.md5 IS NOT f.md5 "
+            "OR r.hash_algo IS NOT f.hash_algo OR r.size IS NOT f.size OR r.mtime IS NOT f.mtime)",
+            (host,),
+        )
+        for row in cursor:
+            yield FileModel(**dict(zip(self.COLUMNS, row)), duplicate_status=DuplicateStatus.NONE)
+
+    def vanished(self, host: str) -> int:
+        """Counts server records under the manifest's roots that the manifest no longer has."""
+        return self._conn.execute(
+            "SELECT COUNT(*) FROM remote r WHERE NOT EXISTS "
+            "(SELECT 1 FROM files f WHERE f.host = ? AND f.full_path = r.full_path)",
+            (host,),
+        ).fetchone()[0]
+
+    def commit(self) -> None:
+        self._conn.commit()
+        self._uncommitted = 0
+
+    def close(self) -> None:
+        self.commit()
+        self._conn.close()
+
+class ScanSnapshot:
+    """What the last successful scan of a root saw: directory mtimes and file stat tuples.
+
+    A rescan reuses the stored listing of every directory whose mtime is unchanged, since
+    adding, removing or renaming an entry updates it, and skips files whose size, mtime
+    and inode are unchanged. Nothing changes until update() is called after a scan.
+    """
+
+    SCHEMA_VERSION = 1
+
+    def __init__(self, db_path: Path, root: Path):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.root = str(root)
+        # Read by the walker, which runs in a worker thread when hashing is pipelined
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Losing it only costs one full rescan, so an outdated layout is simply rebuilt
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] != self.SCHEMA_VERSION:
+            self._conn.execute("DROP TABLE IF EXISTS dirs")
+            self._conn.execute("DROP TABLE IF EXISTS files")
+            self._conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS dirs ("
+            "root TEXT NOT NULL, path TEXT NOT NULL, parent TEXT NOT NULL, mtime_ns INTEGER NOT NULL, "
+            "PRIMARY KEY (root, path))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (root, parent)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "root TEXT NOT NULL, path TEXT NOT NULL, dir TEXT NOT NULL, size INTEGER NOT NULL, "
+            "mtime_ns INTEGER NOT NULL, ino INTEGER NOT NULL, digest TEXT, PRIMARY KEY (root, path))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS files_dir ON files (root, dir)")
+        self._conn.commit()
+
+    def dir_mtime(self, directory: Path) -> Optional[int]:
+        row = self._conn.execute(
+            "SELECT mtime_ns FROM dirs WHERE root = ? AND path = ?", (self.root, str(directory))
+        ).fetchone()
+        return row[0] if row else None
+
+    def subdirs(self, directory: Path) -> List[str]:
+        rows = self._conn.execute(
+            "SELECT path FROM dirs WHERE root = ? AND parent = ?", (self.root, str(directory))
+        )
+        return [Path(path).name for (path,) in rows]
+
+    def files(self, directory: Path) -> Dict[str, tuple[int, int, int, Optional[str]]]:
+        """Maps each file name stored for directory to its (size, mtime_ns, inode, digest)."""
+        rows = self._conn.execute(
+            "SELECT path, size, mtime_ns, ino, digest FROM files WHERE root = ? AND dir = ?",
+            (self.root, str(directory)),
+        )
+        return {Path(path).name: tuple(row) for path, *row in rows}
+
+    def _under(self, column: str, directory: Path) -> tuple[str, tuple]:
+        """SQL condition and parameters matching directory and everything below it."""
+        prefix = os.path.join(str(directory), "")
+        return f"root = ? AND ({column} = ? OR substr({column}, 1, ?) = ?)", \
+            (self.root, str(directory), len(prefix), prefix)
+
+    def update(self, dirs: Dict[Path, tuple[int, List[str]]], removed_dirs: Iterable[Path],
+               files: Dict[Path, tuple[int, int, int, Optional[str]]], removed_files: Iterable[Path]) -> None:
+        """Records the changes of a finished scan in one transaction.
+
+        dirs maps each relisted directory to its (mtime_ns, subdirectory names); files maps
+        each new or modified file to its (size, mtime_ns, inode, digest).
+        """
+        with self._conn:
+            for directory in removed_dirs:
+                for table, column in (("dirs", "path"), ("files", "dir")):
+                    condition, params = self._under(column, directory)
+                    self._conn.execute(f"DELETE FROM {table} WHERE {condition}", params)
+            self._conn.executemany(
+                "DELETE FROM files WHERE root = ? AND path = ?",
+                ((self.root, str(path)) for path in removed_files),
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO dirs (root, path, parent, mtime_ns) VALUES (?, ?, ?, ?)",
+                ((self.root, str(directory), str(directory.parent), mtime_ns)
+                 for directory, (mtime_ns, _) in dirs.items()),
+            )
+            # Subdirectories not visited this scan (pruned or skipped) get an mtime that never
+            # matches, so the next scan still finds and lists them
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO dirs (root, path, parent, mtime_ns) VALUES (?, ?, ?, -1)",
+                ((self.root, str(directory / name), str(directory))
+                 for directory, (_, subdirs) in dirs.items() for name in subdirs),
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO files (root, path, dir, size, mtime_ns, ino, digest) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ((self.root, str(path), str(path.parent), *values) for path, values in files.items()),
+            )
+
+    def close(self) -> None:
+        self._conn.close()
+
 def get_retrying_session() -> requests.Session:
     """Creates a session with exponential backoff retries for 5xx errors."""
     session = requests.Session()
@@ -101,53 +665,406 @@ def get_retrying_session() -> requests.Session:
     session.mount("https://", HTTPAdapter(max_retries=retries))
     return session
 
-def execute_action(action: str, args: str, current_path: Path, force: bool) -> bool:
-    """Executes local file operations requested by the server."""
-    try:
-        match action.lower():
-            case "cp":
-                dest = Path(args)
-                dest.parent.mkdir(parents=True, exist_ok=True)
-                shutil.copy2(current_path, dest)
-                logging.info(f"ACTION: Copied {current_path.name} to {dest}")
-                return True
-            case "mv":
-                dest = Path(args)
-                dest.parent.mkdir(parents=True, exist_ok=True)
-                shutil.move(str(current_path), str(dest))
-                logging.info(f"ACTION: Moved {current_path.name} to {dest}")
-                return True
-            case "rm":
-                if not force:
-                    confirm = input(f"CONFIRM: Delete {current_path}? (y/N): ")
-                    if confirm.lower() != 'y':
-                        logging.info(f"ACTION: Skipped deletion of {current_path.name}")
-                        return False
-                current_path.unlink()
-                logging.info(f"ACTION: Removed {current_path.name}")
-                return True
-            case "marked_for_deletion":
-                marker_file = current_path.parent / "MARKED_FOR_DELETION"
-                marker_file.touch(exist_ok=True)
-                logging.info(f"ACTION: Created marker file {marker_file}")
-                return True
+# Exceptions that count as a failed network operation for either transport
+NETWORK_ERRORS = (requests.exceptions.RequestException, httpx.HTTPError, json.JSONDecodeError)
+
+class SessionTransport:
+    """Awaitable facade over the blocking retrying session; requests run one at a time."""
+
+    def __init__(self, session: requests.Session, headers: Dict[str, str]):
+        self.session = session
+        self.headers = headers
+
+    async def get(self, url: str, params: Optional[Dict[str, str]] = None, timeout: float = 10) -> requests.Response:
+        return self.session.get(url, params=params, headers=self.headers, timeout=timeout)
+
+    async def post(self, url: str, json: Any = None, timeout: float = 10) -> requests.Response:
+        return self.session.post(url, json=json, headers=self.headers, timeout=timeout)
+
+    async def aclose(self) -> None:
+        pass
+
+class AsyncTransport:
+    """httpx.AsyncClient with pooled keep-alive connections and the session's retry policy.
+
+    HTTP/2 is used when the h2 package is installed (uv sync --extra http2). Like
+    get_retrying_session, 5xx responses and transport errors are retried with exponential backoff.
+    """
+
+    RETRY_STATUSES = {500, 502, 503, 504}
+
+    def __init__(self, headers: Dict[str, str], max_connections: int, retries: int = 3,
+                 backoff_factor: float = 1.0, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.client = httpx.AsyncClient(
+            http2=h2 is not None,
+            headers={"X-Client-Version": VERSION, **headers},
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            transport=transport,
+        )
+
+    async def _send(self, method: str, url: str, timeout: float, **kwargs) -> httpx.Response:
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self.backoff_factor * (2 ** attempt))
+            try:
+                response = await self.client.request(method, url, timeout=timeout, **kwargs)
+            except httpx.TransportError:
+                if attempt == self.retries:
+                    raise
+                continue
+            if response.status_code not in self.RETRY_STATUSES or attempt == self.retries:
+                return response
+
+    async def get(self, url: str, params: Optional[Dict[str, str]] = None, timeout: float = 10) -> httpx.Response:
+        return await self._send("GET", url, timeout, params=params)
+
+    async def post(self, url: str, json: Any = None, timeout: float = 10) -> httpx.Response:
+        return await self._send("POST", url, timeout, json=json)
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+class Policy:
+    """Decides what happens wherever a scan would otherwise stop to prompt.
+
+    Events and their decisions:
+      previously_scanned  - skip (the directory) | continue | ask
+      marked_for_deletion - delete (the marker, then scan) | skip | confirm | ask
+      rm                  - delete | skip | confirm | ask
+    "confirm" defers the deletion to a review after the scan (see review_deferred) and
+    leaves things as they are meanwhile. Rules match the full path against a glob
+    pattern; the first matching rule that names the event wins, else the default
+    applies. Without a terminal, "ask" becomes "continue" for previously scanned
+    files and "confirm" otherwise, so an unattended scan never blocks.
+    """
+
+    EVENTS = {
+        "previously_scanned": {"skip", "continue", "ask"},
+        "marked_for_deletion": {"delete", "skip", "confirm", "ask"},
+        "rm": {"delete", "skip", "confirm", "ask"},
+    }
+
+    def __init__(self, defaults: Optional[Dict[str, str]] = None,
+                 rules: Optional[List[Dict[str, str]]] = None, interactive: bool = True):
+        self.defaults = defaults or {}
+        self.rules = rules or []
+        self.interactive = interactive
+        self.deferred: List[Dict[str, Any]] = []
+        for rule in [self.defaults, *self.rules]:
+            for event, decision in rule.items():
+                if event == "pattern":
+                    continue
+                if decision not in self.EVENTS.get(event, ()):
+                    raise ValueError(f"Invalid policy: {event} = {decision!r}")
+        if any("pattern" not in rule for rule in self.rules):
+            raise ValueError("Invalid policy: every rule needs a pattern")
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], interactive: bool) -> "Policy":
+        """Builds the policy from the [policy] table of the config file."""
+        defaults = {event: decision for event, decision in config.items() if event != "rules"}
+        return cls(defaults, config.get("rules", []), interactive)
+
+    def decide(self, event: str, path: Path) -> str:
+        for rule in self.rules:
+            if event in rule and fnmatch.fnmatch(str(path), rule["pattern"]):
+                decision = rule[event]
+                break
+        else:
+            decision = self.defaults.get(event, "ask")
+        if decision == "ask" and not self.interactive:
+            return "continue" if event == "previously_scanned" else "confirm"
+        return decision
+
+    def defer(self, event: str, path: Path) -> None:
+        """Queues the deletion of path for review, with its stat to detect later changes."""
+        try:
+            st = os.stat(path)
+            size, mtime_ns = st.st_size, st.st_mtime_ns
+        except OSError:
+            size, mtime_ns = None, None
+        self.deferred.append({"event": event, "path": str(path), "size": size, "mtime_ns": mtime_ns})
+        logging.info(f"Deferred {event} of {path} for review")
+
+ACTIONS = {"cp", "mv", "rm", "marked_for_deletion"}
+
+def confirm_delete(current_path: Path, force: bool, policy: Optional[Policy] = None) -> bool:
+    """Whether an rm action may delete current_path: force, or else policy (by default, the user is asked)."""
+    policy = policy or Policy()
+    decision = "delete" if force else policy.decide("rm", current_path)
+    if decision == "ask":
+        confirm = input(f"CONFIRM: Delete {current_path}? (y/N): ")
+        decision = "delete" if confirm.lower() == 'y' else "skip"
+    if decision == "confirm":
+        policy.defer("rm", current_path)
+    elif decision != "delete":
+        logging.info(f"ACTION: Skipped deletion of {current_path.name}")
+    return decision == "delete"
+
+def perform_action(action: str, args: str, current_path: Path, resumed: bool = False) -> None:
+    """Runs one local file operation requested by the server; raises on failure.
+
+    A resumed action may already have taken effect before a crash, so a missing
+    source is only an error if the outcome is not there either.
+    """
+    match action.lower():
+        case "cp":
+            dest = Path(args)
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(current_path, dest)
+            logging.info(f"ACTION: Copied {current_path.name} to {dest}")
+        case "mv":
+            dest = Path(args)
+            if resumed and not os.path.lexists(current_path) and dest.exists():
+                return
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            # A rename on the same device, a copy and delete across devices
+            shutil.move(str(current_path), str(dest))
+            logging.info(f"ACTION: Moved {current_path.name} to {dest}")
+        case "rm":
+            current_path.unlink(missing_ok=resumed)
+            logging.info(f"ACTION: Removed {current_path.name}")
+        case "marked_for_deletion":
+            marker_file = current_path.parent / MARKER_FILE
+            marker_file.touch(exist_ok=True)
+            logging.info(f"ACTION: Created marker file {marker_file}")
+        case _:
+            raise ValueError(f"Unknown action {action}")
+
+def execute_action(action: str, args: str, current_path: Path, force: bool,
+                   policy: Optional[Policy] = None) -> bool:
+    """Executes a local file operation requested by the server, right away.
+
+    Deletions follow policy (see confirm_delete). Scans collect their actions in an
+    ActionJournal and run them together instead (see run_action_plan).
+    """
+    if action.lower() not in ACTIONS:
         return False
+    try:
+        if action.lower() == "rm" and not confirm_delete(current_path, force, policy):
+            return False
+        perform_action(action, args, current_path)
+        return True
     except Exception as e:
         logging.error(f"Action {action} failed for {current_path.name}: {e}")
         return False
 
+class ActionJournal:
+    """Crash-safe SQLite log of the remote actions a scan planned, and their outcomes.
+
+    Actions are journaled as planned while the scan runs, and a whole batch is marked
+    running in one commit before any of it executes. After a crash the next run
+    resumes every action not known to be finished, tolerating those that had already
+    taken effect. Outcomes are kept until the server has acknowledged them. Without a
+    db_path the journal lives in memory and lasts one scan.
+    """
+
+    COMMIT_INTERVAL = 1000
+
+    def __init__(self, db_path: Optional[Path] = None):
+        if db_path is not None:
+            db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(db_path) if db_path else ":memory:")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS actions ("
+            "id INTEGER PRIMARY KEY, host TEXT, path TEXT NOT NULL, action TEXT NOT NULL, "
+            "args TEXT NOT NULL DEFAULT '', status TEXT NOT NULL DEFAULT 'planned', error TEXT, "
+            "UNIQUE (host, path, action, args))"
+        )
+        self._conn.commit()
+        self._uncommitted = 0
+
+    def plan(self, host: str, path: Path, action: str, args: Optional[str]) -> None:
+        # An identical action still in the journal is not planned twice
+        self._conn.execute(
+            "INSERT OR IGNORE INTO actions (host, path, action, args) VALUES (?, ?, ?, ?)",
+            (host, str(path), action.lower(), args or ""),
+        )
+
+    def pending(self) -> List[tuple[int, str, str, str, bool]]:
+        """(id, path, action, args, resumed) of every action not yet finished."""
+        rows = self._conn.execute(
+            "SELECT id, path, action, args, status = 'running' FROM actions "
+            "WHERE status IN ('planned', 'running') ORDER BY id"
+        ).fetchall()
+        return [(row_id, path, action, args, bool(resumed)) for row_id, path, action, args, resumed in rows]
+
+    def start(self, ids: List[int]) -> None:
+        self._conn.executemany("UPDATE actions SET status = 'running' WHERE id = ?", ((i,) for i in ids))
+        self._conn.commit()
+
+    def finish(self, row_id: int, error: Optional[str]) -> None:
+        self._conn.execute(
+            "UPDATE actions SET status = ?, error = ? WHERE id = ?",
+            (ActionStatus.FAILED.value if error else ActionStatus.DONE.value, error, row_id),
+        )
+        self._uncommitted += 1
+        if self._uncommitted >= self.COMMIT_INTERVAL:
+            self.commit()
+
+    def outcomes(self, limit: int) -> List[tuple[int, str, str, str, str, str, Optional[str]]]:
+        """(id, host, path, action, args, status, error) of up to limit finished actions."""
+        return self._conn.execute(
+            "SELECT id, host, path, action, args, status, error FROM actions "
+            "WHERE status IN ('done', 'failed') ORDER BY id LIMIT ?", (limit,)
+        ).fetchall()
+
+    def acknowledged(self, ids: List[int]) -> None:
+        """Drops outcomes the server has recorded."""
+        self._conn.executemany("DELETE FROM actions WHERE id = ?", ((i,) for i in ids))
+        self._conn.commit()
+
+    def commit(self) -> None:
+        self._conn.commit()
+        self._uncommitted = 0
+
+    def close(self) -> None:
+        self._conn.commit()
+        self._conn.close()
+
+def same_device(source: Path, dest: Path) -> bool:
+    """Whether dest (or its nearest existing parent) is on the same device as source."""
+    try:
+        device = os.stat(source).st_dev
+        target = dest
+        while not os.path.exists(target) and target.parent != target:
+            target = target.parent
+        return os.stat(target).st_dev == device
+    except OSError:
+        return False
+
+def run_action_plan(journal: ActionJournal, workers: int = 4) -> Counter:
+    """Executes the journal's pending actions and records their outcomes.
+
+    Same-device moves are plain renames, metadata-only and cheap, so they run in order
+    on the calling thread. Copies, cross-device moves and deletions run on a pool of
+    workers. Returns the number of actions done and failed.
+    """
+    counts = Counter(done=0, failed=0)
+    entries = journal.pending()
+    if not entries:
+        return counts
+    journal.start([entry[0] for entry in entries])
+
+    def run(entry: tuple[int, str, str, str, bool]) -> Optional[str]:
+        _, path, action, args, resumed = entry
+        try:
+            perform_action(action, args, Path(path), resumed)
+            return None
+        except Exception as e:
+            logging.error(f"Action {action} failed for {Path(path).name}: {e}")
+            return str(e) or type(e).__name__
+
+    def record(entry: tuple[int, str, str, str, bool], error: Optional[str]) -> None:
+        journal.finish(entry[0], error)
+        counts["failed" if error else "done"] += 1
+
+    renames = [entry for entry in entries if entry[2] == "mv" and same_device(Path(entry[1]), Path(entry[3]))]
+    rename_ids = {entry[0] for entry in renames}
+    others = [entry for entry in entries if entry[0] not in rename_ids]
+    try:
+        for entry in renames:
+            record(entry, run(entry))
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for entry, error in zip(others, pool.map(run, others)):
+                record(entry, error)
+    finally:
+        journal.commit()
+    return counts
+
+def report_action_outcomes(session: requests.Session, api_url: str, headers: Dict[str, str],
+                           journal: ActionJournal, chunk_size: int = 1000) -> bool:
+    """Posts the journal's finished actions to the server in bulk, dropping acknowledged ones.
+
+    Returns False if some could not be reported; they stay journaled for the next run.
+    """
+    report_url = f"{api_url.rstrip('/')}/actions/report"
+    while rows := journal.outcomes(chunk_size):
+        reports = [
+            {"host": host, "full_path": path, "action": action, "action_args": args or None,
+             "status": status, "error": error}
+            for _, host, path, action, args, status, error in rows
+        ]
+        try:
+            res = session.post(report_url, json=reports, headers=headers, timeout=60)
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Network error while reporting {len(reports)} action outcomes: {e}")
+            return False
+        if res.status_code != 200:
+            logging.error(f"Reporting {len(reports)} action outcomes failed (HTTP {res.status_code})")
+            return False
+        journal.acknowledged([row[0] for row in rows])
+    return True
+
+def review_deferred(deferred: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Asks about each deferred deletion and carries out the confirmed ones.
+
+    A file that changed since it was deferred is not deleted. Returns the entries
+    that were neither confirmed nor rejected (EOF on stdin stops the review).
+    """
+    for index, entry in enumerate(deferred):
+        path = Path(entry["path"])
+        prompt = f"Delete {path}" if entry["event"] == "rm" else f"Remove the deletion marker of {path.parent}"
+        try:
+            answer = input(f"CONFIRM: {prompt}? (y/N/q): ").lower()
+        except EOFError:
+            answer = "q"
+        if answer == "q":
+            return deferred[index:]
+        if answer != "y":
+            logging.info(f"Rejected deferred {entry['event']} of {path}")
+            continue
+        try:
+            st = path.stat()
+            if entry["event"] == "rm" and (st.st_size, st.st_mtime_ns) != (entry["size"], entry["mtime_ns"]):
+                logging.warning(f"Not deleting {path}: it changed since the scan")
+                continue
+            path.unlink()
+            logging.info(f"ACTION: Removed {path}")
+        except OSError as e:
+            logging.error(f"Deferred {entry['event']} of {path} failed: {e}")
+    return []
+
+def load_deferred(queue_file: Path) -> List[Dict[str, Any]]:
+    if not queue_file.exists():
+        return []
+    with open(queue_file) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def save_deferred(queue_file: Path, deferred: List[Dict[str, Any]]) -> None:
+    """Rewrites the review queue with deferred, removing the file when it is empty."""
+    if not deferred:
+        queue_file.unlink(missing_ok=True)
+        return
+    queue_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(queue_file, "w") as f:
+        f.writelines(json.dumps(entry) + "\n" for entry in deferred)
+
 def check_duplicate_status(
-    items: List[Dict[str, Any]], filename: str, current_dir: Path, file_path: Path
+    items: List[Dict[str, Any]], filename: str, current_dir: Path, file_path: Path,
+    host: Optional[str] = None
 ) -> DuplicateStatus:
-    """Determines the duplicate status of a file based on API response."""
+    """Determines the duplicate status of a file based on API response.
+
+    A record only counts as this file if it has the same path on the same host;
+    records without a host predate host tracking and match any host.
+    """
     full_path_str = str(file_path)
     for item in items:
-        if item.get("full_path") == full_path_str:
+        if item.get("full_path") == full_path_str and item.get("host") in (None, host):
             return DuplicateStatus.PREVIOUSLY_SCANNED
         if item.get("name") == filename and item.get("parent_dir") == current_dir.name:
             return DuplicateStatus.DUPLICATE
     return DuplicateStatus.DUPLICATE_CONTENTS
 
+def live_records(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Drops records of deleted copies, which servers before the vanished filter still return."""
+    return [item for item in items if not item.get("vanished_at")]
+
 def check_server_compatibility(session: requests.Session, base_url: str) -> bool:
     """Checks if the server version is compatible with the client."""
     # Assume base_url is something like http://api.example.com/api/v1/files
@@ -178,10 +1095,554 @@ def check_server_compatibility(session: requests.Session, base_url: str) -> bool
         logging.warning(f"Error checking server version: {e}")
         return True
 
+_PIPELINE_DONE = object()
+
+def hash_pipeline(paths: Iterable[Path], workers: int, queue_depth: int,
+                  use_processes: bool = False,
+                  hash_cache: Optional[HashCache] = None,
+                  hash_file: Callable[[Path], Optional[str]] = get_md5) -> Iterator[tuple[Path, Optional[str]]]:
+    """Hashes paths on a pool of workers connected by bounded queues.
+
+    A walker thread drains paths into one queue, worker threads hash them (in a
+    process pool when use_processes is set) and the caller consumes (path, digest)
+    pairs from a second queue in completion order. hash_file must be picklable
+    for the process pool. Closing the generator stops
+    every stage. Cache lookups happen in the worker threads, so cached files never
+    reach the process pool.
+    """
+    path_queue: queue.Queue = queue.Queue(maxsize=queue_depth)
+    result_queue: queue.Queue = queue.Queue(maxsize=queue_depth)
+    stop = threading.Event()
+    errors: List[BaseException] = []
+    executor = ProcessPoolExecutor(max_workers=workers) if use_processes else None
+
+    def put(q: queue.Queue, item: Any) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(q: queue.Queue) -> Any:
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _PIPELINE_DONE
+
+    def walker() -> None:
+        try:
+            for path in paths:
+                if not put(path_queue, path):
+                    return
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            for _ in range(workers):
+                put(path_queue, _PIPELINE_DONE)
+
+    def hash_in_pool(path: Path) -> Optional[str]:
+        return executor.submit(hash_file, path).result()
+
+    def hasher() -> None:
+        while (path := get(path_queue)) is not _PIPELINE_DONE:
+            try:
+                md5_hash = get_cached_md5(path, hash_cache, hash_in_pool if executor else hash_file)
+            except Exception as e:
+                logging.debug(f"Could not hash {path}: {e}")
+                md5_hash = None
+            if not put(result_queue, (path, md5_hash)):
+                return
+        put(result_queue, _PIPELINE_DONE)
+
+    threads = [threading.Thread(target=walker, daemon=True)]
+    threads += [threading.Thread(target=hasher, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        finished = 0
+        while finished < workers:
+            item = result_queue.get()
+            if item is _PIPELINE_DONE:
+                finished += 1
+                continue
+            yield item
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        if executor:
+            executor.shutdown(cancel_futures=True)
+    if errors:
+        raise errors[0]
+
+async def lookup_md5_batch(transport: SessionTransport | AsyncTransport, api_url: str,
+                           md5s: List[str], hash_algo: str = DEFAULT_HASH_ALGO):
+    """Validates a batch of hashes with a single request to the lookup endpoint."""
+    lookup_url = f"{api_url.rstrip('/')}/lookup"
+    payload = {"md5s": sorted(set(md5s)), "hash_algo": hash_algo}
+    return await transport.post(lookup_url, json=payload, timeout=30)
+
+def lookup_sizes(session: requests.Session, api_url: str, headers: Dict[str, str],
+                 sizes: Iterable[int], chunk_size: int = 10000) -> Optional[set[int]]:
+    """Returns which sizes are already indexed on the server, or None if the lookup failed."""
+    sizes_url = f"{api_url.rstrip('/')}/sizes"
+    unique_sizes = sorted(set(sizes))
+    found: set[int] = set()
+    try:
+        for start in range(0, len(unique_sizes), chunk_size):
+            res = session.post(sizes_url, json={"sizes": unique_sizes[start:start + chunk_size]},
+                               headers=headers, timeout=30)
+            if res.status_code != 200:
+                logging.warning(f"Size lookup failed (HTTP {res.status_code})")
+                return None
+            found.update(res.json().get("sizes", []))
+    except requests.exceptions.RequestException as e:
+        logging.warning(f"Network error during size lookup: {e}")
+        return None
+    return found
+
+def merkle_hashes(tree: Dict[Path, Optional[tuple[List[str], List[str]]]], digests: Dict[Path, str],
+                  hash_algo: str = DEFAULT_HASH_ALGO) -> Dict[Path, tuple[str, int, int]]:
+    """Computes a bottom-up Merkle hash for every fully hashed directory of a walk.
+
+    tree maps each walked directory to its (file names, subdirectory names), or None if
+    it was pruned. A directory hashes the sorted names and digests of its files together
+    with the names and hashes of its subdirectories, so identical subtrees hash alike
+    wherever they live. A directory with an unhashed file or subdirectory gets no hash.
+    Returns (hash, file count, total size) for each hashed directory.
+    """
+    hashes: Dict[Path, tuple[str, int, int]] = {}
+    # Deepest first, so every subdirectory is done before its parent
+    for directory in sorted(tree, key=lambda d: len(d.parts), reverse=True):
+        listing = tree[directory]
+        if listing is None:
+            continue
+        files, subdirs = listing
+        entries = []
+        file_count = total_size = 0
+        try:
+            for name in files:
+                file_path = directory / name
+                entries.append((os.fsencode(name), b"f", digests[file_path]))
+                file_count += 1
+                total_size += file_path.stat().st_size
+            for name in subdirs:
+                digest, sub_count, sub_size = hashes[directory / name]
+                entries.append((os.fsencode(name), b"d", digest))
+                file_count += sub_count
+                total_size += sub_size
+        except (KeyError, OSError):
+            continue
+
+        hasher = HASH_ALGORITHMS[hash_algo]()
+        for name, kind, digest in sorted(entries):
+            hasher.update(b"%s\0%s\0%s\n" % (kind, name, digest.encode()))
+        hashes[directory] = (hasher.hexdigest(), file_count, total_size)
+    return hashes
+
+async def submit_directories_bulk(transport: SessionTransport | AsyncTransport, api_url: str,
+                                  docs: List[Dict[str, Any]]):
+    """Posts a batch of DirectoryModel documents to the directories bulk endpoint."""
+    # api_url points at the files collection; directories live next to it
+    bulk_url = f"{api_url.rstrip('/').rsplit('/', 1)[0]}/directories/bulk"
+    return await transport.post(bulk_url, json=docs, timeout=60)
+
+async def submit_records_bulk(transport: SessionTransport | AsyncTransport, api_url: str,
+                              docs: List[Dict[str, Any]]):
+    """Posts a batch of FileModel documents with a single request to the bulk endpoint."""
+    bulk_url = f"{api_url.rstrip('/')}/bulk"
+    return await transport.post(bulk_url, json=docs, timeout=60)
+
+def build_file_model(file_path: Path, digest: str, hash_algo: str, host: str,
+                     duplicate_status: DuplicateStatus = DuplicateStatus.NONE) -> FileModel:
+    """Builds the record of a hashed file; raises OSError if it has since disappeared."""
+    st = file_path.stat()
+    return FileModel(
+        name=file_path.name,
+        size=st.st_size,
+        kind=file_path.suffix.lower() or "file",
+        md5=digest,
+        hash_algo=hash_algo,
+        parent_dir=file_path.parent.name,
+        full_path=str(file_path),
+        host=host,
+        mtime=st.st_mtime,
+        duplicate_status=duplicate_status,
+    )
+
+def fetch_remote_records(session: requests.Session, api_url: str, headers: Dict[str, str],
+                         host: str, roots: List[Path]) -> Iterator[Dict[str, Any]]:
+    """Streams the server's records of host under roots, with just the fields a sync compares."""
+    params = {
+        # Quoted, so the server's query parser reads the host as a string
+        "host_eq": json.dumps(host),
+        "fields": "full_path,md5,hash_algo,size,mtime,vanished_at",
+        "format": "ndjson",
+    }
+    with session.get(api_url, params=params, headers=headers, stream=True, timeout=60) as res:
+        res.raise_for_status()
+        for line in res.iter_lines():
+            if not line:
+                continue
+            record = json.loads(line)
+            if any(Path(record["full_path"]).is_relative_to(root) for root in roots):
+                yield record
+
+def sync_manifest(manifest: Manifest, api_url: str, token: Optional[str],
+                  chunk_size: int = 10000) -> Optional[Counter]:
+    """Uploads the manifest records that are missing from or differ on the server.
+
+    The server's records for each scanned host are streamed into the manifest database and
+    compared there, so neither side is held in memory; only the delta is posted, chunk_size
+    records per bulk request. Returns the counts, or None if the server could not be read.
+    """
+    session = get_retrying_session()
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    if not check_server_compatibility(session, api_url):
+        logging.error("Incompatible server version. Aborting sync.")
+        return None
+
+    bulk_url = f"{api_url.rstrip('/')}/bulk"
+    stats = Counter(uploaded=0, failed=0, vanished=0)
+    for host in manifest.hosts():
+        try:
+            manifest.load_remote(fetch_remote_records(session, api_url, headers, host, manifest.roots(host)))
+        except (requests.exceptions.RequestException, json.JSONDecodeError) as e:
+            logging.error(f"Could not read the server's records for {host}: {e}")
+            return None
+
+        delta = manifest.delta(host)
+        while batch := [file_model.model_dump(mode='json') for file_model in itertools.islice(delta, chunk_size)]:
+            try:
+                res = session.post(bulk_url, json=batch, headers=headers, timeout=120)
+                if res.status_code != 200:
+                    logging.error(f"Upload of {len(batch)} records failed (HTTP {res.status_code})")
+                    stats["failed"] += len(batch)
+                    continue
+                errors = res.json().get("errors", [])
+            except requests.exceptions.RequestException as e:
+                logging.error(f"Network error during upload of {len(batch)} records: {e}")
+                stats["failed"] += len(batch)
+                continue
+            for error in errors:
+                logging.error(f"Failed to upload {batch[error['index']]['full_path']}: {error['error']}")
+            stats["uploaded"] += len(batch) - len(errors)
+            stats["failed"] += len(errors)
+
+        stats["vanished"] += manifest.vanished(host)
+
+    logging.info(f"Sync complete: {stats['uploaded']} uploaded, {stats['failed']} failed")
+    if stats["vanished"]:
+        logging.info(f"{stats['vanished']} server records are no longer in the manifest")
+    return stats
+
+class Inotify:
+    """Minimal ctypes binding of the Linux inotify API, so watch mode needs no extra package."""
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+    # Files are only hashed once written and closed, never mid-write
+    WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+
+    _EVENT = struct.Struct("iIII")
+
+    def __init__(self):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path: Path) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), self.WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), str(path))
+        return wd
+
+    def rm_watch(self, wd: int) -> None:
+        # Fails harmlessly if the kernel already dropped the watch with its directory
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout: float) -> List[tuple[int, int, str]]:
+        """Returns the (wd, mask, name) events that arrive within timeout seconds."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = self._EVENT.unpack_from(data, offset)
+            offset += self._EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+class DirectoryWatcher:
+    """Keeps the server's records of a directory tree current from inotify events.
+
+    Events are coalesced per path: a file written many times is hashed once, and one
+    created then deleted is never hashed. Pending changes are pushed in batches once
+    no event arrived for debounce seconds, or at the latest after max_delay seconds.
+    Only records are indexed; duplicate statuses and remote actions need a full scan.
+    """
+
+    def __init__(self, target_dir: str, api_url: str, token: Optional[str], excludes: List[str],
+                 hash_algo: str = DEFAULT_HASH_ALGO, hasher: Optional[Callable[[Path], Optional[str]]] = None,
+                 hash_cache: Optional[HashCache] = None, debounce: float = 2.0, max_delay: float = 30.0,
+                 batch_size: int = 1000):
+        self.root = Path(target_dir).resolve()
+        self.api_url = api_url
+        self.excludes = ExcludeRules(excludes)
+        self.hash_algo = hash_algo
+        self.hasher = hasher or partial(get_file_hash, algo=hash_algo)
+        self.hash_cache = hash_cache
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.batch_size = batch_size
+        self.hostname = socket.gethostname()
+        self.session = get_retrying_session()
+        self.headers = {"Content-Type": "application/json"}
+        if token:
+            self.headers["Authorization"] = f"Bearer {token}"
+        self.stats = Counter(events=0, indexed=0, vanished=0, failed=0)
+        # File path -> True if it changed, False if it went away
+        self.pending: Dict[Path, bool] = {}
+        self.removed_dirs: set[Path] = set()
+        # Files that did not exist when the window opened; if deleted again, nothing is pushed
+        self.created: set[Path] = set()
+        self.first_event = self.last_event = 0.0
+        self.watches: Dict[int, Path] = {}
+        self.inotify = Inotify()
+        self.add_tree(self.root)
+
+    def add_tree(self, directory: Path) -> List[Path]:
+        """Watches directory and its subdirectories; returns the files found below it."""
+        found = []
+        stack = [directory]
+        while stack:
+            current_dir = stack.pop()
+            try:
+                self.watches[self.inotify.add_watch(current_dir)] = current_dir
+                files, subdirs, _ = scan_directory(current_dir, self.root, self.excludes)
+            except OSError as e:
+                logging.warning(f"Could not watch {current_dir}: {e}")
+                continue
+            # Plain paths: by the time they are flushed, the listing's stat results are stale
+            found.extend(map(Path, files))
+            stack.extend(current_dir / name for name in subdirs)
+        return found
+
+    def drop_tree(self, directory: Path) -> None:
+        """Stops watching a directory that was deleted or moved away, and its subdirectories."""
+        for wd, path in list(self.watches.items()):
+            if path.is_relative_to(directory):
+                self.inotify.rm_watch(wd)
+                del self.watches[wd]
+
+    def poll(self, timeout: float) -> None:
+        """Reads the events arriving within timeout seconds into the pending changes."""
+        events = self.inotify.read(timeout)
+        for wd, mask, name in events:
+            if mask & Inotify.IN_Q_OVERFLOW:
+                # Events were lost, so everything below the root may have changed
+                logging.warning("inotify queue overflowed; re-reading the whole tree")
+                self.drop_tree(self.root)
+                self.pending.update(dict.fromkeys(self.add_tree(self.root), True))
+                continue
+            if mask & Inotify.IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            directory = self.watches.get(wd)
+            if directory is None or not name:
+                continue
+            path = directory / name
+            rel_dir = str(directory.relative_to(self.root)) if directory != self.root else ""
+            if name == MARKER_FILE or self.excludes.matches(name, rel_dir):
+                continue
+            if mask & Inotify.IN_ISDIR:
+                if mask & (Inotify.IN_CREATE | Inotify.IN_MOVED_TO):
+                    self.removed_dirs.discard(path)
+                    self.pending.update(dict.fromkeys(self.add_tree(path), True))
+                elif mask & (Inotify.IN_DELETE | Inotify.IN_MOVED_FROM):
+                    self.drop_tree(path)
+                    self.removed_dirs.add(path)
+            elif mask & Inotify.IN_CREATE:
+                if path not in self.pending:
+                    self.created.add(path)
+                continue
+            elif mask & (Inotify.IN_CLOSE_WRITE | Inotify.IN_MOVED_TO):
+                self.pending[path] = True
+            elif mask & (Inotify.IN_DELETE | Inotify.IN_MOVED_FROM):
+                if path in self.created:
+                    self.created.discard(path)
+                    self.pending.pop(path, None)
+                else:
+                    self.pending[path] = False
+            else:
+                continue
+            self.stats["events"] += 1
+            now = time.monotonic()
+            if not self.first_event:
+                self.first_event = now
+            self.last_event = now
+
+    def due(self) -> bool:
+        if not self.pending and not self.removed_dirs:
+            return False
+        now = time.monotonic()
+        return now - self.last_event >= self.debounce or now - self.first_event >= self.max_delay
+
+    def flush(self) -> None:
+        """Pushes the pending changes: vanished paths first, then the changed files' records."""
+        pending, self.pending = self.pending, {}
+        removed_dirs, self.removed_dirs = sorted(self.removed_dirs), set()
+        self.created.clear()
+        self.first_event = self.last_event = 0.0
+        docs, gone = [], []
+        for path, changed in pending.items():
+            # The file may have changed again, or gone, since its event
+            if changed and path.is_file():
+                md5_hash = get_cached_md5(path, self.hash_cache, self.hasher)
+                if not md5_hash:
+                    self.stats["failed"] += 1
+                    continue
+                try:
+                    docs.append(build_file_model(path, md5_hash, self.hash_algo, self.hostname).model_dump(mode='json'))
+                except OSError:
+                    gone.append(path)
+            elif not path.exists():
+                gone.append(path)
+        if gone or removed_dirs:
+            self.push_vanished(gone, removed_dirs)
+        for start in range(0, len(docs), self.batch_size):
+            self.push_records(docs[start:start + self.batch_size])
+
+    def requeue(self, paths: Iterable[Path], changed: bool) -> None:
+        """Keeps paths whose push hit a network error pending, to retry with the next flush."""
+        for path in paths:
+            self.pending.setdefault(path, changed)
+        self.first_event = self.last_event = time.monotonic()
+
+    def push_vanished(self, files: List[Path], directories: List[Path]) -> None:
+        vanished_url = f"{self.api_url.rstrip('/')}/vanished"
+        for start in range(0, max(len(files), len(directories)), 10000):
+            batch = files[start:start + 10000]
+            dir_batch = directories[start:start + 10000]
+            body = {"host": self.hostname, "full_paths": [str(path) for path in batch],
+                    "directories": [str(path) for path in dir_batch]}
+            try:
+                res = self.session.post(vanished_url, json=body, headers=self.headers, timeout=60)
+            except requests.exceptions.RequestException as e:
+                logging.error(f"Network error while marking {len(batch) + len(dir_batch)} vanished paths: {e}")
+                self.requeue(batch, False)
+                self.removed_dirs.update(dir_batch)
+                continue
+            if res.status_code != 200:
+                logging.error(f"Marking {len(batch) + len(dir_batch)} vanished paths failed (HTTP {res.status_code})")
+                self.stats["failed"] += len(batch) + len(dir_batch)
+                continue
+            self.stats["vanished"] += len(batch) + len(dir_batch)
+
+    def push_records(self, batch: List[Dict[str, Any]]) -> None:
+        bulk_url = f"{self.api_url.rstrip('/')}/bulk"
+        try:
+            res = self.session.post(bulk_url, json=batch, headers=self.headers, timeout=120)
+            if res.status_code != 200:
+                logging.error(f"Upload of {len(batch)} records failed (HTTP {res.status_code})")
+                self.stats["failed"] += len(batch)
+                return
+            errors = res.json().get("errors", [])
+        except (requests.exceptions.RequestException, json.JSONDecodeError) as e:
+            logging.error(f"Network error during upload of {len(batch)} records: {e}")
+            self.requeue((Path(doc["full_path"]) for doc in batch), True)
+            return
+        for error in errors:
+            logging.error(f"Failed to upload {batch[error['index']]['full_path']}: {error['error']}")
+        self.stats["indexed"] += len(batch) - len(errors)
+        self.stats["failed"] += len(errors)
+
+    def run(self, stop: Optional[threading.Event] = None) -> Counter:
+        """Processes events until stop is set or the process is interrupted."""
+        logging.info(f"Watching {self.root} ({len(self.watches)} directories)")
+        try:
+            while stop is None or not stop.is_set():
+                self.poll(min(self.debounce, 1.0))
+                if self.due():
+                    self.flush()
+        except KeyboardInterrupt:
+            logging.info("Watch interrupted")
+        finally:
+            if self.pending or self.removed_dirs:
+                self.flush()
+        return self.stats
+
+    def close(self) -> None:
+        self.inotify.close()
+        self.session.close()
+
 def process_directory(target_dir: str, api_url: str, token: Optional[str],
-                      dry_run: bool, force: bool, excludes: list[str]) -> None:
-    """Recursively scans directory, validates with API, and posts data."""
+                      dry_run: bool, force: bool, excludes: list[str],
+                      batch_size: int = 0, submit_batch_size: int = 0,
+                      workers: int = 1, queue_depth: int = 1024,
+                      use_processes: bool = False,
+                      hash_cache: Optional[HashCache] = None,
+                      size_prefilter: bool = False, partial_hash_kib: int = 64,
+                      hash_algo: str = DEFAULT_HASH_ALGO, read_buffer_size: int = HASH_BUFFER_SIZE,
+                      mmap_threshold: int = 0, fadvise: bool = True,
+                      async_client: bool = False, max_in_flight: int = 32,
+                      http_transport: Optional[httpx.AsyncBaseTransport] = None,
+                      dir_hashes: bool = False, manifest: Optional[Manifest] = None,
+                      snapshot: Optional[ScanSnapshot] = None, policy: Optional[Policy] = None,
+                      journal: Optional[ActionJournal] = None, action_workers: int = 4) -> None:
+    """Recursively scans directory, validates with API, and posts data.
+
+    With a batch_size greater than zero, hashes are buffered and validated
+    batch_size at a time through the lookup endpoint instead of one GET per file.
+    Likewise a submit_batch_size greater than zero buffers new records and posts
+    them through the bulk endpoint. With more than one worker, hashing runs in a
+    pipeline (see hash_pipeline) while this thread handles the network stage.
+    A hash_cache lets unchanged files skip hashing entirely. With size_prefilter,
+    only files that may have a duplicate are hashed (see select_size_candidates);
+    the others are counted but neither hashed nor posted. Files are hashed with
+    hash_algo and only matched against server records of the same algorithm;
+    read_buffer_size, mmap_threshold and fadvise tune how (see get_file_hash).
+    With async_client, validation and submission go through httpx (see AsyncTransport)
+    with up to max_in_flight files in flight, overlapping with hashing. With dir_hashes,
+    a Merkle hash of every fully hashed directory is posted once the files are done
+    (see merkle_hashes). With a manifest, the scan runs offline: records are written to
+    the manifest instead of the server (see sync_manifest) and no remote actions run.
+    With a snapshot of the previous scan, only new and modified files are processed and
+    deleted ones are reported to the server as vanished (see ScanSnapshot).
+    Prompts are decided by policy (see Policy); deletions it defers are left in
+    policy.deferred for the caller to review. Remote actions are planned in journal
+    while the files are validated, then run on action_workers threads once the scan
+    is done and their outcomes reported to the server (see run_action_plan).
+    """
     root_path = Path(target_dir).resolve()
+    policy = policy or Policy()
+    own_journal = journal is None
+    journal = journal or ActionJournal()
     stats = Counter(
         new=0,
         duplicate_contents=0,
@@ -189,136 +1650,531 @@ def process_directory(target_dir: str, api_url: str, token: Optional[str],
         previously_scanned=0,
         failed=0,
         actions_taken=0,
+        actions_failed=0,
+        unique_size=0,
+        directories=0,
+        recorded=0,
+        unchanged=0,
+        vanished=0,
     )
     skipped_dirs = set()
+    # Directory -> (len(skipped_dirs) when computed, whether it is skipped)
+    skip_cache: Dict[Path, tuple[int, bool]] = {}
+    exclude_rules = ExcludeRules(excludes)
+    # Directory listings seen by the walker and file digests, for the Merkle hashes
+    tree: Dict[Path, Optional[tuple[List[str], List[str]]]] = {}
+    digests: Dict[Path, str] = {}
+    # Incremental rescans: relisted dirs, new or modified files and what was deleted
+    changed_dirs: Dict[Path, tuple[int, List[str]]] = {}
+    changed_files: Dict[Path, tuple[int, int, int]] = {}
+    removed_dirs: List[Path] = []
+    vanished: List[Path] = []
+    hostname = socket.gethostname()
+    pending: List[tuple[Path, str]] = []
+    records: List[tuple[Path, Dict[str, Any]]] = []
     session = get_retrying_session()
 
     headers = {"Content-Type": "application/json"}
     if token:
         headers["Authorization"] = f"Bearer {token}"
 
-    if not root_path.is_dir():
-        logging.error(f"Invalid directory: {root_path}")
-        return
+    transport: SessionTransport | AsyncTransport = SessionTransport(session, headers)
 
-    logging.info(f"Scanning: {root_path} {'(DRY RUN)' if dry_run else ''}")
+    def is_skipped(current_dir: Path) -> bool:
+        """Whether current_dir or any directory above it was skipped.
 
-    if not check_server_compatibility(session, api_url):
-        logging.error("Incompatible server version. Aborting scan.")
-        return
+        Answers are memoized per directory and derived from the parent's, so a check is a
+        dict lookup. skipped_dirs only grows, so an answer computed before its size changed
+        is stale; the walker thread can check while the network stage adds without a lock.
+        """
+        generation = len(skipped_dirs)
+        cached = skip_cache.get(current_dir)
+        if cached is not None and cached[0] == generation:
+            return cached[1]
+        skipped = current_dir in skipped_dirs or (
+            current_dir != root_path and current_dir.parent != current_dir and is_skipped(current_dir.parent)
+        )
+        skip_cache[current_dir] = (generation, skipped)
+        return skipped
 
-    try:
-        for root, dirs, files in os.walk(root_path, topdown=True):
-            if excludes:
-                dirs[:] = [d for d in dirs if d not in excludes]
+    def classify(file_path: Path, items: List[Dict[str, Any]]) -> tuple[DuplicateStatus, str, str]:
+        """Updates stats for a file with matching records and returns its status and remote action."""
+        current_dir = file_path.parent
+        duplicate_status = check_duplicate_status(items, file_path.name, current_dir, file_path, hostname)
+        remote_action = items[0].get("action", "")
+        remote_args = items[0].get("action_args", "")
 
-            current_dir = Path(root)
-            
-            # Check for MARKED_FOR_DELETION file in current directory
-            marker_file = current_dir / "MARKED_FOR_DELETION"
-            if marker_file.exists():
-                if dry_run:
-                    logging.info(f"[DRY-RUN] Would remove marker file and potentially directory: {current_dir}")
-                else:
-                    confirm = input(f"CONFIRM: Directory {current_dir} is MARKED_FOR_DELETION. Delete marker? (y/N): ")
-                    if confirm.lower() == 'y':
-                        marker_file.unlink()
-                        logging.info(f"Removed marker file: {marker_file}")
-                    else:
-                        logging.info(f"Skipping processing for directory {current_dir} as it is marked for deletion")
-                        dirs[:] = []
-                        files[:] = []
-                        continue
+        if duplicate_status == DuplicateStatus.PREVIOUSLY_SCANNED:
+            stats["previously_scanned"] += 1
+            logging.info(f"Previously scanned: {file_path}")
+            if not dry_run:
+                decision = policy.decide("previously_scanned", current_dir)
+                if decision == "ask":
+                    user_input = input(
+                        f"MD5 and full path match for {file_path}. "
+                        "Skip this directory? (y/N): "
+                    )
+                    decision = "skip" if user_input.lower() == "y" else "continue"
+                if decision == "skip":
+                    skipped_dirs.add(current_dir)
+                    logging.info(f"Skipping directory: {current_dir}")
+        elif duplicate_status == DuplicateStatus.DUPLICATE:
+            stats["duplicate"] += 1
+            logging.info(f"Duplicate file: {file_path}")
+        else: # DUPLICATE_CONTENTS
+            stats["duplicate_contents"] += 1
+            logging.info(f"Duplicate contents: {file_path}")
+        return duplicate_status, remote_action, remote_args
 
-            if any(skipped_dir == current_dir or skipped_dir in current_dir.parents for skipped_dir in skipped_dirs):
-                dirs[:] = []
-                files[:] = []
-                continue
+    async def submit(file_path: Path, md5_hash: str, duplicate_status: DuplicateStatus,
+                     remote_action: str, remote_args: str) -> None:
+        """Runs any remote action for a validated file and posts its record."""
+        # 2. Remote Action Planning; the actions run together after the scan
+        if duplicate_status != DuplicateStatus.NONE and remote_action:
+            if dry_run:
+                logging.info(f"[DRY-RUN] Would {remote_action} {file_path.name}")
+            elif remote_action.lower() not in ACTIONS:
+                logging.warning(f"Ignoring unknown action {remote_action} for {file_path.name}")
+            elif remote_action.lower() != "rm" or confirm_delete(file_path, force, policy):
+                journal.plan(hostname, file_path, remote_action, remote_args)
+
+        # 3. Data Submission (POST)
+        if (
+            dry_run
+            # A real check: the path's remembered stat predates any action taken on it
+            or not os.path.exists(file_path)
+            or duplicate_status == DuplicateStatus.PREVIOUSLY_SCANNED
+            or duplicate_status == DuplicateStatus.DUPLICATE
+        ):
+            return
 
-            for filename in files:
-                file_path = current_dir / filename
-                if not file_path.exists():
+        try:
+            file_model = build_file_model(file_path, md5_hash, hash_algo, hostname, duplicate_status)
+            if submit_batch_size > 0:
+                records.append((file_path, file_model.model_dump(mode='json')))
+                if len(records) >= submit_batch_size:
+                    await flush_records()
+                return
+            await transport.post(api_url, json=file_model.model_dump(mode='json'), timeout=10)
+        except (OSError, *NETWORK_ERRORS):
+            stats["failed"] += 1
+
+    async def flush_records() -> None:
+        """Posts all buffered records through the bulk endpoint and logs per-record failures."""
+        buffered = records[:]
+        records.clear()
+
+        # A --submit-batch-size above the server's limit is split into several requests
+        for start in range(0, len(buffered), MAX_BULK_INSERT):
+            batch = buffered[start:start + MAX_BULK_INSERT]
+            try:
+                res = await submit_records_bulk(transport, api_url, [doc for _, doc in batch])
+                if res.status_code != 200:
+                    logging.error(f"Bulk submission of {len(batch)} records failed (HTTP {res.status_code})")
+                    stats["failed"] += len(batch)
                     continue
+                errors = res.json().get("errors", [])
+            except NETWORK_ERRORS as e:
+                logging.error(f"Network error during bulk submission of {len(batch)} records: {e}")
+                stats["failed"] += len(batch)
+                continue
 
-                md5_hash = get_md5(file_path)
-                if not md5_hash:
-                    stats["failed"] += 1
+            for error in errors:
+                logging.error(f"Failed to submit {batch[error['index']][0]}: {error['error']}")
+                stats["failed"] += 1
+
+    async def submit_directories() -> None:
+        """Posts a record for every directory whose whole subtree was hashed."""
+        hashed_dirs = merkle_hashes(tree, digests, hash_algo)
+        docs = [
+            DirectoryModel(
+                name=directory.name,
+                full_path=str(directory),
+                host=hostname,
+                merkle=merkle,
+                hash_algo=hash_algo,
+                file_count=file_count,
+                size=size,
+            ).model_dump(mode='json')
+            for directory, (merkle, file_count, size) in hashed_dirs.items()
+            # Empty subtrees would all match each other
+            if file_count
+        ]
+        stats["directories"] = len(docs)
+        if dry_run:
+            logging.info(f"[DRY-RUN] Would post {len(docs)} directory hashes")
+            return
+
+        chunk = submit_batch_size or 1000
+        for start in range(0, len(docs), chunk):
+            batch = docs[start:start + chunk]
+            try:
+                res = await submit_directories_bulk(transport, api_url, batch)
+                if res.status_code != 200:
+                    logging.error(f"Submission of {len(batch)} directory hashes failed (HTTP {res.status_code})")
+                    stats["failed"] += len(batch)
                     continue
+                errors = res.json().get("errors", [])
+            except NETWORK_ERRORS as e:
+                logging.error(f"Network error during submission of {len(batch)} directory hashes: {e}")
+                stats["failed"] += len(batch)
+                continue
+            for error in errors:
+                logging.error(f"Failed to submit {batch[error['index']]['full_path']}: {error['error']}")
+                stats["failed"] += 1
+
+    async def flush_pending() -> bool:
+        """Validates all buffered hashes, in as few requests as the server allows. Returns False on auth failure."""
+        batch = pending[:]
+        pending.clear()
+        if not batch:
+            return True
+
+        md5s = sorted({md5_hash for _, md5_hash in batch})
+        grouped: Dict[str, Any] = {}
+        try:
+            # A --batch-size above the server's limit is split into several lookups
+            for start in range(0, len(md5s), MAX_LOOKUP_BATCH):
+                res = await lookup_md5_batch(transport, api_url, md5s[start:start + MAX_LOOKUP_BATCH], hash_algo)
+                if res.status_code == 401:
+                    logging.error("Authentication failed. Check your token.")
+                    return False
+                if res.status_code != 200:
+                    logging.error(f"Batch validation of {len(batch)} files failed (HTTP {res.status_code})")
+                    stats["failed"] += len(batch)
+                    return True
+                grouped.update(res.json())
+        except NETWORK_ERRORS as e:
+            logging.error(f"Network error during batch validation of {len(batch)} files: {e}")
+            stats["failed"] += len(batch)
+            return True
+
+        for file_path, md5_hash in batch:
+            if is_skipped(file_path.parent):
+                continue
+            duplicate_status = DuplicateStatus.NONE
+            remote_action, remote_args = "", ""
+            if items := grouped.get(md5_hash):
+                duplicate_status, remote_action, remote_args = classify(file_path, items)
+            else:
+                stats["new"] += 1
+            await submit(file_path, md5_hash, duplicate_status, remote_action, remote_args)
+        return True
+
+    def marked_for_deletion(current_dir: Path) -> bool:
+        """Handles a MARKED_FOR_DELETION file found in the listing. Returns True if the directory must be skipped."""
+        marker_file = current_dir / MARKER_FILE
+        if dry_run:
+            logging.info(f"[DRY-RUN] Would remove marker file and potentially directory: {current_dir}")
+            return False
+        decision = policy.decide("marked_for_deletion", current_dir)
+        if decision == "ask":
+            confirm = input(f"CONFIRM: Directory {current_dir} is MARKED_FOR_DELETION. Delete marker? (y/N): ")
+            decision = "delete" if confirm.lower() == 'y' else "skip"
+        if decision == "delete":
+            marker_file.unlink()
+            logging.info(f"Removed marker file: {marker_file}")
+            return False
+        if decision == "confirm":
+            policy.defer("marked_for_deletion", marker_file)
+        logging.info(f"Skipping processing for directory {current_dir} as it is marked for deletion")
+        return True
+
+    def walk_files() -> Iterator[Path]:
+        """Walker stage: yields every file to hash, pruning excluded, marked and skipped dirs."""
+        stack = [root_path]
+        while stack:
+            current_dir = stack.pop()
+            # Pruned until its files are listed below, so an abandoned directory stays unhashed
+            tree[current_dir] = None
+            if is_skipped(current_dir):
+                continue
+            try:
+                files, subdirs, marked = scan_directory(current_dir, root_path, exclude_rules)
+            except OSError as e:
+                logging.error(f"Could not list {current_dir}: {e}")
+                continue
+            if marked and marked_for_deletion(current_dir):
+                continue
 
-                duplicate_status = DuplicateStatus.NONE
-                remote_action, remote_args = "", ""
+            tree[current_dir] = ([file_path.name for file_path in files], subdirs)
+            yield from files
+            # Depth-first in name order, like a sorted os.walk
+            stack.extend(current_dir / name for name in sorted(subdirs, reverse=True))
 
-                # 1. Validation (GET)
+    def walk_changed() -> Iterator[Path]:
+        """Walker stage of an incremental rescan: yields only new and modified files.
+
+        Directories whose mtime matches the snapshot are not listed again. Files and
+        directories that disappeared from a relisted directory are collected in vanished.
+        """
+        stack = [root_path]
+        while stack:
+            current_dir = stack.pop()
+            tree[current_dir] = None
+            if is_skipped(current_dir):
+                continue
+            try:
+                mtime_ns = current_dir.stat().st_mtime_ns
+            except OSError as e:
+                logging.error(f"Could not stat {current_dir}: {e}")
+                continue
+
+            known = snapshot.files(current_dir)
+            if snapshot.dir_mtime(current_dir) == mtime_ns:
+                files = []
+                for name in known:
+                    file_path = current_dir / name
+                    try:
+                        files.append(ScannedPath(file_path, stat_result=file_path.stat()))
+                    except OSError:
+                        continue
+                rel_dir = str(current_dir.relative_to(root_path)) if current_dir != root_path else ""
+                subdirs = [name for name in snapshot.subdirs(current_dir)
+                           if not exclude_rules.matches(name, rel_dir)]
+            else:
                 try:
-                    params = {"md5_eq": md5_hash}
-                    res = session.get(api_url, params=params, headers=headers, timeout=10)
-
-                    match (res.status_code, res.json()):
-                        case (200, list(items)) if items:
-                            duplicate_status = check_duplicate_status(
-                                items, filename, current_dir, file_path
-                            )
-                            remote_action = items[0].get("action", "")
-                            remote_args = items[0].get("action_args", "")
-
-                            if duplicate_status == DuplicateStatus.PREVIOUSLY_SCANNED:
-                                stats["previously_scanned"] += 1
-                                logging.info(f"Previously scanned: {file_path}")
-                                if not dry_run:
-                                    user_input = input(
-                                        f"MD5 and full path match for {file_path}. "
-                                        "Skip this directory? (y/N): "
-                                    )
-                                    if user_input.lower() == "y":
-                                        skipped_dirs.add(current_dir)
-                                        logging.info(f"Skipping directory: {current_dir}")
-                            elif duplicate_status == DuplicateStatus.DUPLICATE:
-                                stats["duplicate"] += 1
-                                logging.info(f"Duplicate file: {file_path}")
-                            else: # DUPLICATE_CONTENTS
-                                stats["duplicate_contents"] += 1
-                                logging.info(f"Duplicate contents: {file_path}")
-
-                        case (200, _):
-                            stats["new"] += 1
-                        case (401, _):
-                            logging.error("Authentication failed. Check your token.")
-                            return
-                except requests.exceptions.RequestException as e:
-                    logging.error(f"Network error during validation of {filename}: {e}")
-                    stats["failed"] += 1
+                    files, subdirs, marked = scan_directory(current_dir, root_path, exclude_rules)
+                except OSError as e:
+                    logging.error(f"Could not list {current_dir}: {e}")
                     continue
+                if marked and marked_for_deletion(current_dir):
+                    continue
+                names = {file_path.name for file_path in files}
+                changed_dirs[current_dir] = (mtime_ns, subdirs)
+                vanished.extend(current_dir / name for name in known.keys() - names)
+                # A removed subdirectory is reported whole; the server marks everything below it
+                removed_dirs.extend(current_dir / name for name in set(snapshot.subdirs(current_dir)) - set(subdirs))
 
-                # 2. Remote Action Execution
-                if duplicate_status != DuplicateStatus.NONE and remote_action:
-                    if dry_run:
-                        logging.info(f"[DRY-RUN] Would {remote_action} {filename}")
-                    elif execute_action(remote_action, remote_args, file_path, force):
-                        stats["actions_taken"] += 1
-
-                # 3. Data Submission (POST)
-                if (
-                    dry_run
-                    or not file_path.exists()
-                    or duplicate_status == DuplicateStatus.PREVIOUSLY_SCANNED
-                    or duplicate_status == DuplicateStatus.DUPLICATE
-                ):
+            for file_path in files:
+                st = file_path.stat()
+                previous = known.get(file_path.name)
+                stat_key = (st.st_size, st.st_mtime_ns, st.st_ino)
+                if previous and previous[:3] == stat_key:
+                    stats["unchanged"] += 1
+                    if previous[3]:
+                        digests[file_path] = previous[3]
                     continue
+                changed_files[file_path] = stat_key
+                yield file_path
+            tree[current_dir] = ([file_path.name for file_path in files], subdirs)
+            stack.extend(current_dir / name for name in sorted(subdirs, reverse=True))
 
-                try:
-                    file_model = FileModel(
-                        name=filename,
-                        size=file_path.stat().st_size,
-                        kind=file_path.suffix.lower() or "file",
-                        md5=md5_hash,
-                        parent_dir=current_dir.name,
-                        full_path=str(file_path),
-                        duplicate_status=duplicate_status,
-                    )
-                    session.post(api_url, json=file_model.model_dump(mode='json'), headers=headers, timeout=10)
-                except requests.exceptions.RequestException:
+    async def post_vanished() -> None:
+        """Reports the files and directories an incremental rescan found deleted, so the server marks them."""
+        total = len(vanished) + len(removed_dirs)
+        stats["vanished"] = total
+        if dry_run:
+            logging.info(f"[DRY-RUN] Would mark {total} vanished paths")
+            return
+        vanished_url = f"{api_url.rstrip('/')}/vanished"
+        # Files first, then directories, at most MAX_LOOKUP_BATCH paths of both per request
+        for start in range(0, total, MAX_LOOKUP_BATCH):
+            end = start + MAX_LOOKUP_BATCH
+            body = {
+                "host": hostname,
+                "full_paths": [str(path) for path in vanished[start:end]],
+                "directories": [str(path) for path in removed_dirs[max(start - len(vanished), 0):max(end - len(vanished), 0)]],
+            }
+            count = len(body["full_paths"]) + len(body["directories"])
+            try:
+                res = await transport.post(vanished_url, json=body, timeout=60)
+                if res.status_code != 200:
+                    logging.error(f"Marking {count} vanished paths failed (HTTP {res.status_code})")
+                    stats["failed"] += count
+            except NETWORK_ERRORS as e:
+                logging.error(f"Network error while marking {count} vanished paths: {e}")
+                stats["failed"] += count
+
+    async def validate(file_path: Path, md5_hash: str) -> bool:
+        """Network stage for one hashed file. Returns False when the scan must abort."""
+        if manifest is not None:
+            try:
+                manifest.add(build_file_model(file_path, md5_hash, hash_algo, hostname))
+                stats["recorded"] += 1
+            except OSError as e:
+                logging.error(f"Could not record {file_path}: {e}")
+                stats["failed"] += 1
+            return True
+
+        if batch_size > 0:
+            pending.append((file_path, md5_hash))
+            return len(pending) < batch_size or await flush_pending()
+
+        duplicate_status = DuplicateStatus.NONE
+        remote_action, remote_args = "", ""
+
+        # 1. Validation (GET)
+        try:
+            params = {"md5_eq": md5_hash}
+            if hash_algo != DEFAULT_HASH_ALGO:
+                params["hash_algo_eq"] = hash_algo
+            res = await transport.get(api_url, params=params, timeout=10)
+
+            match (res.status_code, res.json()):
+                case (200, list(items)) if (items := live_records(items)):
+                    duplicate_status, remote_action, remote_args = classify(file_path, items)
+                case (200, _):
+                    stats["new"] += 1
+                case (401, _):
+                    logging.error("Authentication failed. Check your token.")
+                    return False
+        except NETWORK_ERRORS as e:
+            logging.error(f"Network error during validation of {file_path.name}: {e}")
+            stats["failed"] += 1
+            return True
+
+        await submit(file_path, md5_hash, duplicate_status, remote_action, remote_args)
+        return True
+
+    async def network_stage(hashed: Iterator[tuple[Path, Optional[str]]]) -> bool:
+        """Consumes hashing results. Returns False when the scan was aborted.
+
+        Everything here runs on the event loop thread, so stats are never updated
+        concurrently. With the async client, the next hash is awaited in a worker
+        thread while up to max_in_flight validations proceed.
+        """
+        in_flight = asyncio.Semaphore(max_in_flight)
+        tasks = set()
+        aborted = False
+
+        async def validate_in_flight(file_path: Path, md5_hash: str) -> None:
+            nonlocal aborted
+            try:
+                if not await validate(file_path, md5_hash):
+                    aborted = True
+            finally:
+                in_flight.release()
+
+        try:
+            while not aborted:
+                item = await asyncio.to_thread(next, hashed, None) if async_client else next(hashed, None)
+                if item is None:
+                    break
+                file_path, md5_hash = item
+                if not md5_hash:
                     stats["failed"] += 1
+                    continue
+                digests[file_path] = md5_hash
+                # The walker runs ahead of validation, so drop files queued before their dir was skipped
+                if workers > 1 and is_skipped(file_path.parent):
+                    continue
+                if not async_client:
+                    if not await validate(file_path, md5_hash):
+                        return False
+                    continue
+                await in_flight.acquire()
+                task = asyncio.create_task(validate_in_flight(file_path, md5_hash))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            if tasks:
+                await asyncio.gather(*tasks)
+
+        if aborted or not await flush_pending():
+            return False
+        await flush_records()
+        if vanished or removed_dirs:
+            await post_vanished()
+        if dir_hashes and manifest is None:
+            await submit_directories()
+        return True
+
+    def run_actions() -> None:
+        """Runs the planned actions (and any a crashed run left) and reports their outcomes."""
+        if dry_run:
+            return
+        counts = run_action_plan(journal, action_workers)
+        stats["actions_taken"] += counts["done"]
+        stats["actions_failed"] += counts["failed"]
+        if manifest is None:
+            report_action_outcomes(session, api_url, headers, journal)
+
+    async def run_network_stage(hashed: Iterator[tuple[Path, Optional[str]]]) -> bool:
+        nonlocal transport
+        if async_client:
+            transport = AsyncTransport(headers, max_in_flight, transport=http_transport)
+        try:
+            return await network_stage(hashed)
+        finally:
+            await transport.aclose()
+
+    if not root_path.is_dir():
+        logging.error(f"Invalid directory: {root_path}")
+        return
+
+    logging.info(f"Scanning: {root_path} {'(DRY RUN)' if dry_run else ''}")
+
+    if manifest is not None and snapshot is not None:
+        # The manifest drops whatever a scan does not record, so it needs full scans
+        logging.warning("Incremental rescans are not available offline; scanning every file")
+        snapshot = None
+    if snapshot is not None and size_prefilter:
+        # A file the prefilter skips is never hashed, and a rescan only revisits changed
+        # files, so it would not be reconsidered when a file of the same size appears
+        logging.warning("Size prefilter is not available with incremental rescans; hashing every changed file")
+        size_prefilter = False
+    if manifest is not None:
+        manifest.add_root(hostname, root_path)
+        if size_prefilter:
+            # Every file has to be in the manifest for a later sync, unique sizes included
+            logging.warning("Size prefilter is not available offline; hashing every file")
+            size_prefilter = False
+    elif not check_server_compatibility(session, api_url):
+        logging.error("Incompatible server version. Aborting scan.")
+        return
+
+    paths: Iterable[Path] = walk_changed() if snapshot is not None else walk_files()
+    if size_prefilter:
+        sizes = get_file_sizes(paths)
+        remote_sizes = lookup_sizes(session, api_url, headers, (size for size in sizes.values() if size >= 0))
+        if remote_sizes is None:
+            logging.warning("Size prefilter disabled for this scan; hashing every file")
+            paths = list(sizes)
+        else:
+            paths, stats["unique_size"] = select_size_candidates(
+                sizes, remote_sizes, partial_hash_kib * 1024, hash_algo
+            )
+
+    hash_file = partial(get_file_hash, algo=hash_algo, buffer_size=read_buffer_size,
+                        mmap_threshold=mmap_threshold, fadvise=fadvise)
+    if workers > 1:
+        hashed = hash_pipeline(paths, workers, queue_depth, use_processes, hash_cache, hash_file)
+    else:
+        hashed = ((file_path, get_cached_md5(file_path, hash_cache, hash_file)) for file_path in paths)
+
+    try:
+        with closing(hashed):
+            completed = asyncio.run(run_network_stage(hashed))
+        # Actions planned before an abort were already decided, so they still run
+        run_actions()
+        if not completed:
+            return
+
+        if hash_cache:
+            evicted = hash_cache.evict_missing(root_path)
+            logging.debug(f"Evicted {evicted} stale hash cache entries")
+        if manifest is not None:
+            removed = manifest.evict_missing(hostname, root_path)
+            logging.debug(f"Removed {removed} manifest records no longer found")
+        if snapshot is not None and not dry_run:
+            if stats["failed"]:
+                # Changed files are only known to have reached the server if nothing failed
+                logging.warning("Keeping the previous scan snapshot so failed files are retried")
+            else:
+                snapshot.update(
+                    changed_dirs, removed_dirs,
+                    {path: (*stat_key, digests.get(path)) for path, stat_key in changed_files.items()
+                     if not is_skipped(path.parent)},
+                    vanished,
+                )
     finally:
+        if hash_cache:
+            hash_cache.commit()
+        if manifest is not None:
+            manifest.commit()
+        if own_journal:
+            journal.close()
         # --- Summary Report ---
         summary = [
             "\n" + "=" * 40,
@@ -329,6 +2185,13 @@ def process_directory(target_dir: str, api_url: str, token: Optional[str],
             f"Duplicate Files Found:      {stats['duplicate']}",
             f"Previously Scanned Files:   {stats['previously_scanned']}",
             f"Actions Executed:           {stats['actions_taken']}",
+            f"Actions Failed:             {stats['actions_failed']}",
+            f"Skipped (Unique Size):      {stats['unique_size']}",
+            f"Directories Hashed:         {stats['directories']}",
+            f"Recorded to Manifest:       {stats['recorded']}",
+            f"Deferred for Review:        {len(policy.deferred)}",
+            f"Unchanged Since Snapshot:   {stats['unchanged']}",
+            f"Vanished Paths:             {stats['vanished']}",
             f"Failed Operations:          {stats['failed']}",
             "=" * 40,
         ]
@@ -348,7 +2211,59 @@ def main():
                         choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="Log level")
     parser.add_argument("--dry-run", action="store_true", help="Preview mode")
     parser.add_argument("--force", action="store_true", default=config.get("force", False), help="Force 'rm'")
-    parser.add_argument("--exclude", nargs="+", default=config.get("exclude", []), help="Excluded folders")
+    parser.add_argument("--exclude", nargs="+", default=config.get("exclude", []), help="Excluded names, name globs ('*.tmp') or path globs relative to the scan path ('build/cache*')")
+    parser.add_argument("--batch-size", type=int, default=config.get("batch_size", 0),
+                        help="Validate hashes in batches of this size (0 = one request per file)")
+    parser.add_argument("--submit-batch-size", type=int, default=config.get("submit_batch_size", 0),
+                        help="Post new records in batches of this size (0 = one request per file)")
+    parser.add_argument("--workers", type=int, default=config.get("workers", 1),
+                        help="Number of hashing workers (1 = hash inline)")
+    parser.add_argument("--queue-depth", type=int, default=config.get("queue_depth", 1024),
+                        help="Maximum paths and results buffered between pipeline stages")
+    parser.add_argument("--pool", choices=["thread", "process"], default=config.get("pool", "thread"),
+                        help="Run hashing workers as threads or processes")
+    parser.add_argument("--hash-cache", default=config.get("hash_cache", str(HASH_CACHE_FILE)),
+                        help="Local hash cache database ('' disables the cache)")
+    parser.add_argument("--rehash", action="store_true", help="Ignore cached hashes and rehash every file")
+    parser.add_argument("--hash-algo", choices=sorted(HASH_ALGORITHMS),
+                        default=config.get("hash_algo", DEFAULT_HASH_ALGO),
+                        help="Content hash algorithm (xxh*/blake3 need the optional packages)")
+    parser.add_argument("--read-buffer-kib", type=int, default=config.get("read_buffer_kib", HASH_BUFFER_SIZE // 1024),
+                        help="Read buffer size used when hashing")
+    parser.add_argument("--mmap-threshold-mib", type=int, default=config.get("mmap_threshold_mib", 0),
+                        help="Memory-map files at least this large when hashing (0 = never)")
+    parser.add_argument("--fadvise", action=argparse.BooleanOptionalAction, default=config.get("fadvise", True),
+                        help="Hint sequential reads and drop hashed files from the page cache")
+    parser.add_argument("--async", dest="async_client", action="store_true", default=config.get("async", False),
+                        help="Validate and submit with a concurrent httpx client while hashing")
+    parser.add_argument("--max-in-flight", type=int, default=config.get("max_in_flight", 32),
+                        help="Maximum concurrent files being validated in --async mode")
+    parser.add_argument("--size-prefilter", action="store_true", default=config.get("size_prefilter", False),
+                        help="Only hash files whose size collides locally or on the server")
+    parser.add_argument("--dir-hashes", action="store_true", default=config.get("dir_hashes", False),
+                        help="Post a Merkle hash of every fully hashed directory after the scan")
+    parser.add_argument("--offline", metavar="MANIFEST",
+                        help="Scan without the server, recording files in this manifest database")
+    parser.add_argument("--sync", metavar="MANIFEST",
+                        help="Upload the records of this manifest that the server lacks, then exit")
+    parser.add_argument("--incremental", action="store_true", default=config.get("incremental", False),
+                        help="Only process files changed since the last scan of this path, and mark deleted ones")
+    parser.add_argument("--snapshot-db", default=config.get("snapshot_db", str(SNAPSHOT_FILE)),
+                        help="Database of per-path scan snapshots used by --incremental")
+    parser.add_argument("--watch", action="store_true", default=config.get("watch", False),
+                        help="After the scan, keep indexing changes from inotify events until interrupted (Linux)")
+    parser.add_argument("--debounce", type=float, default=config.get("debounce", 2.0),
+                        help="Seconds without events before --watch pushes the pending changes")
+    parser.add_argument("--review", action="store_true",
+                        help="Review the deletions deferred by earlier scans, then exit")
+    parser.add_argument("--deferred-file", default=config.get("deferred_file", str(DEFERRED_FILE)),
+                        help="Queue of deletions deferred for review by the [policy] settings")
+    parser.add_argument("--action-journal", default=config.get("action_journal", str(ACTION_JOURNAL_FILE)),
+                        help="Journal of remote actions, resumed after a crash ('' keeps it in memory)")
+    parser.add_argument("--action-workers", type=int, default=config.get("action_workers", 4),
+                        help="Threads running remote actions after the scan")
+    parser.add_argument("--partial-hash-kib", type=int, default=config.get("partial_hash_kib", 64),
+                        help="KiB read from each end of a file before a full hash (0 = disabled)")
     
     args = parser.parse_args()
 
@@ -356,12 +2271,84 @@ def main():
         init_config()
         sys.exit(0)
 
-    if not args.url:
+    if not args.url and not args.offline:
         print("Error: API URL required. Run with --init or set FILIZER_URL.")
         sys.exit(1)
 
     setup_logging(args.level, args.log)
-    process_directory(args.path, args.url, args.token, args.dry_run, args.force, args.exclude)
+    deferred_file = Path(args.deferred_file).expanduser()
+    if args.review:
+        save_deferred(deferred_file, review_deferred(load_deferred(deferred_file)))
+        sys.exit(0)
+    try:
+        policy = Policy.from_config(config.get("policy", {}), interactive=sys.stdin.isatty())
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    if args.sync:
+        manifest = Manifest(Path(args.sync).expanduser())
+        try:
+            stats = sync_manifest(manifest, args.url, args.token)
+        finally:
+            manifest.close()
+        sys.exit(0 if stats is not None and not stats["failed"] else 1)
+
+    if args.watch and (args.offline or args.dry_run):
+        print("Error: --watch cannot be combined with --offline or --dry-run.")
+        sys.exit(1)
+
+    manifest = Manifest(Path(args.offline).expanduser()) if args.offline else None
+    snapshot = None
+    if args.incremental:
+        snapshot = ScanSnapshot(Path(args.snapshot_db).expanduser(), Path(args.path).resolve())
+    journal = ActionJournal(Path(args.action_journal).expanduser()) if args.action_journal else None
+    hash_cache = None
+    if args.hash_cache:
+        hash_cache = HashCache(Path(args.hash_cache).expanduser(), rehash=args.rehash, hash_algo=args.hash_algo)
+    watcher = None
+    try:
+        if args.watch:
+            # Watches go in before the scan, so changes made while it runs are not missed
+            hasher = partial(get_file_hash, algo=args.hash_algo, buffer_size=args.read_buffer_kib * 1024,
+                             mmap_threshold=args.mmap_threshold_mib * 1024 * 1024, fadvise=args.fadvise)
+            try:
+                watcher = DirectoryWatcher(args.path, args.url, args.token, args.exclude, hash_algo=args.hash_algo,
+                                           hasher=hasher, hash_cache=hash_cache, debounce=args.debounce,
+                                           max_delay=max(30.0, args.debounce * 10))
+            except OSError as e:
+                logging.error(f"Cannot watch {args.path}: {e}")
+                sys.exit(1)
+        process_directory(args.path, args.url, args.token, args.dry_run, args.force, args.exclude,
+                          batch_size=args.batch_size, submit_batch_size=args.submit_batch_size,
+                          workers=args.workers, queue_depth=args.queue_depth,
+                          use_processes=args.pool == "process", hash_cache=hash_cache,
+                          size_prefilter=args.size_prefilter, partial_hash_kib=args.partial_hash_kib,
+                          hash_algo=args.hash_algo, read_buffer_size=args.read_buffer_kib * 1024,
+                          mmap_threshold=args.mmap_threshold_mib * 1024 * 1024, fadvise=args.fadvise,
+                          async_client=args.async_client, max_in_flight=args.max_in_flight,
+                          dir_hashes=args.dir_hashes, manifest=manifest, snapshot=snapshot, policy=policy,
+                          journal=journal, action_workers=args.action_workers)
+        if policy.deferred:
+            deferred = review_deferred(policy.deferred) if policy.interactive else policy.deferred
+            save_deferred(deferred_file, load_deferred(deferred_file) + deferred)
+            if deferred:
+                logging.info(f"{len(deferred)} deletions await review; run with --review")
+        if watcher:
+            stats = watcher.run()
+            logging.info(f"Watch stopped: {stats['indexed']} indexed, {stats['vanished']} vanished, "
+                         f"{stats['failed']} failed")
+    finally:
+        if journal:
+            journal.close()
+        if watcher:
+            watcher.close()
+        if snapshot:
+            snapshot.close()
+        if hash_cache:
+            hash_cache.close()
+        if manifest:
+            manifest.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
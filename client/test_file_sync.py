@@ -1,11 +1,16 @@
 import pytest
 import os
+import sys
+import hashlib
 import logging
 from pathlib import Path
-from unittest.mock import patch
-from file_sync import get_md5, load_config, process_directory, DuplicateStatus
+from unittest.mock import patch, MagicMock
+import file_sync
+from file_sync import get_md5, load_config, process_directory, DuplicateStatus, HashCache, get_cached_md5, get_file_hash, AsyncTransport, check_duplicate_status, merkle_hashes, Manifest, sync_manifest, ScanSnapshot, DirectoryWatcher, Policy, review_deferred, ActionJournal, run_action_plan, report_action_outcomes
 import requests
 import requests_mock
+import asyncio
+import httpx
 
 def test_duplicate_contents_detection(tmp_path, caplog):
     """Test that a file with same MD5 but different name/path is detected as DUPLICATE_CONTENTS."""
@@ -159,6 +164,18 @@ def test_md5_calculation(tmp_path):
     
     assert get_md5(p) == "5eb63bbbe01eeed093cb22bb8f5acdc3"
 
+def test_hashing_strategies_agree(tmp_path):
+    """Test that buffered, small-buffer and memory-mapped hashing produce the same digest."""
+    p = tmp_path / "data.bin"
+    data = os.urandom(3 * 1024 * 1024 + 123)
+    p.write_bytes(data)
+    expected = hashlib.md5(data).hexdigest()
+
+    assert get_file_hash(p) == expected
+    assert get_file_hash(p, buffer_size=4096, fadvise=False) == expected
+    assert get_file_hash(p, mmap_threshold=1024) == expected
+    assert get_file_hash(tmp_path / "missing.bin") is None
+
 def test_config_loading(tmp_path):
     """Test that load_config handles missing files gracefully."""
     config_dir = tmp_path / ".config" / "filizer"
@@ -203,10 +220,12 @@ def test_marked_for_deletion_logic(mock_input, tmp_path, caplog):
             "md5": md5,
             "action": "marked_for_deletion"
         }])
+        mock_report = m.post(f"{api_url}/actions/report", json={"matched": 1, "modified": 1})
         
         process_directory(str(test_dir), api_url, token="test-token", dry_run=False, force=False, excludes=[])
 
     assert "ACTION: Created marker file" in caplog.text
+    assert mock_report.last_request.json()[0]["status"] == "done"
     marker_file = test_dir / "MARKED_FOR_DELETION"
     assert marker_file.exists()
 
@@ -242,3 +261,608 @@ def test_marked_for_deletion_skip(mock_input, tmp_path, caplog):
     assert "New Files Posted:           0" in caplog.text
     # Ensure marker file still exists
     assert (test_dir / "MARKED_FOR_DELETION").exists()
+
+def test_batch_validation(tmp_path, caplog):
+    """Test that batch mode validates all hashes with a single lookup request."""
+    caplog.set_level(logging.INFO)
+
+    test_dir = tmp_path / "test_dir"
+    test_dir.mkdir()
+    dup_path = test_dir / "dup.txt"
+    dup_path.write_text("content")
+    (test_dir / "new.txt").write_text("other content")
+    (test_dir / "new2.txt").write_text("more content")
+    md5 = get_md5(dup_path)
+
+    api_url = "https://api.example.com/files"
+
+    with requests_mock.Mocker() as m:
+        mock_get = m.get(api_url, json=[])
+        mock_lookup = m.post(f"{api_url}/lookup", json={md5: [{
+            "name": "dup.txt",
+            "parent_dir": "elsewhere",
+            "full_path": "/some/old/path/dup.txt",
+            "md5": md5
+        }]})
+        mock_post = m.post(api_url, status_code=201)
+
+        process_directory(str(test_dir), api_url, token="test-token", dry_run=False, force=False,
+                          excludes=[], batch_size=100)
+
+    assert not mock_get.called
+    assert mock_lookup.call_count == 1
+    assert len(mock_lookup.last_request.json()["md5s"]) == 3
+    assert "New Files Posted:           2" in caplog.text
+    assert "Duplicate Contents Found:   1" in caplog.text
+    assert mock_post.call_count == 3
+
+def test_batch_validation_split(tmp_path, monkeypatch, caplog):
+    """Test that a batch larger than the server's lookup limit is sent as several lookups."""
+    caplog.set_level(logging.INFO)
+    monkeypatch.setattr(file_sync, "MAX_LOOKUP_BATCH", 2)
+
+    test_dir = tmp_path / "test_dir"
+    test_dir.mkdir()
+    for i in range(5):
+        (test_dir / f"file{i}.txt").write_text(f"content {i}")
+
+    api_url = "https://api.example.com/files"
+
+    with requests_mock.Mocker() as m:
+        mock_lookup = m.post(f"{api_url}/lookup", json={})
+        mock_post = m.post(api_url, status_code=201)
+
+        process_directory(str(test_dir), api_url, token="test-token", dry_run=False, force=False,
+                          excludes=[], batch_size=100)
+
+    assert [len(r.json()["md5s"]) for r in mock_lookup.request_history] == [2, 2, 1]
+    assert "New Files Posted:           5" in caplog.text
+    assert "Failed Operations:          0" in caplog.text
+    assert mock_post.call_count == 5
+
+def test_bulk_submission(tmp_path, caplog):
+    """Test that new records are buffered and posted through the bulk endpoint."""
+    caplog.set_level(logging.INFO)
+
+    test_dir = tmp_path / "test_dir"
+    test_dir.mkdir()
+    for i in range(3):
+        (test_dir / f"file{i}.txt").write_text(f"content {i}")
+
+    api_url = "https://api.example.com/files"
+
+    with requests_mock.Mocker() as m:
+        m.get(api_url, json=[])
+        mock_post = m.post(api_url, status_code=201)
+        def bulk_response(request, context):
+            docs = request.json()
+            errors = [{"index": 1, "error": "duplicate key"}] if len(docs) > 1 else []
+            return {"inserted": len(docs) - len(errors), "failed": len(errors), "errors": errors}
+
+        mock_bulk = m.post(f"{api_url}/bulk", json=bulk_response)
+
+        process_directory(str(test_dir), api_url, token="test-token", dry_run=False, force=False,
+                          excludes=[], submit_batch_size=2)
+
+    assert not mock_post.called
+    assert mock_bulk.call_count == 2
+    assert [len(r.json()) for r in mock_bulk.request_history] == [2, 1]
+    assert "duplicate key" in caplog.text
+    assert "Failed Operations:          1" in caplog.text
+
+def test_bulk_submission_split(tmp_path, monkeypatch, caplog):
+    """Test that a submit batch larger than the server's bulk limit is sent as several requests."""
+    caplog.set_level(logging.INFO)
+    monkeypatch.setattr(file_sync, "MAX_BULK_INSERT", 2)
+
+    test_dir = tmp_path / "test_dir"
+    test_dir.mkdir()
+    for i in range(5):
+        (test_dir / f"file{i}.txt").write_text(f"content {i}")
+
+    api_url = "https://api.example.com/files"
+
+    with requests_mock.Mocker() as m:
+        m.get(api_url, json=[])
+        def bulk_response(request, context):
+            docs = request.json()
+            errors = [{"index": 1, "error": f"duplicate key {docs[1]['name']}"}] if len(docs) > 1 else []
+            return {"inserted": len(docs) - len(errors), "failed": len(errors), "errors": errors}
+
+        mock_bulk = m.post(f"{api_url}/bulk", json=bulk_response)
+
+        process_directory(str(test_dir), api_url, token="test-token", dry_run=False, force=False,
+                          excludes=[], submit_batch_size=100)
+
+    batches = [r.json() for r in mock_bulk.request_history]
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    # Errors are reported against the record at that index of their own request
+    for batch in batches[:2]:
+        assert f"Failed to submit {test_dir / batch[1]['name']}: duplicate key {batch[1]['name']}" in caplog.text
+    assert "Failed Operations:          2" in caplog.text
+
+def test_parallel_hashing_pipeline(tmp_path, caplog):
+    """Test that a multi-worker scan hashes every file once and keeps the summary accurate."""
+    caplog.set_level(logging.INFO)
+
+    test_dir = tmp_path / "test_dir"
+    (test_dir / "sub").mkdir(parents=True)
+    for i in range(20):
+        (test_dir / f"file{i}.txt").write_text(f"content {i}")
+        (test_dir / "sub" / f"file{i}.txt").write_text(f"sub content {i}")
+
+    api_url = "https://api.example.com/files"
+
+    with requests_mock.Mocker() as m:
+        m.get(api_url, json=[])
+        mock_post = m.post(api_url, status_code=201)
+
+        process_directory(str(test_dir), api_url, token="test-token", dry_run=False, force=False,
+                          excludes=[], workers=4, queue_depth=2)
+
+    assert "New Files Posted:           40" in caplog.text
+    assert "Failed Operations:          0" in caplog.text
+    posted = {r.json()["full_path"] for r in mock_post.request_history}
+    assert len(posted) == 40
+
+
+def test_hash_cache(tmp_path):
+    """Test that unchanged files are served from the cache and missing files are evicted."""
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    file_path = data_dir / "file.txt"
+    file_path.write_text("hello world")
+    gone_path = data_dir / "gone.txt"
+    gone_path.write_text("bye")
+
+    cache = HashCache(tmp_path / "cache.db")
+    assert get_cached_md5(file_path, cache) == "5eb63bbbe01eeed093cb22bb8f5acdc3"
+    get_cached_md5(gone_path, cache)
+    cache.close()
+
+    gone_path.unlink()
+    cache = HashCache(tmp_path / "cache.db")
+    mock_md5 = MagicMock()
+    assert get_cached_md5(file_path, cache, mock_md5) == "5eb63bbbe01eeed093cb22bb8f5acdc3"
+    assert not mock_md5.called
+    assert cache.evict_missing(data_dir) == 1
+    cache.close()
+
+    cache = HashCache(tmp_path / "cache.db", rehash=True)
+    assert get_cached_md5(file_path, cache, MagicMock(return_value="rehashed")) == "rehashed"
+    cache.close()
+
+def test_size_prefilter(tmp_path, caplog):
+    """Test that only files with colliding sizes and partial hashes are hashed and posted."""
+    caplog.set_level(logging.INFO)
+
+    test_dir = tmp_path / "test_dir"
+    test_dir.mkdir()
+    (test_dir / "unique.txt").write_text("unique!")
+    (test_dir / "remote.txt").write_text("on server!!")
+    (test_dir / "big1.bin").write_bytes(b"a" * 3000)
+    (test_dir / "big2.bin").write_bytes(b"a" * 3000)
+    (test_dir / "big3.bin").write_bytes(b"b" + b"a" * 2999)
+
+    api_url = "https://api.example.com/files"
+
+    with requests_mock.Mocker() as m:
+        mock_sizes = m.post(f"{api_url}/sizes", json={"sizes": [11]})
+        m.get(api_url, json=[])
+        mock_post = m.post(api_url, status_code=201)
+
+        process_directory(str(test_dir), api_url, token="test-token", dry_run=False, force=False,
+                          excludes=[], size_prefilter=True, partial_hash_kib=1)
+
+    assert sorted(mock_sizes.last_request.json()["sizes"]) == [7, 11, 3000]
+    assert "Skipped (Unique Size):      2" in caplog.text
+    assert "New Files Posted:           3" in caplog.text
+    posted = sorted(r.json()["name"] for r in mock_post.request_history)
+    assert posted == ["big1.bin", "big2.bin", "remote.txt"]
+
+def test_alternate_hash_algorithm(tmp_path, caplog):
+    """Test that a non-MD5 algorithm is used for hashing, lookups and posted records."""
+    caplog.set_level(logging.INFO)
+
+    test_dir = tmp_path / "test_dir"
+    test_dir.mkdir()
+    (test_dir / "file.txt").write_text("hello world")
+    digest = hashlib.blake2b(b"hello world").hexdigest()
+
+    api_url = "https://api.example.com/files"
+
+    with requests_mock.Mocker() as m:
+        mock_get = m.get(api_url, json=[])
+        mock_post = m.post(api_url, status_code=201)
+
+        process_directory(str(test_dir), api_url, token="test-token", dry_run=False, force=False,
+                          excludes=[], hash_algo="blake2b")
+
+    assert mock_get.last_request.qs["md5_eq"] == [digest]
+    assert mock_get.last_request.qs["hash_algo_eq"] == ["blake2b"]
+    assert mock_post.last_request.json()["md5"] == digest
+    assert mock_post.last_request.json()["hash_algo"] == "blake2b"
+
+
+def test_async_client(tmp_path, caplog):
+    """Test that async mode validates and posts every file through httpx with the version header."""
+    caplog.set_level(logging.INFO)
+
+    test_dir = tmp_path / "test_dir"
+    test_dir.mkdir()
+    for i in range(10):
+        (test_dir / f"file{i}.txt").write_text(f"content {i}")
+
+    api_url = "https://api.example.com/files"
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        if request.method == "GET":
+            return httpx.Response(200, json=[])
+        return httpx.Response(201, json={})
+
+    with requests_mock.Mocker() as m:
+        m.get("https://api.example.com/version", json={"version": "1.0.0"})
+        process_directory(str(test_dir), api_url, token="test-token", dry_run=False, force=False,
+                          excludes=[], async_client=True, max_in_flight=4,
+                          http_transport=httpx.MockTransport(handler))
+
+    assert "New Files Posted:           10" in caplog.text
+    assert len([r for r in seen if r.method == "POST"]) == 10
+    assert all(r.headers["X-Client-Version"] for r in seen)
+    assert all(r.headers["Authorization"] == "Bearer test-token" for r in seen)
+
+def test_async_transport_retries():
+    """Test that the async transport retries 5xx responses like the blocking session."""
+    responses = iter([httpx.Response(503), httpx.Response(502), httpx.Response(200, json=[])])
+    transport = AsyncTransport({}, 1, backoff_factor=0,
+                               transport=httpx.MockTransport(lambda request: next(responses)))
+
+    async def fetch():
+        try:
+            return await transport.get("https://api.example.com/files")
+        finally:
+            await transport.aclose()
+
+    assert asyncio.run(fetch()).status_code == 200
+
+def test_previously_scanned_requires_same_host(tmp_path):
+    """Test that a record for the same path on another host is not treated as this file."""
+    file_path = tmp_path / "file.txt"
+    items = [{"name": "file.txt", "parent_dir": "other", "full_path": str(file_path), "host": "nas-2"}]
+
+    assert check_duplicate_status(items, "file.txt", tmp_path, file_path, "nas-1") == DuplicateStatus.DUPLICATE_CONTENTS
+    assert check_duplicate_status(items, "file.txt", tmp_path, file_path, "nas-2") == DuplicateStatus.PREVIOUSLY_SCANNED
+    items[0].pop("host")
+    assert check_duplicate_status(items, "file.txt", tmp_path, file_path, "nas-1") == DuplicateStatus.PREVIOUSLY_SCANNED
+
+def test_merkle_hashes(tmp_path):
+    """Test that identical subtrees share a Merkle hash and incomplete ones get none."""
+    digests = {}
+    tree = {}
+    for top in ("a", "b", "c"):
+        for sub, name, content in (("", "x.txt", "x"), ("nested", "y.txt", "y")):
+            directory = tmp_path / top / sub if sub else tmp_path / top
+            directory.mkdir(parents=True, exist_ok=True)
+            file_path = directory / name
+            file_path.write_text(content)
+            digests[file_path] = get_md5(file_path)
+        tree[tmp_path / top] = (["x.txt"], ["nested"])
+        tree[tmp_path / top / "nested"] = (["y.txt"], [])
+    # Same contents under a different file name
+    (tmp_path / "c" / "nested" / "y.txt").rename(tmp_path / "c" / "nested" / "z.txt")
+    digests[tmp_path / "c" / "nested" / "z.txt"] = digests.pop(tmp_path / "c" / "nested" / "y.txt")
+    tree[tmp_path / "c" / "nested"] = (["z.txt"], [])
+    tree[tmp_path] = ([], ["a", "b", "c", "pruned"])
+    tree[tmp_path / "pruned"] = None
+
+    hashes = merkle_hashes(tree, digests)
+
+    assert hashes[tmp_path / "a"] == hashes[tmp_path / "b"]
+    assert hashes[tmp_path / "a"][1:] == (2, 2)
+    assert hashes[tmp_path / "a"][0] != hashes[tmp_path / "c"][0]
+    assert hashes[tmp_path / "a" / "nested"] == hashes[tmp_path / "b" / "nested"]
+    # The root contains a pruned directory, so its subtree is unknown
+    assert tmp_path not in hashes
+
+def test_directory_hashes_submitted(tmp_path):
+    """Test that directory records are posted after the files when dir_hashes is set."""
+    test_dir = tmp_path / "test_dir"
+    for sub in ("one", "two"):
+        (test_dir / sub).mkdir(parents=True)
+        (test_dir / sub / "file.txt").write_text("same")
+
+    api_url = "https://api.example.com/api/v1/files"
+
+    with requests_mock.Mocker() as m:
+        m.get(api_url, json=[])
+        m.post(api_url, status_code=201)
+        mock_dirs = m.post("https://api.example.com/api/v1/directories/bulk", json={"errors": []})
+
+        process_directory(str(test_dir), api_url, token="test-token", dry_run=False, force=False,
+                          excludes=[], dir_hashes=True)
+
+    records = {Path(doc["full_path"]).name: doc for doc in mock_dirs.last_request.json()}
+    assert set(records) == {"test_dir", "one", "two"}
+    assert records["one"]["merkle"] == records["two"]["merkle"]
+    assert records["test_dir"]["file_count"] == 2
+
+def test_offline_scan_and_sync(tmp_path):
+    """Test that an offline scan needs no server and a sync uploads only the delta."""
+    import json
+
+    test_dir = tmp_path / "test_dir"
+    test_dir.mkdir()
+    for name in ("same.txt", "changed.txt", "new.txt", "restored.txt"):
+        (test_dir / name).write_text(name)
+    api_url = "https://api.example.com/api/v1/files"
+
+    manifest = Manifest(tmp_path / "manifest.db")
+    with requests_mock.Mocker() as m:
+        process_directory(str(test_dir), api_url, token=None, dry_run=False, force=False,
+                          excludes=[], manifest=manifest)
+        assert not m.called
+
+    same = test_dir.resolve() / "same.txt"
+    restored = test_dir.resolve() / "restored.txt"
+    remote = [
+        {"id": "1", "full_path": str(same), "md5": get_md5(same), "hash_algo": "md5",
+         "size": same.stat().st_size, "mtime": same.stat().st_mtime},
+        {"id": "2", "full_path": str(test_dir.resolve() / "changed.txt"), "md5": "stale", "hash_algo": "md5",
+         "size": 1, "mtime": 0.0},
+        {"id": "3", "full_path": str(test_dir.resolve() / "deleted.txt"), "md5": "gone", "hash_algo": "md5",
+         "size": 1, "mtime": 0.0},
+        # Marked vanished on the server, then restored: uploaded again to clear the mark
+        {"id": "5", "full_path": str(restored), "md5": get_md5(restored), "hash_algo": "md5",
+         "size": restored.stat().st_size, "mtime": restored.stat().st_mtime, "vanished_at": "2026-01-01T00:00:00"},
+        # Already marked vanished, so not counted as gone again
+        {"id": "6", "full_path": str(test_dir.resolve() / "old.txt"), "md5": "old", "hash_algo": "md5",
+         "size": 1, "mtime": 0.0, "vanished_at": "2026-01-01T00:00:00"},
+        # Outside the scanned root, so not this manifest's concern
+        {"id": "4", "full_path": "/elsewhere/file.txt", "md5": "other", "hash_algo": "md5", "size": 1, "mtime": 0.0},
+    ]
+    with requests_mock.Mocker() as m:
+        m.get("https://api.example.com/version", json={"version": "1.0.0"})
+        mock_list = m.get(api_url, text="\n".join(json.dumps(record) for record in remote) + "\n")
+        mock_bulk = m.post(f"{api_url}/bulk", json={"errors": []})
+        stats = sync_manifest(manifest, api_url, token=None)
+    manifest.close()
+
+    assert mock_list.last_request.qs["format"] == ["ndjson"]
+    assert "vanished_at" in mock_list.last_request.qs["fields"][0].split(",")
+    uploaded = sorted(Path(doc["full_path"]).name for doc in mock_bulk.last_request.json())
+    assert uploaded == ["changed.txt", "new.txt", "restored.txt"]
+    assert stats["uploaded"] == 3
+    assert stats["vanished"] == 1
+
+def test_incremental_rescan(tmp_path):
+    """Test that a rescan with a snapshot posts only changed files and marks deleted ones."""
+    test_dir = tmp_path / "test_dir"
+    (test_dir / "sub").mkdir(parents=True)
+    for name in ("same.txt", "changed.txt", "deleted.txt", "sub/inner.txt"):
+        (test_dir / name).write_text(name)
+    root = test_dir.resolve()
+    api_url = "https://api.example.com/api/v1/files"
+
+    def scan():
+        snapshot = ScanSnapshot(tmp_path / "snapshots.db", root)
+        try:
+            with requests_mock.Mocker() as m:
+                m.get(api_url, json=[])
+                mock_post = m.post(api_url, status_code=201)
+                mock_vanished = m.post(f"{api_url}/vanished", json={"marked": 1})
+                process_directory(str(test_dir), api_url, token="test-token", dry_run=False, force=False,
+                                  excludes=[], snapshot=snapshot)
+                posted = sorted(Path(r.json()["full_path"]).name for r in mock_post.request_history)
+                return posted, mock_vanished.request_history
+        finally:
+            snapshot.close()
+
+    posted, vanished = scan()
+    assert posted == ["changed.txt", "deleted.txt", "inner.txt", "same.txt"]
+    assert not vanished
+
+    (test_dir / "changed.txt").write_text("changed, and longer")
+    (test_dir / "deleted.txt").unlink()
+    (test_dir / "new.txt").write_text("new")
+    (test_dir / "sub" / "inner.txt").unlink()
+    (test_dir / "sub").rmdir()
+
+    posted, vanished = scan()
+    assert posted == ["changed.txt", "new.txt"]
+    # A removed directory is reported as such, not expanded into its files
+    assert vanished[0].json()["full_paths"] == [str(root / "deleted.txt")]
+    assert vanished[0].json()["directories"] == [str(root / "sub")]
+
+    posted, vanished = scan()
+    assert posted == []
+    assert not vanished
+
+def test_incremental_rescan_hashes_unique_sizes(tmp_path):
+    """Test that a file of a unique size is still hashed on an incremental scan, so a later copy is found."""
+    test_dir = tmp_path / "test_dir"
+    (test_dir / "sub").mkdir(parents=True)
+    (test_dir / "a.bin").write_bytes(b"a" * 5000)
+    root = test_dir.resolve()
+    api_url = "https://api.example.com/api/v1/files"
+
+    def scan():
+        snapshot = ScanSnapshot(tmp_path / "snapshots.db", root)
+        try:
+            with requests_mock.Mocker() as m:
+                m.post(f"{api_url}/sizes", json={"sizes": []})
+                mock_get = m.get(api_url, json=[])
+                mock_post = m.post(api_url, status_code=201)
+                process_directory(str(test_dir), api_url, token="test-token", dry_run=False, force=False,
+                                  excludes=[], snapshot=snapshot, size_prefilter=True)
+                posted = [Path(r.json()["full_path"]).name for r in mock_post.request_history]
+                return posted, [r.qs["md5_eq"] for r in mock_get.request_history]
+        finally:
+            snapshot.close()
+
+    posted, looked_up = scan()
+    assert posted == ["a.bin"]
+    (test_dir / "sub" / "b.bin").write_bytes(b"a" * 5000)
+    posted, looked_up = scan()
+    assert posted == ["b.bin"]
+    assert looked_up == [[get_md5(test_dir / "a.bin")]]
+
+def test_restored_file_is_reposted(tmp_path):
+    """Test that a file restored at a path marked vanished is posted again, not skipped as scanned."""
+    test_dir = tmp_path / "test_dir"
+    test_dir.mkdir()
+    file_path = test_dir / "restored.txt"
+    file_path.write_text("restored")
+    api_url = "https://api.example.com/api/v1/files"
+    vanished = {"name": "restored.txt", "parent_dir": "test_dir", "full_path": str(file_path.resolve()),
+                "host": None, "md5": get_md5(file_path), "action": "rm", "vanished_at": "2026-01-01T00:00:00"}
+
+    snapshot = ScanSnapshot(tmp_path / "snapshots.db", test_dir.resolve())
+    try:
+        with requests_mock.Mocker() as m:
+            # A server that predates the vanished filter on validation still returns the record
+            m.get(api_url, json=[vanished])
+            mock_post = m.post(api_url, status_code=201)
+            process_directory(str(test_dir), api_url, token="test-token", dry_run=False, force=False,
+                              excludes=[], snapshot=snapshot)
+    finally:
+        snapshot.close()
+
+    assert mock_post.call_count == 1
+    body = mock_post.last_request.json()
+    assert body["duplicate_status"] == DuplicateStatus.NONE.value
+    assert not body.get("action")
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is Linux-only")
+def test_watch_coalesces_events(tmp_path):
+    """Test that watch mode pushes each changed file once and marks deleted paths vanished."""
+    test_dir = tmp_path / "test_dir"
+    (test_dir / "old").mkdir(parents=True)
+    (test_dir / "old" / "inner.txt").write_text("inner")
+    (test_dir / "gone.txt").write_text("gone")
+    root = test_dir.resolve()
+    api_url = "https://api.example.com/api/v1/files"
+
+    watcher = DirectoryWatcher(str(test_dir), api_url, token=None, excludes=[], debounce=0)
+    try:
+        for content in ("one", "two", "three"):
+            (test_dir / "edited.txt").write_text(content)
+        (test_dir / "temp.txt").write_text("temp")
+        (test_dir / "temp.txt").unlink()
+        (test_dir / "gone.txt").unlink()
+        (test_dir / "new").mkdir()
+        (test_dir / "old").rename(tmp_path / "moved")
+        watcher.poll(0.1)
+        (test_dir / "new" / "nested.txt").write_text("nested")
+        watcher.poll(0.1)
+
+        with requests_mock.Mocker() as m:
+            mock_vanished = m.post(f"{api_url}/vanished", json={"marked": 2})
+            mock_bulk = m.post(f"{api_url}/bulk", json={"errors": []})
+            assert watcher.due()
+            watcher.flush()
+    finally:
+        watcher.close()
+
+    uploaded = sorted(Path(doc["full_path"]).name for doc in mock_bulk.last_request.json())
+    assert uploaded == ["edited.txt", "nested.txt"]
+    assert mock_bulk.call_count == 1
+    body = mock_vanished.last_request.json()
+    assert body["full_paths"] == [str(root / "gone.txt")]
+    assert body["directories"] == [str(root / "old")]
+    assert watcher.stats["indexed"] == 2
+
+def test_exclude_patterns(tmp_path):
+    """Test that exact names, name globs and relative path globs are all excluded."""
+    test_dir = tmp_path / "test_dir"
+    for name in ("keep.txt", "scratch.tmp", "node_modules/dep.js", "build/cache1/a.o", "build/out/b.o",
+                 "src/build/cache1/c.o"):
+        (test_dir / name).parent.mkdir(parents=True, exist_ok=True)
+        (test_dir / name).write_text(name)
+    api_url = "https://api.example.com/api/v1/files"
+
+    with requests_mock.Mocker() as m:
+        m.get(api_url, json=[])
+        mock_post = m.post(api_url, status_code=201)
+        process_directory(str(test_dir), api_url, token="test-token", dry_run=False, force=False,
+                          excludes=["node_modules", "*.tmp", "build/cache*"])
+
+    posted = sorted(Path(r.json()["full_path"]).name for r in mock_post.request_history)
+    # Path globs are anchored at the scan root, so src/build/cache1 is kept
+    assert posted == ["b.o", "c.o", "keep.txt"]
+
+@patch('builtins.input', side_effect=AssertionError("must not prompt"))
+def test_policy_defers_deletions(mock_input, tmp_path):
+    """Test that a non-interactive policy never prompts and defers deletions to the review."""
+    test_dir = tmp_path / "test_dir"
+    (test_dir / "marked").mkdir(parents=True)
+    (test_dir / "marked" / "MARKED_FOR_DELETION").touch()
+    (test_dir / "marked" / "inside.txt").write_text("inside")
+    dup = test_dir / "dup.txt"
+    dup.write_text("content")
+    kept = test_dir / "kept" / "dup.txt"
+    kept.parent.mkdir()
+    kept.write_text("content")
+    api_url = "https://api.example.com/api/v1/files"
+
+    policy = Policy({"rm": "confirm"}, [{"pattern": f"{test_dir}/kept/*", "rm": "skip"}], interactive=False)
+    with requests_mock.Mocker() as m:
+        m.get(api_url, json=[{"full_path": "/elsewhere/dup.txt", "md5": get_md5(dup), "action": "rm"}])
+        mock_post = m.post(api_url, status_code=201)
+        process_directory(str(test_dir), api_url, token="test-token", dry_run=False, force=False,
+                          excludes=[], policy=policy)
+
+    # The marked directory is skipped until its marker removal is confirmed
+    assert "inside.txt" not in [Path(r.json()["full_path"]).name for r in mock_post.request_history]
+    assert sorted((entry["event"], Path(entry["path"])) for entry in policy.deferred) == [
+        ("marked_for_deletion", test_dir / "marked" / "MARKED_FOR_DELETION"),
+        ("rm", dup),
+    ]
+    assert dup.exists() and kept.exists()
+
+    # A file that changed since the scan is kept even when confirmed
+    dup.write_text("changed since")
+    with patch('builtins.input', side_effect=["y", "y"]):
+        assert review_deferred(policy.deferred) == []
+    assert not (test_dir / "marked" / "MARKED_FOR_DELETION").exists()
+    assert dup.exists()
+
+def test_action_journal_resumes_after_crash(tmp_path):
+    """Test that journaled actions run in bulk, survive a crash and are reported once."""
+    src = tmp_path / "src"
+    src.mkdir()
+    for name in ("move.txt", "copy.txt", "remove.txt", "done.txt"):
+        (src / name).write_text(name)
+    journal_path = tmp_path / "actions.db"
+
+    journal = ActionJournal(journal_path)
+    journal.plan("nas", src / "move.txt", "mv", str(tmp_path / "dest" / "move.txt"))
+    journal.plan("nas", src / "copy.txt", "cp", str(tmp_path / "dest" / "copy.txt"))
+    journal.plan("nas", src / "remove.txt", "rm", None)
+    journal.plan("nas", src / "missing.txt", "rm", None)
+    journal.plan("nas", src / "done.txt", "rm", None)
+    journal.plan("nas", src / "done.txt", "rm", None)  # planned twice, journaled once
+    # Crash after the batch started and done.txt was already deleted
+    journal.start([row[0] for row in journal.pending()])
+    (src / "done.txt").unlink()
+    journal._conn.execute("UPDATE actions SET status = 'planned' WHERE path LIKE '%missing.txt'")
+    journal.close()
+
+    journal = ActionJournal(journal_path)
+    counts = run_action_plan(journal, workers=2)
+    assert counts == {"done": 4, "failed": 1}
+    assert (tmp_path / "dest" / "move.txt").exists() and not (src / "move.txt").exists()
+    assert (tmp_path / "dest" / "copy.txt").exists() and (src / "copy.txt").exists()
+    assert not (src / "remove.txt").exists()
+
+    api_url = "https://api.example.com/api/v1/files"
+    with requests_mock.Mocker() as m:
+        mock_report = m.post(f"{api_url}/actions/report", json={"matched": 5, "modified": 5})
+        assert report_action_outcomes(requests.Session(), api_url, {}, journal)
+    statuses = {Path(r["full_path"]).name: r["status"] for r in mock_report.last_request.json()}
+    assert statuses == {"move.txt": "done", "copy.txt": "done", "remove.txt": "done",
+                        "missing.txt": "failed", "done.txt": "done"}
+    # Acknowledged outcomes leave the journal
+    assert journal.outcomes(10) == [] and journal.pending() == []
+    journal.close()
@@ -1,3 +1,4 @@
+from datetime import datetime
 from enum import Enum
 from pydantic import BaseModel, Field
 from typing import Optional, List, ClassVar
@@ -10,6 +11,8 @@ VERSION = "1.0.0"
 MIN_CLIENT_VERSION = "1.0.0"
 # Minimum Server version the client supports
 MIN_SERVER_VERSION = "1.0.0"
+# Hash algorithm assumed for records that predate the hash_algo field
+DEFAULT_HASH_ALGO = "md5"
 
 class DuplicateStatus(str, Enum):
     NONE = "NONE"
@@ -18,19 +21,81 @@ class DuplicateStatus(str, Enum):
     PREVIOUSLY_SCANNED = "PREVIOUSLY_SCANNED"
     MARKED_FOR_DELETION = "MARKED_FOR_DELETION"
 
+class UpsertResult(str, Enum):
+    INSERTED = "inserted"
+    UPDATED = "updated"
+    UNCHANGED = "unchanged"
+
 class ActionUpdate(BaseModel):
     action: str
     action_args: Optional[str] = None
 
+class ActionStatus(str, Enum):
+    DONE = "done"
+    FAILED = "failed"
+
+class ActionReport(BaseModel):
+    """The outcome of an action a client ran on its file at (host, full_path)."""
+    host: Optional[str] = None
+    full_path: str
+    action: str
+    action_args: Optional[str] = None
+    status: ActionStatus
+    error: Optional[str] = None
+
+class Md5Lookup(BaseModel):
+    md5s: List[str]
+    hash_algo: str = DEFAULT_HASH_ALGO
+
+class SizeLookup(BaseModel):
+    sizes: List[int]
+
+class VanishedPaths(BaseModel):
+    host: Optional[str] = None
+    full_paths: List[str]
+    # Whole directories (e.g. moved away), marking every path below them
+    directories: List[str] = []
+
+class MerkleLookup(BaseModel):
+    merkles: List[str]
+    hash_algo: str = DEFAULT_HASH_ALGO
+
 class FileModel(DbModel):
     #id: Optional[str] = Field(alias="_id", default=None)
     name: str
     size: int
     kind: str
+    # Content digest produced by hash_algo; the field keeps its historical name
     md5: str
+    hash_algo: str = DEFAULT_HASH_ALGO
     parent_dir: str
     full_path: str
+    # Records are unique per (host, full_path); None for records from before hosts were tracked
+    host: Optional[str] = None
+    mtime: Optional[float] = None
+    # Set when a rescan found the path gone; cleared when the path is ingested again
+    vanished_at: Optional[datetime] = None
     action: Optional[str] = None
     action_args: Optional[str] = None
+    # Outcome of the last action run on this file, as reported by its client
+    action_status: Optional[ActionStatus] = None
+    action_error: Optional[str] = None
+    action_at: Optional[datetime] = None
     duplicate_status: DuplicateStatus
     _collection: ClassVar[str] = "files"
+
+class FileUpsertResponse(BaseModel):
+    result: UpsertResult
+    file: FileModel
+
+class DirectoryModel(DbModel):
+    name: str
+    full_path: str
+    host: Optional[str] = None
+    # Bottom-up hash of the names and digests of everything below the directory (see the client's merkle_hashes)
+    merkle: str
+    hash_algo: str = DEFAULT_HASH_ALGO
+    # Files and bytes in the whole subtree
+    file_count: int
+    size: int
+    _collection: ClassVar[str] = "directories"
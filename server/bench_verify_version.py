@@ -0,0 +1,56 @@
+"""Micro-benchmark of the per-request cost of the verify_version dependency.
+
+Usage:
+    uv run python server/bench_verify_version.py --requests 200000
+
+Calls the dependency directly, as FastAPI does for every api_router request, with the
+memoized semver check and with the check run from scratch each time. Only the
+dependency is timed; routing and the handler are the same either way.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fastapi import Response
+from starlette.requests import Request
+
+import main
+
+def make_request(client_version: str) -> Request:
+    return Request({"type": "http", "method": "POST", "path": "/api/v1/files/lookup",
+                    "headers": [(b"x-client-version", client_version.encode())]})
+
+def run(requests: list, loops: int) -> float:
+    start = time.perf_counter()
+    for _ in range(loops):
+        for request in requests:
+            main.verify_version(request, Response())
+    return time.perf_counter() - start
+
+def cli():
+    parser = argparse.ArgumentParser(description="Measure verify_version overhead per request")
+    parser.add_argument("--requests", type=int, default=100000, help="Requests timed per variant")
+    parser.add_argument("--versions", nargs="+", default=["1.0.0", "1.0.1", "1.2.0"],
+                        help="Distinct X-Client-Version values sent, round-robin")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per variant; the best is reported")
+    args = parser.parse_args()
+
+    requests = [make_request(version) for version in args.versions]
+    loops = max(1, args.requests // len(requests))
+    total = loops * len(requests)
+    variants = {
+        "memoized": main.check_client_version,
+        "uncached": main.check_client_version.__wrapped__,
+    }
+    for name, check in variants.items():
+        with patch("main.check_client_version", check):
+            best = min(run(requests, loops) for _ in range(args.repeat))
+        print(f"  {name:<10} {best * 1e9 / total:9.0f} ns/request  ({total} requests)")
+
+if __name__ == "__main__":
+    cli()
@@ -1,17 +1,89 @@
+import hashlib
+import hmac
 import os
+import secrets
+import sys
 import tomllib
 from pathlib import Path
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
+
+def hash_api_key(token: str) -> str:
+    """Hashes an API key for the config file as sha256$<hash>.
+
+    Keys from new-key are 256 random bits, so one unsalted SHA-256 is as hard to
+    reverse as a slow hash, and checking a wrong token costs microseconds.
+    """
+    return f"sha256${hashlib.sha256(token.encode()).hexdigest()}"
+
+def check_api_key(token: str, hashed: str) -> bool:
+    """Whether token matches a hash from hash_api_key."""
+    return hmac.compare_digest(hash_api_key(token), hashed)
+
+class ApiKey(BaseModel):
+    name: str
+    # Never the key itself; see hash_api_key, so a malformed entry fails at startup
+    hash: str = Field(pattern=r"^sha256\$[0-9a-f]{64}$")
 
 class AuthConfig(BaseModel):
     enabled: bool = False
     username: str = "admin"
     password: str = "secret"
+    # Bearer tokens accepted when auth is enabled; Basic credentials stay a fallback
+    api_keys: List[ApiKey] = []
+    basic: bool = True
+    # Most verified tokens remembered, so a known token skips the hash; failures are never cached
+    token_cache_size: int = 1024
+
+class ServerConfig(BaseModel):
+    host: str = "0.0.0.0"
+    port: int = 8000
+    # Worker processes; 0 starts one per available CPU
+    workers: int = 1
+    # "auto" uses uvloop and httptools when they are installed
+    loop: Literal["auto", "uvloop", "asyncio"] = "auto"
+    http: Literal["auto", "httptools", "h11"] = "auto"
+    # Seconds in-flight requests get to finish after SIGTERM
+    graceful_timeout: int = 30
+
+POOL_URI_OPTIONS = {
+    "max_pool_size": "maxPoolSize",
+    "min_pool_size": "minPoolSize",
+    "max_idle_time_ms": "maxIdleTimeMS",
+    "server_selection_timeout_ms": "serverSelectionTimeoutMS",
+    "connect_timeout_ms": "connectTimeoutMS",
+    "socket_timeout_ms": "socketTimeoutMS",
+}
+
+class PoolConfig(BaseModel):
+    """MongoDB connection pool options, per worker process. None keeps the driver default."""
+    max_pool_size: Optional[int] = None
+    min_pool_size: Optional[int] = None
+    max_idle_time_ms: Optional[int] = None
+    server_selection_timeout_ms: Optional[int] = None
+    connect_timeout_ms: Optional[int] = None
+    socket_timeout_ms: Optional[int] = None
+
+    def uri_options(self) -> dict:
+        """The options that are set, under their MongoDB connection string names."""
+        return {POOL_URI_OPTIONS[name]: value for name, value in self.model_dump().items() if value is not None}
+
+class MetricsConfig(BaseModel):
+    # Directory the workers of one server share their metrics through; serve.py sets
+    # one up when it starts several workers
+    dir: Optional[str] = None
+    # Seconds between each worker's snapshots
+    interval: float = 5.0
 
 class Settings(BaseModel):
     auth: AuthConfig = AuthConfig()
+    server: ServerConfig = ServerConfig()
     mongodb_url: str = "mongodb://localhost:27017"
     db_name: str = "files_db"
+    pool: PoolConfig = PoolConfig()
+    # Seconds each server process may serve /stats from memory
+    stats_cache_ttl: float = 5.0
+    metrics: MetricsConfig = MetricsConfig()
 
 def load_settings() -> Settings:
     # 1. Defaults
@@ -27,8 +99,17 @@ def load_settings() -> Settings:
                 if "auth" in toml_data:
                     config_data["auth"] = toml_data["auth"]
                 if "mongodb" in toml_data:
-                    config_data["mongodb_url"] = toml_data["mongodb"].get("url")
-                    config_data["db_name"] = toml_data["mongodb"].get("db_name")
+                    # The table may hold only pool options, leaving the defaults in place
+                    for key, field in (("url", "mongodb_url"), ("db_name", "db_name")):
+                        if key in toml_data["mongodb"]:
+                            config_data[field] = toml_data["mongodb"][key]
+                    config_data["pool"] = {k: v for k, v in toml_data["mongodb"].items() if k in PoolConfig.model_fields}
+                if "server" in toml_data:
+                    config_data["server"] = toml_data["server"]
+                if "metrics" in toml_data:
+                    config_data["metrics"] = toml_data["metrics"]
+                if "stats" in toml_data:
+                    config_data["stats_cache_ttl"] = toml_data["stats"].get("cache_ttl", 5.0)
         except Exception as e:
             print(f"Warning: Failed to parse config file at {config_path}: {e}")
 
@@ -41,6 +122,14 @@ def load_settings() -> Settings:
         auth_env["username"] = os.getenv("API_USERNAME")
     if os.getenv("API_PASSWORD") is not None:
         auth_env["password"] = os.getenv("API_PASSWORD")
+    if os.getenv("API_KEYS") is not None:
+        # name=hash pairs separated by commas
+        auth_env["api_keys"] = [
+            {"name": name, "hash": hashed}
+            for name, _, hashed in (pair.partition("=") for pair in os.getenv("API_KEYS").split(",") if pair)
+        ]
+    if os.getenv("API_BASIC_AUTH") is not None:
+        auth_env["basic"] = os.getenv("API_BASIC_AUTH").lower() == "true"
     
     if auth_env:
         # Ensure 'auth' key exists if we are overriding it
@@ -53,6 +142,25 @@ def load_settings() -> Settings:
     if os.getenv("MONGODB_DB_NAME") is not None:
         config_data["db_name"] = os.getenv("MONGODB_DB_NAME")
 
+    # SERVER_WORKERS, SERVER_LOOP, ..., MONGODB_MAX_POOL_SIZE, ... and METRICS_DIR, METRICS_INTERVAL
+    for section, prefix, fields in (("server", "SERVER_", ServerConfig.model_fields),
+                                    ("pool", "MONGODB_", PoolConfig.model_fields),
+                                    ("metrics", "METRICS_", MetricsConfig.model_fields)):
+        for field in fields:
+            value = os.getenv(prefix + field.upper())
+            if value is not None:
+                config_data.setdefault(section, {})[field] = value
+
+    if os.getenv("STATS_CACHE_TTL") is not None:
+        config_data["stats_cache_ttl"] = float(os.getenv("STATS_CACHE_TTL"))
+
     return Settings(**config_data)
 
 settings = load_settings()
+
+if __name__ == "__main__" and sys.argv[1:2] == ["new-key"]:
+    # uv run python server/config.py new-key NAME: prints a token for the client and its config entry
+    token = secrets.token_urlsafe(32)
+    name = sys.argv[2] if len(sys.argv) > 2 else "client"
+    print(f"Token (give to the client as --token): {token}")
+    print(f'[[auth.api_keys]]\nname = "{name}"\nhash = "{hash_api_key(token)}"')
@@ -1,52 +1,166 @@
+import asyncio
+import json
+import logging
+import re
 import secrets
-from fastapi import FastAPI, HTTPException, Body, Request, Depends, status, APIRouter
-from fastapi.responses import HTMLResponse
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from fastapi import FastAPI, HTTPException, Body, Request, Response, Depends, Query, status, APIRouter
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
-from fastapi.security import HTTPBasic, HTTPBasicCredentials
-from config import settings
-from pymongo import AsyncMongoClient
+from fastapi.security import HTTPBasic, HTTPBasicCredentials, HTTPBearer, HTTPAuthorizationCredentials
+from config import settings, check_api_key
+import metrics
+from pymongo import monitoring
+from pymongo import IndexModel, ASCENDING, UpdateOne, ReplaceOne, ReturnDocument
+from pymongo.errors import BulkWriteError, OperationFailure
 from pyodmongo import AsyncDbEngine, DbModel
 from pyodmongo.queries import mount_query_filter
 from bson import ObjectId
-from pydantic import BaseModel, Field
-from typing import Optional, List, ClassVar
-from common.models import DuplicateStatus, FileModel, ActionUpdate, VERSION, MIN_CLIENT_VERSION
+from pydantic import BaseModel, Field, ValidationError
+from typing import Optional, List, ClassVar, Dict, Any, Iterable, AsyncIterator
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from common.models import (
+    DuplicateStatus, FileModel, DirectoryModel, ActionUpdate, ActionReport, ActionStatus, Md5Lookup, SizeLookup, MerkleLookup, VanishedPaths,
+    UpsertResult, FileUpsertResponse,
+    DEFAULT_HASH_ALGO, VERSION, MIN_CLIENT_VERSION,
+)
 import semver
+from collections import Counter, defaultdict
+from functools import partial, lru_cache
 
 # export MONGODB_URL="mongodb+srv://localhost:27017/?retryWrites=true&w=majority"
 
+logger = logging.getLogger(__name__)
+
 security = HTTPBasic(auto_error=False)
+bearer = HTTPBearer(auto_error=False)
 
-def verify_version(request: Request):
-    client_version = request.headers.get("X-Client-Version")
-    if not client_version:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Missing X-Client-Version header",
-        )
-    
+# Upper bound on the number of hashes accepted by a single batch lookup
+MAX_LOOKUP_BATCH = 10000
+# Upper bound on the number of records accepted by a single bulk insert
+MAX_BULK_INSERT = 10000
+# Records written per bulk write by the NDJSON ingest endpoint, the most it buffers at once
+INGEST_BATCH_SIZE = 1000
+# Longest NDJSON line accepted, and the most per-line errors an ingest summary lists
+MAX_INGEST_LINE = 1024 * 1024
+MAX_INGEST_ERRORS = 1000
+# Page size of GET /files and /reports when no limit is given, and the most a page may hold
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# Indexes ensured on the files collection at startup
+FILE_INDEXES = [
+    # Client md5_eq lookups, optionally narrowed by hash_algo_eq; md5 alone uses the prefix
+    IndexModel([("md5", ASCENDING), ("hash_algo", ASCENDING)], name="md5_hash_algo"),
+    IndexModel([("host", ASCENDING), ("full_path", ASCENDING)], name="host_full_path", unique=True),
+    # Name + parent_dir duplicate checks
+    IndexModel([("parent_dir", ASCENDING), ("name", ASCENDING)], name="parent_dir_name"),
+    IndexModel([("size", ASCENDING)], name="size"),
+    # Dashboard search by name
+    IndexModel([("name", ASCENDING)], name="name"),
+]
+
+# Indexes ensured on the directories collection at startup
+DIRECTORY_INDEXES = [
+    # Identical subtrees share a Merkle hash, so duplicates are an equality lookup
+    IndexModel([("merkle", ASCENDING), ("hash_algo", ASCENDING)], name="merkle_hash_algo"),
+    IndexModel([("host", ASCENDING), ("full_path", ASCENDING)], name="host_full_path", unique=True),
+]
+
+# Materialized report collections, kept up to date by every write to the files and directories collections
+DUPLICATE_GROUPS = "duplicate_groups"
+DUPLICATE_DIRECTORIES = "duplicate_directories"
+# Cap on the entries listed per duplicate group, keeping each group below the 16 MB document limit;
+# count and the totals always cover every member
+MAX_GROUP_FILES = 1000
+# Record fields copied into duplicate group entries
+GROUP_FILE_FIELDS = ["name", "full_path", "parent_dir", "host", "size", "action"]
+GROUP_DIRECTORY_FIELDS = ["name", "full_path", "host"]
+# Fields of a stored record needed to take it out of its duplicate group
+REPORT_PROJECTION = {"md5": 1, "hash_algo": 1, "size": 1, "vanished_at": 1}
+DIRECTORY_REPORT_PROJECTION = {"merkle": 1, "hash_algo": 1}
+
+# Sent on every accepted /api/v1 response, see verify_version
+SERVER_HEADERS = {"X-Server-Version": VERSION}
+
+# Distinct X-Client-Version values whose check is remembered; a fleet sends a handful
+VERSION_CACHE_SIZE = 64
+
+@lru_cache(maxsize=VERSION_CACHE_SIZE)
+def check_client_version(client_version: str) -> Optional[tuple[int, str]]:
+    """Returns None if client_version is supported, else the status and detail to reject it with."""
     try:
         if semver.compare(client_version, MIN_CLIENT_VERSION) < 0:
-            raise HTTPException(
-                status_code=status.HTTP_426_UPGRADE_REQUIRED,
-                detail=f"Client version {client_version} is too old. Minimum required version is {MIN_CLIENT_VERSION}",
+            return (
+                status.HTTP_426_UPGRADE_REQUIRED,
+                f"Client version {client_version} is too old. Minimum required version is {MIN_CLIENT_VERSION}",
             )
     except ValueError:
+        return status.HTTP_400_BAD_REQUEST, f"Invalid X-Client-Version format: {client_version}"
+    return None
+
+def verify_version(request: Request, response: Response):
+    """Rejects unsupported clients; the semver check is memoized per header value.
+
+    Accepted responses carry X-Server-Version, so a client can check the server's
+    version from any reply instead of probing /version again. FastAPI only copies it
+    from the injected response into handler return values it serializes itself;
+    handlers returning a Response pass SERVER_HEADERS explicitly.
+    """
+    client_version = request.headers.get("X-Client-Version")
+    if not client_version:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Invalid X-Client-Version format: {client_version}",
+            detail="Missing X-Client-Version header",
         )
+    if rejected := check_client_version(client_version):
+        raise HTTPException(status_code=rejected[0], detail=rejected[1])
+    response.headers.update(SERVER_HEADERS)
     return client_version
 
-def get_current_username(credentials: HTTPBasicCredentials = Depends(security)):
+@lru_cache(maxsize=settings.auth.token_cache_size)
+def matching_api_key(token: str) -> str:
+    """Returns the name of the configured API key that token matches.
+
+    Raises LookupError when none does. lru_cache does not keep exceptions, so only
+    verified tokens are remembered and random tokens cannot evict them.
+    """
+    for api_key in settings.auth.api_keys:
+        if check_api_key(token, api_key.hash):
+            return api_key.name
+    raise LookupError("No matching API key")
+
+def verify_api_key(token: str) -> Optional[str]:
+    """Returns the name of the configured API key that token matches, or None."""
+    try:
+        return matching_api_key(token)
+    except LookupError:
+        return None
+
+def get_current_username(credentials: Optional[HTTPBasicCredentials] = Depends(security),
+                         token: Optional[HTTPAuthorizationCredentials] = Depends(bearer)):
     if not settings.auth.enabled:
         return "anonymous"
 
-    if not credentials:
+    if token:
+        name = verify_api_key(token.credentials)
+        if name is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid token",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        return name
+
+    if not credentials or not settings.auth.basic:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Not authenticated",
-            headers={"WWW-Authenticate": "Basic"},
+            headers={"WWW-Authenticate": "Bearer" if not settings.auth.basic else "Basic"},
         )
 
     correct_username = settings.auth.username
@@ -64,7 +178,270 @@ def get_current_username(credentials: HTTPBasicCredentials = Depends(security)):
         )
     return credentials.username
 
-app = FastAPI(dependencies=[Depends(get_current_username)])
+async def ensure_indexes():
+    """Creates FILE_INDEXES and DIRECTORY_INDEXES one at a time so one failing index does not block the rest."""
+    for collection_name, indexes in (
+        (FileModel._collection, FILE_INDEXES),
+        (DirectoryModel._collection, DIRECTORY_INDEXES),
+    ):
+        collection = engine._db[collection_name]
+        for index in indexes:
+            try:
+                await collection.create_indexes([index])
+            except OperationFailure as e:
+                # e.g. the unique full_path index while duplicate paths are still stored
+                logger.warning(f"Could not create index {index.document['name']} on {collection_name}: {e}")
+
+def group_key(md5: str, hash_algo: Optional[str]) -> str:
+    """Key of the duplicate group for a digest; records without hash_algo are MD5s."""
+    return f"{hash_algo or DEFAULT_HASH_ALGO}:{md5}"
+
+def group_entry(record: Dict[str, Any], entry_fields: List[str]) -> Dict[str, Any]:
+    """A record's entry in its duplicate group: its id and entry_fields."""
+    record_id = record.get("_id", record.get("id"))
+    return {"_id": str(record_id), **{field: record.get(field) for field in entry_fields}}
+
+# Set on groups with two or more members, the only ones /reports lists; its sparse index
+# leaves out the groups of hashes held by a single record
+REPORT_KEY = {"$cond": [{"$gt": ["$count", 1]}, "$_id", "$$REMOVE"]}
+REPORT_INDEXES = [IndexModel([("report_key", ASCENDING)], name="report_key", sparse=True)]
+
+def group_stages(hash_field: str, entries: str, entry_fields: List[str], totals: Dict[str, Any]) -> list:
+    """Aggregation stages producing one group document per (hash_algo, hash_field).
+
+    The first MAX_GROUP_FILES members are listed under entries, each with its id and
+    entry_fields; $firstN keeps the listing bounded however large the group is.
+    """
+    hash_algo = {"$ifNull": ["$hash_algo", DEFAULT_HASH_ALGO]}
+    entry = {"_id": {"$toString": "$_id"}, **{field: f"${field}" for field in entry_fields}}
+    return [
+        {"$group": {
+            "_id": {"$concat": [hash_algo, ":", f"${hash_field}"]},
+            hash_field: {"$first": f"${hash_field}"},
+            "hash_algo": {"$first": hash_algo},
+            "count": {"$sum": 1},
+            **totals,
+            entries: {"$firstN": {"input": entry, "n": MAX_GROUP_FILES}},
+        }},
+        {"$set": {"report_key": REPORT_KEY}},
+    ]
+
+def duplicate_group_stages() -> list:
+    """Groups file records by content digest, leaving out vanished files."""
+    return [{"$match": {"vanished_at": None}}, *group_stages("md5", "files", GROUP_FILE_FIELDS, {"total_size": {"$sum": "$size"}})]
+
+def duplicate_directory_stages() -> list:
+    """Groups directory records by Merkle hash; every member holds the same files and bytes."""
+    return group_stages("merkle", "directories", GROUP_DIRECTORY_FIELDS, {
+        "file_count": {"$first": "$file_count"},
+        "size": {"$first": "$size"},
+    })
+
+async def ensure_report_collections():
+    """Builds the report collections from their sources the first time they are missing.
+
+    Every hash gets a group, a single record's too, so that writes can keep the member
+    counts with increments alone (see update_groups).
+
+    Drop a report collection and restart the server to rebuild it from scratch.
+    """
+    db = engine._db
+    existing = await db.list_collection_names()
+    builds = {
+        DUPLICATE_GROUPS: (FileModel._collection, duplicate_group_stages()),
+        DUPLICATE_DIRECTORIES: (DirectoryModel._collection, duplicate_directory_stages()),
+    }
+    for name, (source, stages) in builds.items():
+        if name in existing:
+            continue
+        logger.info(f"Building {name} from the {source} collection")
+        await db.create_collection(name)
+        await db[name].create_indexes(REPORT_INDEXES)
+        cursor = db[source].aggregate([
+            *stages,
+            {"$merge": {"into": name, "whenMatched": "replace"}},
+        ], allowDiskUse=True)
+        await cursor.to_list(length=None)
+
+# Running totals of the files collection: one document per bucket ("total", "kind/<kind>",
+# "duplicate_status/<status>") holding {files, size}, kept current by every write
+FILE_STATS = "file_stats"
+STATS_BREAKDOWNS = ("kind", "duplicate_status")
+STATS_PROJECTION = {"host": 1, "full_path": 1, "size": 1, "kind": 1, "duplicate_status": 1}
+_stats_cache: Dict[str, Any] = {"expires": 0.0, "stats": None}
+
+def stats_buckets(record: Dict[str, Any]) -> List[str]:
+    buckets = ["total"]
+    for field in STATS_BREAKDOWNS:
+        value = record.get(field)
+        buckets.append(f"{field}/{getattr(value, 'value', value)}")
+    return buckets
+
+async def update_stats(added: Iterable[Dict[str, Any]], removed: Iterable[Dict[str, Any]] = ()):
+    """Applies written and replaced or deleted file records to the running totals.
+
+    Each bucket's net change is applied with an atomic $inc, so concurrent writers
+    never lose updates; a record written unchanged adds and removes the same amounts.
+    """
+    deltas: Dict[str, Counter] = defaultdict(Counter)
+    for records, sign in ((added, 1), (removed, -1)):
+        for record in records:
+            for bucket in stats_buckets(record):
+                deltas[bucket]["files"] += sign
+                deltas[bucket]["size"] += sign * (record.get("size") or 0)
+    operations = [
+        UpdateOne({"_id": bucket}, {"$inc": {"files": delta["files"], "size": delta["size"]}}, upsert=True)
+        for bucket, delta in deltas.items() if delta["files"] or delta["size"]
+    ]
+    if operations:
+        await engine._db[FILE_STATS].bulk_write(operations, ordered=False)
+        # This process sees its own writes at once; other workers within the cache TTL
+        _stats_cache["expires"] = 0.0
+
+async def rebuild_stats():
+    """Recomputes the running totals from the whole files collection."""
+    db = engine._db
+    facets = {"total": [{"$group": {"_id": "total", "files": {"$sum": 1}, "size": {"$sum": "$size"}}}]}
+    for field in STATS_BREAKDOWNS:
+        facets[field] = [
+            {"$group": {"_id": f"${field}", "files": {"$sum": 1}, "size": {"$sum": "$size"}}},
+            {"$set": {"_id": {"$concat": [f"{field}/", {"$toString": "$_id"}]}}},
+        ]
+    cursor = db[FileModel._collection].aggregate([{"$facet": facets}], allowDiskUse=True)
+    results = await cursor.to_list(length=1)
+    buckets = [bucket for facet in (results[0] if results else {}).values() for bucket in facet]
+    if not buckets:
+        buckets = [{"_id": "total", "files": 0, "size": 0}]
+    await db[FILE_STATS].delete_many({"_id": {"$nin": [bucket["_id"] for bucket in buckets]}})
+    await db[FILE_STATS].bulk_write(
+        [ReplaceOne({"_id": bucket["_id"]}, bucket, upsert=True) for bucket in buckets], ordered=False
+    )
+    _stats_cache["expires"] = 0.0
+
+async def ensure_stats():
+    """Builds the running totals the first time they are missing."""
+    if await engine._db[FILE_STATS].find_one({"_id": "total"}) is None:
+        logger.info(f"Building {FILE_STATS} from the {FileModel._collection} collection")
+        await rebuild_stats()
+
+async def update_groups(target: str, hash_field: str, entries: str, entry_fields: List[str],
+                        totals: Dict[str, str], shared: List[str],
+                        added: Iterable[Dict[str, Any]], removed: Iterable[Dict[str, Any]]):
+    """Applies written and replaced or deleted records to their groups in the target collection.
+
+    Each group gets one atomic pipeline update: count and the totals fields (summed from
+    the record field they name) move by the net change, shared fields are copied from an
+    added record, and entries drop the members removed and list the ones added, up to
+    MAX_GROUP_FILES. Concurrent writers' updates commute, and no group is recomputed
+    from the source collection. A record both removed and added, e.g. one whose
+    action changed, has its entry replaced.
+    """
+    changes: Dict[str, Dict[str, Any]] = {}
+    for records, sign in ((removed, -1), (added, 1)):
+        for record in records:
+            key = group_key(record[hash_field], record.get("hash_algo"))
+            change = changes.setdefault(key, {
+                "hash": record[hash_field], "count": 0, "totals": Counter(), "shared": {}, "dropped": [], "entries": [],
+            })
+            change["count"] += sign
+            for field, source in totals.items():
+                change["totals"][field] += sign * (record.get(source) or 0)
+            entry = group_entry(record, entry_fields)
+            change["dropped"].append(entry["_id"])
+            if sign > 0:
+                change["shared"].update({field: record.get(field) for field in shared})
+                change["entries"].append(entry)
+    if not changes:
+        return
+
+    operations = []
+    for key, change in changes.items():
+        kept = {"$filter": {
+            "input": {"$ifNull": [f"${entries}", []]},
+            "cond": {"$not": [{"$in": ["$$this._id", {"$literal": change["dropped"]}]}]},
+        }}
+        update = {
+            hash_field: {"$literal": change["hash"]},
+            "hash_algo": {"$literal": key.split(":", 1)[0]},
+            "count": {"$add": [{"$ifNull": ["$count", 0]}, change["count"]]},
+            **{field: {"$add": [{"$ifNull": [f"${field}", 0]}, change["totals"][field]]} for field in totals},
+            **{field: {"$literal": value} for field, value in change["shared"].items()},
+            entries: {"$slice": [{"$concatArrays": [kept, {"$literal": change["entries"]}]}, MAX_GROUP_FILES]},
+        }
+        operations.append(UpdateOne({"_id": key}, [{"$set": update}, {"$set": {"report_key": REPORT_KEY}}], upsert=True))
+    collection = engine._db[target]
+    await collection.bulk_write(operations, ordered=False)
+    # An add racing this delete has already raised the count, so it never loses its group
+    await collection.delete_many({"_id": {"$in": list(changes)}, "count": {"$lte": 0}})
+
+async def refresh_reports(added: Iterable[Dict[str, Any]], removed: Iterable[Dict[str, Any]] = ()):
+    """Applies written and replaced, deleted or vanished live file records to the duplicate groups."""
+    await update_groups(DUPLICATE_GROUPS, "md5", "files", GROUP_FILE_FIELDS, {"total_size": "size"}, [],
+                        added, removed)
+
+async def refresh_directory_reports(added: Iterable[Dict[str, Any]], removed: Iterable[Dict[str, Any]] = ()):
+    """Applies written and replaced or deleted directory records to the duplicate directory groups."""
+    await update_groups(DUPLICATE_DIRECTORIES, "merkle", "directories", GROUP_DIRECTORY_FIELDS, {},
+                        ["file_count", "size"], added, removed)
+
+def pool_uri(url: str, options: Dict[str, Any]) -> str:
+    """Adds connection pool options to a MongoDB connection string, replacing any it already sets."""
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query))
+    query.update({name: str(value) for name, value in options.items()})
+    return urlunsplit(parts._replace(path=parts.path or "/", query=urlencode(query)))
+
+def create_engine() -> AsyncDbEngine:
+    """Connects with the configured pool; each worker process gets its own engine and pool."""
+    return AsyncDbEngine(mongo_uri=pool_uri(settings.mongodb_url, settings.pool.uri_options()),
+                         db_name=settings.db_name)
+
+def save_metrics(directory: str):
+    try:
+        metrics.write_snapshot(directory)
+    except OSError as e:
+        logger.warning(f"Could not write metrics snapshot to {directory}: {e}")
+
+def withdraw_metrics(directory: str):
+    try:
+        metrics.remove_snapshot(directory)
+    except OSError as e:
+        logger.warning(f"Could not remove metrics snapshot from {directory}: {e}")
+
+async def share_metrics(directory: str, interval: float):
+    """Keeps this worker's metrics snapshot current for the other workers' /metrics."""
+    while True:
+        save_metrics(directory)
+        await asyncio.sleep(interval)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global engine
+    # An engine set before startup (e.g. by tests) is used as is and left open
+    owned = engine is None
+    if owned:
+        engine = create_engine()
+        logger.info(f"Connected to {settings.db_name} with pool options {settings.pool.uri_options()}")
+    snapshots = None
+    try:
+        await ensure_indexes()
+        await ensure_report_collections()
+        await ensure_stats()
+        if settings.metrics.dir:
+            snapshots = asyncio.create_task(share_metrics(settings.metrics.dir, settings.metrics.interval))
+        yield
+    finally:
+        if snapshots:
+            snapshots.cancel()
+            withdraw_metrics(settings.metrics.dir)
+        if owned:
+            engine._client.close()
+            engine = None
+
+app = FastAPI(dependencies=[Depends(get_current_username)], lifespan=lifespan)
+app.add_middleware(metrics.MetricsMiddleware)
+# Registered before any client is created, so every connection reports its commands
+monitoring.register(metrics.CommandMetrics())
 templates = Jinja2Templates(directory="server/templates")
 api_router = APIRouter(prefix="/api/v1", dependencies=[Depends(verify_version)])
 
@@ -72,25 +449,465 @@ api_router = APIRouter(prefix="/api/v1", dependencies=[Depends(verify_version)])
 async def get_version():
     return {"version": VERSION, "min_client_version": MIN_CLIENT_VERSION}
 
-engine = AsyncDbEngine(mongo_uri=settings.mongodb_url, db_name=settings.db_name)
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Request and MongoDB command metrics in the Prometheus text format, summed over all workers."""
+    others = metrics.read_snapshots(settings.metrics.dir, settings.metrics.interval) if settings.metrics.dir else ()
+    return PlainTextResponse(metrics.registry.render(others), media_type=metrics.CONTENT_TYPE)
+
+# Created by lifespan in each worker process, so no connection outlives its event loop
+engine: Optional[AsyncDbEngine] = None
+
+# Fields owned by the server that re-ingesting a file must not overwrite
+SERVER_MANAGED_FIELDS = {
+    "id", "created_at", "updated_at", "action", "action_args", "action_status", "action_error", "action_at",
+}
+
+def upsert_spec(model: FileModel | DirectoryModel, now: datetime) -> tuple[dict, list]:
+    """Builds the filter and update of an idempotent upsert keyed on (host, full_path).
+
+    The update is a pipeline so updated_at only moves, and MongoDB only reports a
+    modification, when some ingested field actually changed. Values are wrapped in
+    $literal because paths may start with '$'.
+    """
+    fields = model.model_dump(mode="json", exclude=SERVER_MANAGED_FIELDS)
+    unchanged = {"$and": [{"$eq": [f"${name}", {"$literal": value}]} for name, value in fields.items()]}
+    update = {name: {"$literal": value} for name, value in fields.items()}
+    if isinstance(model, FileModel):
+        update["action"] = {"$ifNull": ["$action", {"$literal": model.action}]}
+        update["action_args"] = {"$ifNull": ["$action_args", {"$literal": model.action_args}]}
+    update["created_at"] = {"$ifNull": ["$created_at", now]}
+    update["updated_at"] = {"$cond": [unchanged, "$updated_at", now]}
+    return {"host": model.host, "full_path": model.full_path}, [{"$set": update}]
+
+def is_unchanged(model: FileModel | DirectoryModel, stored: Dict[str, Any]) -> bool:
+    """Whether the stored record already holds every ingested field of model, as upsert_spec compares them."""
+    fields = model.model_dump(mode="json", exclude=SERVER_MANAGED_FIELDS)
+    return all(stored.get(name) == value for name, value in fields.items())
+
+def is_live(record: Optional[Dict[str, Any]]) -> bool:
+    """Whether a stored record counts in the duplicate reports: it exists and has not vanished."""
+    return record is not None and record.get("vanished_at") is None
+
+async def bulk_upsert(Model, records: List[Dict[str, Any]]) -> tuple[dict, list]:
+    """Upserts records with one unordered bulk write keyed on (host, full_path).
+
+    Returns the response counts and sorted per-record-index errors, and a (record,
+    previous) pair for every record the write inserted or changed, previous being the
+    stored version it replaced (None for an insert), for updating the reports.
+
+    Previous versions are read just before the write, not by it. A record that the bulk
+    write did not insert but that was missing at the read was inserted concurrently, and
+    that writer accounts for it, so the path is never counted twice. Two bulk writes
+    replacing one stored version at the same time can still both remove it from the
+    totals; POST /stats/rebuild corrects them.
+    """
+    if len(records) > MAX_BULK_INSERT:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {MAX_BULK_INSERT} records may be inserted per request",
+        )
+
+    errors = []
+    operations = []
+    positions = []
+    models = []
+    now = datetime.now(timezone.utc)
+    for index, record in enumerate(records):
+        try:
+            model = Model(**record)
+        except ValidationError as e:
+            errors.append({"index": index, "error": str(e)})
+            continue
+        operations.append(UpdateOne(*upsert_spec(model, now), upsert=True))
+        positions.append(index)
+        models.append(model)
+
+    counts = {"nUpserted": 0, "nModified": 0, "nMatched": 0}
+    changes = []
+    if operations:
+        collection = engine._db[Model._collection]
+        paths = defaultdict(list)
+        for model in models:
+            paths[model.host].append(model.full_path)
+        # One clause per host, so each is a range on the host_full_path index
+        query = {"$or": [{"host": host, "full_path": {"$in": host_paths}} for host, host_paths in paths.items()]}
+        previous = {(record.get("host"), record["full_path"]): record
+                    for record in await collection.find(query).to_list(length=None)}
+        failed = set()
+        try:
+            result = await collection.bulk_write(operations, ordered=False)
+            counts = result.bulk_api_result
+        except BulkWriteError as e:
+            counts = e.details
+            for write_error in e.details.get("writeErrors", []):
+                failed.add(write_error["index"])
+                errors.append({
+                    "index": positions[write_error["index"]],
+                    "error": write_error.get("errmsg", "write failed"),
+                })
+        upserted = {upsert["index"]: upsert["_id"] for upsert in counts.get("upserted", [])}
+        for i, model in enumerate(models):
+            stored = previous.get((model.host, model.full_path))
+            if i in failed or (stored is not None and is_unchanged(model, stored)):
+                continue
+            if i in upserted:
+                model.id, stored = upserted[i], None
+            elif stored is not None:
+                model.id = stored["_id"]
+            else:
+                # Inserted by a concurrent write since the read; that write accounted for it
+                continue
+            changes.append((model.model_dump(), stored))
+        if Model is FileModel:
+            await update_stats([record for record, _ in changes], [stored for _, stored in changes if stored])
+
+    errors.sort(key=lambda error: error["index"])
+    summary = {
+        "inserted": counts.get("nUpserted", 0),
+        "updated": counts.get("nModified", 0),
+        "unchanged": counts.get("nMatched", 0) - counts.get("nModified", 0),
+        "failed": len(errors),
+        "errors": errors,
+    }
+    return summary, changes
+
+async def refresh_file_changes(changes: List[tuple[dict, Optional[dict]]]):
+    """Applies bulk_upsert's changed file records to the duplicate groups."""
+    await refresh_reports([record for record, _ in changes], [stored for _, stored in changes if is_live(stored)])
+
+def page_size(limit: Optional[int]) -> int:
+    """Page size for a requested limit, capped at MAX_PAGE_SIZE."""
+    return min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+
+def wants_ndjson(request: Request, format: Optional[str]) -> bool:
+    """Whether the caller asked for an NDJSON stream, by ?format=ndjson or the Accept header."""
+    if format is not None:
+        return format == "ndjson"
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
 
-@api_router.post("/files/", response_model=FileModel)
+def file_projection(fields: Optional[str]) -> Optional[Dict[str, int]]:
+    """Parses ?fields=name,md5,size into a MongoDB projection; None returns whole records."""
+    if not fields:
+        return None
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in FileModel.model_fields]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    # An empty projection would return whole documents, so always name _id
+    return {"_id": 1, **{name: 1 for name in names if name != "id"}}
+
+def serialize_file(doc: Dict[str, Any], projection: Optional[Dict[str, int]]) -> Dict[str, Any]:
+    """Renders a raw record as JSON-ready data, in full FileModel shape unless projected."""
+    if projection is None:
+        return FileModel.model_validate(doc).model_dump(mode="json")
+    return jsonable_encoder({"id": str(doc["_id"]), **{k: v for k, v in doc.items() if k != "_id"}})
+
+def parse_cursor(after: Optional[str]) -> Optional[ObjectId]:
+    if after is None:
+        return None
+    if not ObjectId.is_valid(after):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return ObjectId(after)
+
+async def ndjson_stream(*parts):
+    """Yields one JSON line per document of each (cursor, serialize) part, a batch at a time."""
+    for cursor, serialize in parts:
+        async for doc in cursor:
+            yield json.dumps(serialize(doc)) + "\n"
+
+@api_router.post("/files/", response_model=FileUpsertResponse)
 async def create_file(request: Request):
-    #  data = file.dict(by_alias=True, exclude=["id"])
+    """Inserts a record, or updates the stored record for the same host and path if it changed."""
     data = await request.json()
     file_model = FileModel(**data)
-    result = await engine.save(file_model)
-    #data["_id"] = str(result.upserted_ids)
-    return file_model
+    collection = engine._db[FileModel._collection]
+    query, update = upsert_spec(file_model, datetime.now(timezone.utc))
+    # The version replaced comes from the write itself, so concurrent writers to one path
+    # each account for exactly the version they replaced
+    previous = await collection.find_one_and_update(query, update, upsert=True,
+                                                    return_document=ReturnDocument.BEFORE)
+    if previous is None:
+        # _id never changes, so this is the inserted record's even if it was written again since
+        file_model.id = (await collection.find_one(query, {"_id": 1}))["_id"]
+        outcome = UpsertResult.INSERTED
+    else:
+        file_model.id = previous["_id"]
+        outcome = UpsertResult.UNCHANGED if is_unchanged(file_model, previous) else UpsertResult.UPDATED
+    if outcome != UpsertResult.UNCHANGED:
+        # The previous hash loses this record, the new one gains it
+        await refresh_reports([file_model.model_dump()], [previous] if is_live(previous) else [])
+        await update_stats([file_model.model_dump()], [previous] if previous else [])
+    return {"result": outcome, "file": file_model}
+
+@api_router.post("/files/sizes")
+async def lookup_sizes(lookup: SizeLookup):
+    """Returns which of the given sizes are already present in the collection."""
+    if len(lookup.sizes) > MAX_LOOKUP_BATCH:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {MAX_LOOKUP_BATCH} sizes may be looked up per request",
+        )
+    if not lookup.sizes:
+        return {"sizes": []}
+    collection = engine._db[FileModel._collection]
+    sizes = await collection.distinct("size", {"size": {"$in": list(set(lookup.sizes))}})
+    return {"sizes": sorted(sizes)}
+
+@api_router.post("/files/bulk")
+async def create_files_bulk(records: List[Dict[str, Any]] = Body(...)):
+    """Upserts many records with one unordered bulk write, reporting failures per record index.
+
+    Records are keyed on (host, full_path) like create_file, so re-posting a batch is idempotent.
+    """
+    summary, changes = await bulk_upsert(FileModel, records)
+    await refresh_file_changes(changes)
+    return summary
 
-@api_router.get("/files/", response_model=List[FileModel])
-async def get_files(request: Request):
+async def read_lines(chunks: AsyncIterator[bytes], max_line: int = MAX_INGEST_LINE) -> AsyncIterator[Optional[bytes]]:
+    """Splits a byte stream into lines as it arrives, yielding None for lines over max_line bytes."""
+    buffer = bytearray()
+    oversized = False
+    async for chunk in chunks:
+        buffer += chunk
+        while (end := buffer.find(b"\n")) >= 0:
+            yield None if oversized or end > max_line else bytes(buffer[:end])
+            del buffer[:end + 1]
+            oversized = False
+        if len(buffer) > max_line:
+            # Drop the rest of the line instead of buffering it
+            oversized = True
+            buffer.clear()
+    if buffer or oversized:
+        yield None if oversized or len(buffer) > max_line else bytes(buffer)
+
+@api_router.post("/files/ingest")
+async def ingest_files(request: Request):
+    """Upserts records streamed as NDJSON, one FileModel per line, without buffering the body.
+
+    Lines are validated as they arrive and written INGEST_BATCH_SIZE at a time; the body
+    is not read further until each batch is written, so a slow database slows the upload
+    rather than filling memory. Errors are reported by 1-based line number.
+    """
+    totals = Counter(lines=0, inserted=0, updated=0, unchanged=0, failed=0)
+    errors = []
+    batch: List[Dict[str, Any]] = []
+    batch_lines: List[int] = []
+
+    def fail(line_number: int, error: str) -> None:
+        totals["failed"] += 1
+        if len(errors) < MAX_INGEST_ERRORS:
+            errors.append({"line": line_number, "error": error})
+
+    async def flush() -> None:
+        summary, changes = await bulk_upsert(FileModel, batch)
+        await refresh_file_changes(changes)
+        for name in ("inserted", "updated", "unchanged"):
+            totals[name] += summary[name]
+        for error in summary["errors"]:
+            fail(batch_lines[error["index"]], error["error"])
+        batch.clear()
+        batch_lines.clear()
+
+    line_number = 0
+    async for line in read_lines(request.stream(), MAX_INGEST_LINE):
+        line_number += 1
+        if line is None:
+            fail(line_number, f"Line exceeds {MAX_INGEST_LINE} bytes")
+            continue
+        if not line.strip():
+            continue
+        totals["lines"] += 1
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            fail(line_number, f"Invalid JSON: {e}")
+            continue
+        if not isinstance(record, dict):
+            fail(line_number, "Expected a JSON object")
+            continue
+        batch.append(record)
+        batch_lines.append(line_number)
+        if len(batch) >= INGEST_BATCH_SIZE:
+            await flush()
+    if batch:
+        await flush()
+
+    errors.sort(key=lambda error: error["line"])
+    return {**totals, "errors": errors, "errors_truncated": totals["failed"] > len(errors)}
+
+@api_router.post("/files/vanished")
+async def mark_vanished(vanished: VanishedPaths):
+    """Marks the records of paths a rescan of host found deleted, and drops them from the reports.
+
+    Directory records at and below the listed directories are deleted: a subtree that is
+    gone no longer duplicates anything, and a rescan posts it again if it comes back.
+    """
+    if len(vanished.full_paths) + len(vanished.directories) > MAX_LOOKUP_BATCH:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {MAX_LOOKUP_BATCH} paths may be marked per request",
+        )
+    if not vanished.full_paths and not vanished.directories:
+        return {"marked": 0, "directories_removed": 0}
+    collection = engine._db[FileModel._collection]
+    query = {"host": vanished.host, "full_path": {"$in": vanished.full_paths}, "vanished_at": None}
+    if vanished.directories:
+        # Anchored prefix regexes can still use the full_path index
+        prefixes = [{"full_path": {"$regex": "^" + re.escape(directory.rstrip("/") + "/")}}
+                    for directory in vanished.directories]
+        query["$or"] = [{"full_path": query.pop("full_path")}, *prefixes]
+    affected = await collection.find(query, REPORT_PROJECTION).to_list(length=None)
+    now = datetime.now(timezone.utc)
+    result = await collection.update_many(query, {"$set": {"vanished_at": now, "updated_at": now}})
+    await refresh_reports([], affected)
+
+    directories_removed = 0
+    if vanished.directories:
+        directories = engine._db[DirectoryModel._collection]
+        dir_query = {"host": vanished.host, "$or": [
+            {"full_path": {"$in": [directory.rstrip("/") for directory in vanished.directories]}}, *prefixes,
+        ]}
+        removed = await directories.find(dir_query, DIRECTORY_REPORT_PROJECTION).to_list(length=None)
+        deleted = await directories.delete_many(dir_query)
+        directories_removed = deleted.deleted_count
+        await refresh_directory_reports([], removed)
+    return {"marked": result.modified_count, "directories_removed": directories_removed}
+
+# Actions that leave nothing at the acted-on path
+REMOVING_ACTIONS = {"rm", "mv"}
+
+@api_router.post("/files/actions/report")
+async def report_actions(reports: List[ActionReport]):
+    """Records the outcomes of actions clients ran, one bulk write per request.
+
+    Files removed or moved away by a completed action are marked vanished, like
+    /files/vanished, and dropped from the reports.
+    """
+    if len(reports) > MAX_BULK_INSERT:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {MAX_BULK_INSERT} action reports may be sent per request",
+        )
+    if not reports:
+        return {"matched": 0, "modified": 0}
+    collection = engine._db[FileModel._collection]
+    now = datetime.now(timezone.utc)
+    operations = []
+    removed = []
+    for report in reports:
+        key = {"host": report.host, "full_path": report.full_path}
+        update = {"action_status": report.status.value, "action_error": report.error, "action_at": now, "updated_at": now}
+        if report.status == ActionStatus.DONE and report.action.lower() in REMOVING_ACTIONS:
+            update["vanished_at"] = now
+            removed.append(key)
+        operations.append(UpdateOne(key, {"$set": update}))
+    affected = []
+    if removed:
+        affected = await collection.find({"$or": removed, "vanished_at": None}, REPORT_PROJECTION).to_list(length=None)
+    result = await collection.bulk_write(operations, ordered=False)
+    await refresh_reports([], affected)
+    return {"matched": result.matched_count, "modified": result.modified_count}
+
+@api_router.post("/directories/bulk")
+async def create_directories_bulk(records: List[Dict[str, Any]] = Body(...)):
+    """Upserts directory records (see DirectoryModel) like /files/bulk."""
+    summary, changes = await bulk_upsert(DirectoryModel, records)
+    await refresh_directory_reports([record for record, _ in changes], [stored for _, stored in changes if stored])
+    return summary
+
+@api_router.post("/directories/lookup", response_model=Dict[str, List[DirectoryModel]])
+async def lookup_directories(lookup: MerkleLookup):
+    """Returns every directory record with any of the given Merkle hashes, grouped by hash."""
+    if len(lookup.merkles) > MAX_LOOKUP_BATCH:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {MAX_LOOKUP_BATCH} hashes may be looked up per request",
+        )
+    grouped: Dict[str, List[DirectoryModel]] = {}
+    if not lookup.merkles:
+        return grouped
+    directories = await engine.find_many(
+        Model=DirectoryModel,
+        raw_query={"merkle": {"$in": list(set(lookup.merkles))}, "hash_algo": lookup.hash_algo},
+    )
+    for directory in directories:
+        grouped.setdefault(directory.merkle, []).append(directory)
+    return grouped
+
+@api_router.get("/files/")
+async def get_files(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1),
+    after: Optional[str] = None,
+    fields: Optional[str] = None,
+    format: Optional[str] = None,
+):
+    """Lists records matching the query string filters, one page at a time.
+
+    Pages are ordered by _id; when more records follow, the X-Next-Cursor header holds
+    the value to pass as ?after= for the next page. A custom sort returns a single page.
+    With ?format=ndjson (or Accept: application/x-ndjson) every match is streamed instead,
+    up to ?limit= when given.
+    """
     query, sort = mount_query_filter(
         Model=FileModel,
         items=request.query_params._dict,
         initial_comparison_operators=[],
     )
-    return await engine.find_many(Model=FileModel, query=query, sort=sort)
+    projection = file_projection(fields)
+    raw_query = query.to_dict() if query else {}
+    if "md5_eq" in request.query_params:
+        # Validating a file by digest, as /files/lookup does: a deleted copy is no longer a duplicate
+        raw_query = {"$and": [raw_query, {"vanished_at": None}]}
+    cursor_id = parse_cursor(after)
+    if cursor_id is not None:
+        raw_query = {"$and": [raw_query, {"_id": {"$gt": cursor_id}}]}
+    raw_sort = list(sort.to_dict().items()) if sort else [("_id", ASCENDING)]
+    collection = engine._db[FileModel._collection]
+
+    if wants_ndjson(request, format):
+        cursor = collection.find(raw_query, projection, sort=raw_sort, limit=limit or 0)
+        serialize = partial(serialize_file, projection=projection)
+        return StreamingResponse(ndjson_stream((cursor, serialize)), media_type=NDJSON_MEDIA_TYPE,
+                                 headers=SERVER_HEADERS)
+
+    size = page_size(limit)
+    docs = await collection.find(raw_query, projection, sort=raw_sort, limit=size + 1).to_list(length=None)
+    headers = dict(SERVER_HEADERS)
+    if len(docs) > size:
+        docs = docs[:size]
+        if not sort:
+            headers["X-Next-Cursor"] = str(docs[-1]["_id"])
+    return JSONResponse([serialize_file(doc, projection) for doc in docs], headers=headers)
+
+@api_router.post("/files/lookup", response_model=Dict[str, List[FileModel]])
+async def lookup_files(lookup: Md5Lookup):
+    """Returns every record matching any of the given digests of hash_algo, grouped by digest."""
+    if len(lookup.md5s) > MAX_LOOKUP_BATCH:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {MAX_LOOKUP_BATCH} hashes may be looked up per request",
+        )
+    grouped: Dict[str, List[FileModel]] = {}
+    if not lookup.md5s:
+        return grouped
+    # Records written before hash_algo existed have no such field and are MD5s
+    hash_algos = [lookup.hash_algo]
+    if lookup.hash_algo == DEFAULT_HASH_ALGO:
+        hash_algos.append(None)
+    files = await engine.find_many(
+        Model=FileModel,
+        raw_query={
+            "hash_algo": {"$in": hash_algos},
+            "md5": {"$in": list(set(lookup.md5s))},
+            # A deleted copy is no longer a duplicate
+            "vanished_at": None,
+        },
+    )
+    for file in files:
+        grouped.setdefault(file.md5, []).append(file)
+    return grouped
 
 @api_router.get("/files/{id}", response_model=FileModel)
 async def get_file(id: str):
@@ -101,10 +918,15 @@ async def get_file(id: str):
 
 @api_router.delete("/files/{id}")
 async def delete_file(id: str):
+    file = await engine.find_one(Model=FileModel, query={"_id": ObjectId(id)})
+    if not file:
+        raise HTTPException(status_code=404, detail="File not found")
     # pyodmongo delete expects query
     response = await engine.delete(Model=FileModel, query={"_id": ObjectId(id)})
     if response.deleted_count == 0:
          raise HTTPException(status_code=404, detail="File not found")
+    await refresh_reports([], [file.model_dump()] if file.vanished_at is None else [])
+    await update_stats([], [file.model_dump()])
     return {"status": "deleted", "count": response.deleted_count}
 
 @api_router.put("/files/{id}/action", response_model=FileModel)
@@ -116,109 +938,130 @@ async def update_file_action(id: str, action_update: ActionUpdate):
     file.action = action_update.action
     file.action_args = action_update.action_args
     await engine.save(file)
+    # Duplicate group entries carry the action shown on the dashboard
+    if file.vanished_at is None:
+        await refresh_reports([file.model_dump()], [file.model_dump()])
     return file
 
 @api_router.get("/stats")
 async def get_stats():
-    collection = engine._db[FileModel._collection]
-    pipeline = [
-        {
-            "$group": {
-                "_id": None,
-                "total_files": {"$sum": 1},
-                "total_size": {"$sum": "$size"}
-            }
-        }
-    ]
-    cursor = collection.aggregate(pipeline)
-    results = await cursor.to_list(length=1)
-    if not results:
-        return {"total_files": 0, "total_size": 0}
-    return {
-        "total_files": results[0]["total_files"],
-        "total_size": results[0]["total_size"]
-    }
+    """Returns the running totals, with breakdowns by kind and duplicate status.
 
-app.include_router(api_router)
+    The totals cover every stored record, vanished ones included, as GET /files lists
+    them and /stats/rebuild counts them; only the duplicate reports leave vanished files out.
 
-@app.get("/reports")
-async def get_reports():
+    Reads the small file_stats collection instead of the files, and caches the answer
+    in-process for settings.stats_cache_ttl seconds (0 disables the cache).
+    """
+    now = time.monotonic()
+    if _stats_cache["stats"] is not None and now < _stats_cache["expires"]:
+        return _stats_cache["stats"]
+    buckets = await engine._db[FILE_STATS].find({}).to_list(length=None)
+    stats = {"total_files": 0, "total_size": 0, **{f"by_{field}": {} for field in STATS_BREAKDOWNS}}
+    for bucket in buckets:
+        totals = {"files": bucket.get("files", 0), "size": bucket.get("size", 0)}
+        if bucket["_id"] == "total":
+            stats["total_files"], stats["total_size"] = totals["files"], totals["size"]
+            continue
+        field, _, value = bucket["_id"].partition("/")
+        # Buckets whose records are all gone are left at zero
+        if field in STATS_BREAKDOWNS and totals["files"]:
+            stats[f"by_{field}"][value] = totals
+    _stats_cache.update(stats=stats, expires=now + settings.stats_cache_ttl)
+    return stats
+
+@api_router.post("/stats/rebuild")
+async def post_rebuild_stats():
+    """Recomputes the running totals from the files collection, e.g. after editing it directly."""
+    await rebuild_stats()
+    return await get_stats()
+
+@api_router.get("/indexes")
+async def get_index_stats():
+    """Reports each index on the files collection with how often it has been used."""
     collection = engine._db[FileModel._collection]
-    
-    # Duplicate Files Pipeline
-    files_pipeline = [
-        {"$group": {
-            "_id": "$md5",
-            "count": {"$sum": 1},
-            "files": {"$push": "$$ROOT"},
-            "total_size": {"$sum": "$size"}
-        }},
-        {"$match": {"count": {"$gt": 1}}}
-    ]
-    
-    # Duplicate Directories Pipeline
-    dirs_pipeline = [
-        {
-            "$group": {
-                "_id": "$parent_dir",
-                "files": {"$push": {"name": "$name", "md5": "$md5"}},
-                "count": {"$sum": 1}
-            }
-        },
-        {
-            "$project": {
-                "parent_dir": "$_id",
-                "files": {
-                    "$sortArray": {"input": "$files", "sortBy": {"name": 1, "md5": 1}}
-                },
-                "file_count": "$count"
-            }
-        },
-        {
-            "$group": {
-                "_id": "$files",
-                "directories": {"$push": "$parent_dir"},
-                "count": {"$sum": 1},
-                "file_count": {"$first": "$file_count"}
-            }
-        },
-        {"$match": {"count": {"$gt": 1}}}
-    ]
-    
-    files_cursor = collection.aggregate(files_pipeline)
-    files_results = await files_cursor.to_list(length=None)
-    
-    dirs_cursor = collection.aggregate(dirs_pipeline)
-    dirs_results = await dirs_cursor.to_list(length=None)
-    
-    # Process files results to be JSON serializable
-    processed_files = []
-    for group in files_results:
-        new_group = group.copy()
-        new_files = []
-        for file in group["files"]:
-            file_dict = dict(file)
-            if "_id" in file_dict:
-                file_dict["_id"] = str(file_dict["_id"])
-            new_files.append(file_dict)
-        new_group["files"] = new_files
-        processed_files.append(new_group)
-    
-    # Process dirs results
-    processed_dirs = []
-    for group in dirs_results:
-        processed_dirs.append({
-            "files": group["_id"],
-            "directories": group["directories"],
-            "count": group["count"],
-            "file_count": group["file_count"]
+    cursor = collection.aggregate([{"$indexStats": {}}])
+    results = await cursor.to_list(length=None)
+    indexes = []
+    for index in results:
+        accesses = index.get("accesses", {})
+        since = accesses.get("since")
+        indexes.append({
+            "name": index["name"],
+            "key": dict(index["key"]),
+            "ops": accesses.get("ops", 0),
+            "since": since.isoformat() if since else None,
         })
-    
+    return sorted(indexes, key=lambda index: index["name"])
+
+app.include_router(api_router)
+
+def serialize_file_group(group: Dict[str, Any]) -> Dict[str, Any]:
     return {
-        "duplicate_files": processed_files,
-        "duplicate_directories": processed_dirs
+        "_id": group["md5"],
+        "hash_algo": group["hash_algo"],
+        "count": group["count"],
+        "files": group["files"],
+        "total_size": group["total_size"]
     }
 
+def serialize_directory_group(group: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "_id": group["merkle"],
+        "hash_algo": group["hash_algo"],
+        "count": group["count"],
+        "directories": group["directories"],
+        "file_count": group["file_count"],
+        "size": group["size"]
+    }
+
+@app.get("/reports")
+async def get_reports(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1),
+    after: Optional[str] = None,
+    dirs_after: Optional[str] = None,
+    format: Optional[str] = None,
+):
+    """Serves the duplicate report from the materialized report collections.
+
+    Duplicate file groups and duplicate directories, identical subtrees found by Merkle
+    hash, are paged separately by group key: next_after and next_dirs_after hold the
+    ?after= and ?dirs_after= values of their next pages. The first page lists both; a
+    later page lists only the sections whose cursor is given. With ?format=ndjson the
+    same sections are streamed as typed lines instead.
+    """
+    db = engine._db
+    first_page = after is None and dirs_after is None
+    sections = []
+    if first_page or after is not None:
+        sections.append(("duplicate_files", db[DUPLICATE_GROUPS], after, serialize_file_group))
+    if first_page or dirs_after is not None:
+        sections.append(("duplicate_directories", db[DUPLICATE_DIRECTORIES], dirs_after, serialize_directory_group))
+
+    def find(collection, cursor: Optional[str], limit: int):
+        # Only groups of two or more have a report_key; every other hash is left out by its sparse index
+        return collection.find({"report_key": {"$gt": cursor or ""}}, sort=[("report_key", ASCENDING)], limit=limit)
+
+    if wants_ndjson(request, format):
+        kinds = {"duplicate_files": "duplicate_file", "duplicate_directories": "duplicate_directory"}
+        parts = [
+            (find(collection, cursor, limit or 0), lambda group, kind=kinds[name], serialize=serialize: {"type": kind, **serialize(group)})
+            for name, collection, cursor, serialize in sections
+        ]
+        return StreamingResponse(ndjson_stream(*parts), media_type=NDJSON_MEDIA_TYPE)
+
+    size = page_size(limit)
+    report = {"duplicate_files": [], "duplicate_directories": [], "next_after": None, "next_dirs_after": None}
+    next_keys = {"duplicate_files": "next_after", "duplicate_directories": "next_dirs_after"}
+    for name, collection, cursor, serialize in sections:
+        groups = await find(collection, cursor, size + 1).to_list(length=None)
+        if len(groups) > size:
+            groups = groups[:size]
+            report[next_keys[name]] = groups[-1]["_id"]
+        report[name] = [serialize(group) for group in groups]
+    return report
+
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
     return templates.TemplateResponse(request=request, name="index.html")
\ No newline at end of file
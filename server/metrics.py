@@ -0,0 +1,276 @@
+"""In-process metrics served in the Prometheus text exposition format.
+
+Each worker process keeps its own counters, gauges and histograms. When several workers
+share a port, each writes a snapshot to a common directory every few seconds and
+/metrics adds them up, so a scrape sees the whole server whichever worker answers it.
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# 256 B to 256 MiB in steps of 4
+SIZE_BUCKETS = tuple(256 * 4 ** i for i in range(11))
+COUNT_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Snapshots not refreshed for this many intervals belong to a worker that is gone
+STALE_INTERVALS = 3
+
+# The ASGI scope of the request being served. The router adds the matched route to it,
+# and Motor copies the context into its executor threads, so database commands can be
+# attributed to the route that issued them.
+current_scope: ContextVar[Optional[dict]] = ContextVar("current_scope", default=None)
+
+Sample = Tuple[str, Tuple[Tuple[str, str], ...], float]
+
+def route_label(scope: Optional[dict]) -> str:
+    """The path template of the route a request matched, e.g. /api/v1/files/{id}."""
+    route = scope.get("route") if scope else None
+    return getattr(route, "path", None) or "unmatched"
+
+def format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values: Dict[Tuple[str, ...], Any] = {}
+        # Database commands are observed from Motor's executor threads
+        self.lock = threading.Lock()
+
+    def samples(self) -> List[Sample]:
+        """(suffix, label pairs, value) for every series, as they appear in the exposition."""
+        with self.lock:
+            return [("", tuple(zip(self.labels, key)), value) for key, value in self.values.items()]
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, *labels: str):
+        # One count per bucket (the last is +Inf), then the sum
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self) -> List[Sample]:
+        with self.lock:
+            series = [(key, list(counts)) for key, counts in self.values.items()]
+        samples = []
+        for key, counts in series:
+            pairs = tuple(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else format_value(bound)
+                samples.append(("_bucket", pairs + (("le", le),), cumulative))
+            samples.append(("_sum", pairs, counts[-1]))
+            samples.append(("_count", pairs, cumulative))
+        return samples
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def snapshot(self) -> Dict[str, List[list]]:
+        return {metric.name: [[suffix, list(map(list, pairs)), value] for suffix, pairs, value in metric.samples()]
+                for metric in self.metrics}
+
+    def render(self, others: Tuple[Dict[str, List[list]], ...] = ()) -> str:
+        """The exposition text, adding up series across this process and other workers' snapshots."""
+        lines = []
+        for metric in self.metrics:
+            merged: Dict[Tuple[str, tuple], float] = {}
+            for suffix, pairs, value in metric.samples():
+                merged[(suffix, pairs)] = merged.get((suffix, pairs), 0) + value
+            for other in others:
+                for suffix, pairs, value in other.get(metric.name, ()):
+                    key = (suffix, tuple(map(tuple, pairs)))
+                    merged[key] = merged.get(key, 0) + value
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for (suffix, pairs), value in merged.items():
+                labels = ",".join(f'{name}="{escape(label)}"' for name, label in pairs)
+                lines.append(f"{metric.name}{suffix}{{{labels}}} {format_value(value)}" if labels
+                             else f"{metric.name}{suffix} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+HTTP_REQUESTS = registry.register(Counter(
+    "filizer_http_requests_total", "HTTP requests served, by route, method and status.",
+    ("route", "method", "status")))
+HTTP_DURATION = registry.register(Histogram(
+    "filizer_http_request_duration_seconds", "Time from receiving a request to sending the last of its response.",
+    ("route", "method")))
+HTTP_REQUEST_SIZE = registry.register(Histogram(
+    "filizer_http_request_size_bytes", "Request body sizes.", ("route", "method"), SIZE_BUCKETS))
+HTTP_RESPONSE_SIZE = registry.register(Histogram(
+    "filizer_http_response_size_bytes", "Response body sizes.", ("route", "method"), SIZE_BUCKETS))
+HTTP_IN_FLIGHT = registry.register(Gauge(
+    "filizer_http_requests_in_flight", "Requests being served."))
+MONGODB_DURATION = registry.register(Histogram(
+    "filizer_mongodb_command_duration_seconds", "MongoDB command round trips, by command, collection and the route that issued it.",
+    ("command", "collection", "route")))
+MONGODB_FAILURES = registry.register(Counter(
+    "filizer_mongodb_command_failures_total", "MongoDB commands that returned an error.",
+    ("command", "collection", "route")))
+MONGODB_DOCUMENTS = registry.register(Histogram(
+    "filizer_mongodb_command_documents", "Documents sent by a write or returned by a read, per command.",
+    ("command", "collection", "route"), COUNT_BUCKETS))
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request and measuring its body sizes."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        received = sent = 0
+
+        async def counting_receive():
+            nonlocal received
+            message = await receive()
+            received += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        token = current_scope.set(scope)
+        HTTP_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            elapsed = time.perf_counter() - start
+            HTTP_IN_FLIGHT.dec()
+            current_scope.reset(token)
+            route, method = route_label(scope), scope["method"]
+            HTTP_REQUESTS.inc(route, method, str(status))
+            HTTP_DURATION.observe(elapsed, route, method)
+            HTTP_REQUEST_SIZE.observe(received, route, method)
+            HTTP_RESPONSE_SIZE.observe(sent, route, method)
+
+class CommandMetrics(monitoring.CommandListener):
+    """Times every MongoDB command the driver sends: find, getMore, aggregate, and the
+    insert/update/delete batches behind save and bulk_write."""
+
+    WRITE_FIELDS = {"insert": "documents", "update": "updates", "delete": "deletes"}
+
+    def __init__(self):
+        self.pending: Dict[Tuple[Any, int], Tuple[str, str, str, Optional[int]]] = {}
+
+    def started(self, event):
+        command = event.command_name
+        target = event.command.get("collection" if command == "getMore" else command)
+        written = event.command.get(self.WRITE_FIELDS.get(command, ""))
+        self.pending[(event.connection_id, event.request_id)] = (
+            command, target if isinstance(target, str) else "", route_label(current_scope.get()),
+            len(written) if written is not None else None)
+
+    def succeeded(self, event):
+        entry = self.pending.pop((event.connection_id, event.request_id), None)
+        if entry is None:
+            return
+        command, collection, route, written = entry
+        MONGODB_DURATION.observe(event.duration_micros / 1e6, command, collection, route)
+        cursor = event.reply.get("cursor")
+        if cursor is not None:
+            documents = len(cursor.get("firstBatch", cursor.get("nextBatch", ())))
+        else:
+            documents = written
+        if documents is not None:
+            MONGODB_DOCUMENTS.observe(documents, command, collection, route)
+
+    def failed(self, event):
+        entry = self.pending.pop((event.connection_id, event.request_id), None)
+        if entry is None:
+            return
+        command, collection, route, _ = entry
+        MONGODB_DURATION.observe(event.duration_micros / 1e6, command, collection, route)
+        MONGODB_FAILURES.inc(command, collection, route)
+
+def snapshot_path(directory: str) -> Path:
+    return Path(directory) / f"worker-{os.getpid()}.json"
+
+def write_snapshot(directory: str):
+    """Saves this worker's metrics for the others to merge, replacing its previous snapshot."""
+    path = snapshot_path(directory)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp = path.with_suffix(".tmp")
+    temp.write_text(json.dumps(registry.snapshot()))
+    os.replace(temp, path)
+
+def remove_snapshot(directory: str):
+    """Withdraws this worker's snapshot, so an exiting worker's counts are not reported forever."""
+    snapshot_path(directory).unlink(missing_ok=True)
+
+def read_snapshots(directory: str, interval: float) -> Tuple[Dict[str, List[list]], ...]:
+    """The latest snapshots of the other live workers sharing the directory.
+
+    A worker that was killed never removes its snapshot, so snapshots older than
+    STALE_INTERVALS intervals are left out.
+    """
+    own = snapshot_path(directory)
+    oldest = time.time() - STALE_INTERVALS * interval
+    snapshots = []
+    for path in Path(directory).glob("worker-*.json"):
+        if path == own:
+            continue
+        try:
+            if path.stat().st_mtime < oldest:
+                continue
+            snapshots.append(json.loads(path.read_text()))
+        except (OSError, ValueError):
+            # A worker that exited between the glob and the read
+            continue
+    return tuple(snapshots)
@@ -0,0 +1,50 @@
+"""Production entry point: runs the API under uvicorn with the [server] settings.
+
+Usage:
+    uv run python server/serve.py
+
+Worker count, event loop, HTTP parser and the graceful shutdown timeout come from
+server-conf.toml or SERVER_* environment variables (see config.py). Each worker imports
+main itself and opens its own MongoDB pool in the lifespan hook.
+"""
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import uvicorn
+
+from config import settings
+
+def worker_count(workers: int) -> int:
+    """The configured worker count, with 0 meaning one per CPU this process may run on."""
+    return workers or os.process_cpu_count() or 1
+
+def cli():
+    server = settings.server
+    workers = worker_count(server.workers)
+    metrics_dir = None
+    if workers > 1 and not settings.metrics.dir:
+        # Workers load their settings afresh, so the shared /metrics directory goes through the environment
+        metrics_dir = os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix="filizer-metrics-")
+    try:
+        # Workers need the app as an import string; they are started as fresh processes
+        uvicorn.run(
+            "main:app",
+            host=server.host,
+            port=server.port,
+            workers=workers,
+            loop=server.loop,
+            http=server.http,
+            timeout_graceful_shutdown=server.graceful_timeout,
+        )
+    finally:
+        if metrics_dir:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    cli()
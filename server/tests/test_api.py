@@ -3,6 +3,8 @@ from fastapi.testclient import TestClient
 from unittest.mock import AsyncMock, MagicMock, patch
 import main
 from main import app, get_current_username, FileModel
+from bson import ObjectId
+from pymongo import ReturnDocument
 from common.models import DuplicateStatus
 
 # Override auth for tests
@@ -11,6 +13,17 @@ def override_auth():
 
 app.dependency_overrides[get_current_username] = override_auth
 
+def mock_report_refresh(mock_collection):
+    """Lets writes refresh the report collections against an empty mock collection."""
+    mock_cursor = AsyncMock()
+    mock_cursor.to_list.return_value = []
+    mock_collection.aggregate.return_value = mock_cursor
+    mock_collection.find.return_value = mock_cursor
+    mock_collection.find_one = AsyncMock(return_value=None)
+    mock_collection.bulk_write = AsyncMock(return_value=MagicMock(bulk_api_result={}))
+    mock_collection.delete_many = AsyncMock()
+    mock_collection.find_one_and_update = AsyncMock(return_value=None)
+
 client = TestClient(app)
 client.headers = {"X-Client-Version": "1.0.0"}
 
@@ -22,6 +35,10 @@ def test_read_main():
 @patch("main.engine")
 def test_crud_file(mock_engine):
     # Setup mocks
+    mock_collection = MagicMock()
+    mock_engine._db.__getitem__.return_value = mock_collection
+    mock_report_refresh(mock_collection)
+    mock_collection.find_one = AsyncMock(return_value={"_id": ObjectId("507f1f77bcf86cd799439011")})
     mock_engine.save = AsyncMock()
     mock_engine.find_many = AsyncMock()
     mock_engine.find_one = AsyncMock()
@@ -60,8 +77,12 @@ def test_crud_file(mock_engine):
     }
     response = client.post("/api/v1/files/", json=file_data)
     assert response.status_code == 200
+    assert response.json()["result"] == "inserted"
     
     # List
+    mock_list_cursor = AsyncMock()
+    mock_list_cursor.to_list.return_value = [{"_id": ObjectId(file_id), **mock_file.model_dump(exclude={"id"})}]
+    mock_collection.find.return_value = mock_list_cursor
     response = client.get(f"/api/v1/files/?name={unique_name}")
     assert response.status_code == 200
     files = response.json()
@@ -86,18 +107,19 @@ def test_crud_file(mock_engine):
     response = client.delete(f"/api/v1/files/{file_id}")
     assert response.status_code == 200
 
+@patch.dict(main._stats_cache, stats=None, expires=0.0)
 @patch("main.engine")
 def test_stats(mock_engine):
     mock_collection = MagicMock()
     mock_engine._db.__getitem__.return_value = mock_collection
     mock_cursor = AsyncMock()
-    mock_collection.aggregate.return_value = mock_cursor
+    mock_collection.find.return_value = mock_cursor
     
     mock_cursor.to_list.return_value = [
-        {
-            "total_files": 10,
-            "total_size": 1000
-        }
+        {"_id": "total", "files": 10, "size": 1000},
+        {"_id": "kind/.txt", "files": 10, "size": 1000},
+        {"_id": "kind/.jpg", "files": 0, "size": 0},
+        {"_id": "duplicate_status/NONE", "files": 10, "size": 1000},
     ]
     
     response = client.get("/api/v1/stats")
@@ -105,21 +127,56 @@ def test_stats(mock_engine):
     data = response.json()
     assert data["total_files"] == 10
     assert data["total_size"] == 1000
+    assert data["by_kind"] == {".txt": {"files": 10, "size": 1000}}
+    assert data["by_duplicate_status"] == {"NONE": {"files": 10, "size": 1000}}
+
+    # Served from the in-process cache until it expires or this process writes
+    assert client.get("/api/v1/stats").json() == data
+    assert mock_collection.find.call_count == 1
+    # The files collection itself is never scanned
+    mock_collection.aggregate.assert_not_called()
 
+@patch.dict(main._stats_cache, stats=None, expires=0.0)
 @patch("main.engine")
-def test_reports(mock_engine):
-    # Mock aggregation
+def test_stats_maintained_on_write(mock_engine):
     mock_collection = MagicMock()
-    # Mock dictionary access for collection
     mock_engine._db.__getitem__.return_value = mock_collection
-    
+    mock_report_refresh(mock_collection)
+    mock_collection.find_one_and_update = AsyncMock(return_value={
+        "_id": ObjectId(), "host": "nas", "full_path": "/d/a.txt", "size": 100, "kind": ".txt", "duplicate_status": "NONE",
+        "md5": "old", "hash_algo": "md5",
+    })
+
+    record = {"name": "a.txt", "size": 150, "kind": ".txt", "md5": "new", "parent_dir": "d",
+              "full_path": "/d/a.txt", "host": "nas", "duplicate_status": "DUPLICATE_CONTENTS"}
+    response = client.post("/api/v1/files/", json=record)
+    assert response.status_code == 200
+
+    stats_write = mock_collection.bulk_write.call_args_list[-1].args[0]
+    increments = {op._filter["_id"]: op._doc["$inc"] for op in stats_write}
+    assert increments == {
+        "total": {"files": 0, "size": 50},
+        "kind/.txt": {"files": 0, "size": 50},
+        "duplicate_status/DUPLICATE_CONTENTS": {"files": 1, "size": 150},
+        "duplicate_status/NONE": {"files": -1, "size": -100},
+    }
+
+@patch("main.engine")
+def test_reports(mock_engine):
+    collections = {main.DUPLICATE_GROUPS: MagicMock(), main.DUPLICATE_DIRECTORIES: MagicMock()}
+    # Mock dictionary access for collection
+    mock_engine._db.__getitem__.side_effect = collections.__getitem__
+
     mock_cursor_files = AsyncMock()
     mock_cursor_dirs = AsyncMock()
-    mock_collection.aggregate.side_effect = [mock_cursor_files, mock_cursor_dirs]
-    
+    collections[main.DUPLICATE_GROUPS].find.return_value = mock_cursor_files
+    collections[main.DUPLICATE_DIRECTORIES].find.return_value = mock_cursor_dirs
+
     mock_cursor_files.to_list.return_value = [
         {
-            "_id": "md5hash",
+            "_id": "md5:md5hash",
+            "md5": "md5hash",
+            "hash_algo": "md5",
             "count": 2,
             "files": [
                 {"name": "f1", "_id": "id1", "size": 10, "full_path": "p1"},
@@ -131,13 +188,16 @@ def test_reports(mock_engine):
 
     mock_cursor_dirs.to_list.return_value = [
         {
-            "_id": [{"name": "f1", "md5": "md5hash"}],
-            "directories": ["dir1", "dir2"],
+            "_id": "md5:treehash",
+            "merkle": "treehash",
+            "hash_algo": "md5",
+            "directories": [{"_id": "id3", "name": "a", "full_path": "/x/a"}, {"_id": "id4", "name": "b", "full_path": "/y/b"}],
             "count": 2,
-            "file_count": 1
+            "file_count": 1,
+            "size": 10
         }
     ]
-    
+
     response = client.get("/reports")
     assert response.status_code == 200
     data = response.json()
@@ -146,4 +206,647 @@ def test_reports(mock_engine):
     assert len(data["duplicate_files"]) == 1
     assert data["duplicate_files"][0]["_id"] == "md5hash"
     assert len(data["duplicate_directories"]) == 1
-    assert data["duplicate_directories"][0]["count"] == 2
\ No newline at end of file
+    assert data["duplicate_directories"][0]["_id"] == "treehash"
+    assert data["duplicate_directories"][0]["count"] == 2
+    assert data["next_after"] is None
+    assert collections[main.DUPLICATE_GROUPS].find.call_args.kwargs["limit"] == main.DEFAULT_PAGE_SIZE + 1
+    # Single-record groups have no report_key and are never read
+    assert collections[main.DUPLICATE_GROUPS].find.call_args.args[0] == {"report_key": {"$gt": ""}}
+
+    # Duplicate directories are paged by their own cursor
+    directory = mock_cursor_dirs.to_list.return_value[0]
+    mock_cursor_dirs.to_list.return_value = [directory, dict(directory, _id="md5:other")]
+    collections[main.DUPLICATE_GROUPS].find.reset_mock()
+    data = client.get("/reports", params={"dirs_after": "md5:first", "limit": 1}).json()
+    assert data["duplicate_files"] == []
+    assert len(data["duplicate_directories"]) == 1
+    assert data["next_dirs_after"] == "md5:treehash"
+    assert collections[main.DUPLICATE_DIRECTORIES].find.call_args.args[0] == {"report_key": {"$gt": "md5:first"}}
+    collections[main.DUPLICATE_GROUPS].find.assert_not_called()
+
+@patch("main.engine")
+def test_report_collections_built(mock_engine):
+    import asyncio
+
+    mock_collection = MagicMock()
+    mock_engine._db.__getitem__.return_value = mock_collection
+    mock_engine._db.list_collection_names = AsyncMock(return_value=[])
+    mock_engine._db.create_collection = AsyncMock()
+    mock_collection.create_indexes = AsyncMock()
+    mock_collection.aggregate.return_value = AsyncMock()
+
+    asyncio.run(main.ensure_report_collections())
+
+    mock_collection.create_indexes.assert_called_with(main.REPORT_INDEXES)
+    pipeline = mock_collection.aggregate.call_args_list[0].args[0]
+    group = pipeline[1]["$group"]
+    # Listings are bounded while they are built, and every hash gets a group to count its members
+    assert group["files"]["$firstN"]["n"] == main.MAX_GROUP_FILES
+    assert pipeline[-2] == {"$set": {"report_key": main.REPORT_KEY}}
+    assert "$merge" in pipeline[-1]
+
+def group_updates(collection):
+    """The pipeline of each group update in the collection's last bulk write, by group key."""
+    operations = collection.bulk_write.call_args.args[0]
+    return {op._filter["_id"]: op._doc[0]["$set"] for op in operations}
+
+@patch("main.engine")
+def test_refresh_reports(mock_engine):
+    import asyncio
+
+    mock_collection = MagicMock()
+    mock_engine._db.__getitem__.return_value = mock_collection
+    mock_report_refresh(mock_collection)
+
+    moved, kept, added = ObjectId(), ObjectId(), ObjectId()
+    previous = [
+        {"_id": moved, "md5": "aaa", "hash_algo": "md5", "size": 10},
+        {"_id": kept, "md5": "bbb", "hash_algo": None, "size": 5},
+    ]
+    written = [
+        {"id": moved, "md5": "ccc", "hash_algo": "md5", "size": 10, "name": "a", "full_path": "/a"},
+        {"id": kept, "md5": "bbb", "hash_algo": "md5", "size": 5, "name": "b", "full_path": "/b", "action": "rm"},
+        {"id": added, "md5": "ccc", "hash_algo": "md5", "size": 10, "name": "c", "full_path": "/c"},
+    ]
+    asyncio.run(main.refresh_reports(written, previous))
+
+    # Groups are never recomputed from the files collection
+    mock_collection.aggregate.assert_not_called()
+    updates = group_updates(mock_collection)
+    assert updates.keys() == {"md5:aaa", "md5:bbb", "md5:ccc"}
+    assert updates["md5:aaa"]["count"] == {"$add": [{"$ifNull": ["$count", 0]}, -1]}
+    assert updates["md5:aaa"]["total_size"] == {"$add": [{"$ifNull": ["$total_size", 0]}, -10]}
+    assert updates["md5:ccc"]["count"] == {"$add": [{"$ifNull": ["$count", 0]}, 2]}
+    assert updates["md5:ccc"]["total_size"] == {"$add": [{"$ifNull": ["$total_size", 0]}, 20]}
+    # A record staying in its group has its entry replaced, e.g. to show a new action
+    assert updates["md5:bbb"]["count"] == {"$add": [{"$ifNull": ["$count", 0]}, 0]}
+    entries = updates["md5:bbb"]["files"]["$slice"]
+    assert entries[1] == main.MAX_GROUP_FILES
+    kept_entries, new_entries = entries[0]["$concatArrays"]
+    assert kept_entries["$filter"]["cond"] == {"$not": [{"$in": ["$$this._id", {"$literal": [str(kept), str(kept)]}]}]}
+    assert new_entries["$literal"][0]["_id"] == str(kept)
+    assert new_entries["$literal"][0]["action"] == "rm"
+    # Groups whose last member left are deleted
+    assert mock_collection.delete_many.call_args.args[0] == {
+        "_id": {"$in": ["md5:aaa", "md5:bbb", "md5:ccc"]}, "count": {"$lte": 0},
+    }
+
+@patch("main.engine")
+def test_create_directories_bulk(mock_engine):
+    mock_collection = MagicMock()
+    mock_engine._db.__getitem__.return_value = mock_collection
+    mock_report_refresh(mock_collection)
+    ids = [ObjectId(), ObjectId()]
+    mock_collection.bulk_write = AsyncMock(return_value=MagicMock(bulk_api_result={
+        "nUpserted": 2, "nModified": 0, "nMatched": 0,
+        "upserted": [{"index": 0, "_id": ids[0]}, {"index": 1, "_id": ids[1]}],
+    }))
+    record = {"name": "a", "full_path": "/x/a", "host": "nas", "merkle": "tree", "file_count": 3, "size": 30}
+
+    response = client.post("/api/v1/directories/bulk", json=[record, dict(record, full_path="/y/a")])
+    assert response.status_code == 200
+    assert response.json()["inserted"] == 2
+    operations = mock_collection.bulk_write.call_args_list[0].args[0]
+    assert operations[0]._filter == {"host": "nas", "full_path": "/x/a"}
+    # Directory records have no dashboard action to preserve
+    assert "action" not in operations[0]._doc[0]["$set"]
+    # Both new directories join their Merkle group
+    mock_engine._db.__getitem__.assert_any_call(main.DUPLICATE_DIRECTORIES)
+    update = group_updates(mock_collection)["md5:tree"]
+    assert update["count"] == {"$add": [{"$ifNull": ["$count", 0]}, 2]}
+    assert update["file_count"] == {"$literal": 3}
+    assert [entry["_id"] for entry in update["directories"]["$slice"][0]["$concatArrays"][1]["$literal"]] == list(map(str, ids))
+
+@patch("main.engine")
+def test_lookup_files(mock_engine):
+    mock_engine.find_many = AsyncMock()
+    mock_engine.find_many.return_value = [
+        FileModel(name="a.txt", size=1, kind=".txt", md5="aaa", parent_dir="d1",
+                  full_path="/d1/a.txt", duplicate_status=DuplicateStatus.NONE),
+        FileModel(name="b.txt", size=1, kind=".txt", md5="aaa", parent_dir="d2",
+                  full_path="/d2/b.txt", duplicate_status=DuplicateStatus.NONE),
+    ]
+
+    response = client.post("/api/v1/files/lookup", json={"md5s": ["aaa", "bbb"]})
+    assert response.status_code == 200
+    data = response.json()
+    assert list(data.keys()) == ["aaa"]
+    assert len(data["aaa"]) == 2
+    query = mock_engine.find_many.call_args.kwargs["raw_query"]
+    assert sorted(query["md5"]["$in"]) == ["aaa", "bbb"]
+
+    response = client.post("/api/v1/files/lookup", json={"md5s": ["x"] * (main.MAX_LOOKUP_BATCH + 1)})
+    assert response.status_code == 413
+
+@patch("main.engine")
+def test_create_files_bulk(mock_engine):
+    from pymongo.errors import BulkWriteError
+
+    mock_collection = MagicMock()
+    mock_engine._db.__getitem__.return_value = mock_collection
+    mock_report_refresh(mock_collection)
+    mock_collection.bulk_write = AsyncMock(side_effect=[BulkWriteError({
+        "nUpserted": 1,
+        "nMatched": 0,
+        "nModified": 0,
+        "writeErrors": [{"index": 1, "errmsg": "E11000 duplicate key"}],
+    }), MagicMock(), MagicMock()])
+
+    record = {
+        "name": "a.txt",
+        "size": 1,
+        "kind": ".txt",
+        "md5": "aaa",
+        "parent_dir": "d",
+        "full_path": "/d/a.txt",
+        "duplicate_status": "NONE",
+    }
+    response = client.post("/api/v1/files/bulk", json=[record, {"name": "broken"}, dict(record, name="b.txt")])
+    assert response.status_code == 200
+    data = response.json()
+    assert data["inserted"] == 1
+    assert [e["index"] for e in data["errors"]] == [1, 2]
+    operations = mock_collection.bulk_write.call_args_list[0].args[0]
+    assert len(operations) == 2
+    assert mock_collection.bulk_write.call_args_list[0].kwargs["ordered"] is False
+    # Previous versions are read through the host_full_path index, which leads with host
+    assert mock_collection.find.call_args.args[0] == {"$or": [{"host": None, "full_path": {"$in": ["/d/a.txt", "/d/a.txt"]}}]}
+
+@patch("main.engine")
+def test_create_files_bulk_concurrent_insert(mock_engine):
+    """A path another writer inserted between the read and the write is not counted again."""
+    mock_collection = MagicMock()
+    mock_engine._db.__getitem__.return_value = mock_collection
+    mock_report_refresh(mock_collection)
+    mock_collection.bulk_write = AsyncMock(return_value=MagicMock(bulk_api_result={
+        "nUpserted": 0, "nMatched": 1, "nModified": 1, "upserted": [],
+    }))
+    record = {"name": "a.txt", "size": 1, "kind": ".txt", "md5": "aaa", "parent_dir": "d",
+              "full_path": "/d/a.txt", "host": "nas", "duplicate_status": "NONE"}
+
+    response = client.post("/api/v1/files/bulk", json=[record])
+    assert response.json()["updated"] == 1
+    # Only the upsert itself: no stats or group increments for a version this write did not see
+    assert mock_collection.bulk_write.call_count == 1
+
+@patch("main.engine")
+def test_lookup_sizes(mock_engine):
+    mock_collection = MagicMock()
+    mock_engine._db.__getitem__.return_value = mock_collection
+    mock_collection.distinct = AsyncMock(return_value=[300, 100])
+
+    response = client.post("/api/v1/files/sizes", json={"sizes": [100, 200, 300]})
+    assert response.status_code == 200
+    assert response.json() == {"sizes": [100, 300]}
+    assert mock_collection.distinct.call_args.args[0] == "size"
+
+@patch("main.engine")
+def test_lookup_files_by_algorithm(mock_engine):
+    mock_engine.find_many = AsyncMock(return_value=[])
+
+    client.post("/api/v1/files/lookup", json={"md5s": ["aaa"]})
+    query = mock_engine.find_many.call_args.kwargs["raw_query"]
+    assert query["hash_algo"] == {"$in": ["md5", None]}
+
+    client.post("/api/v1/files/lookup", json={"md5s": ["aaa"], "hash_algo": "blake2b"})
+    query = mock_engine.find_many.call_args.kwargs["raw_query"]
+    assert query["hash_algo"] == {"$in": ["blake2b"]}
+
+@patch("main.engine")
+def test_indexes_created_at_startup(mock_engine):
+    from pymongo.errors import OperationFailure
+
+    mock_collection = MagicMock()
+    mock_engine._db.__getitem__.return_value = mock_collection
+
+    def create_indexes(indexes):
+        if indexes[0].document.get("unique"):
+            raise OperationFailure("E11000 duplicate key error")
+        return [indexes[0].document["name"]]
+
+    mock_collection.create_indexes = AsyncMock(side_effect=create_indexes)
+    mock_engine._db.list_collection_names = AsyncMock(return_value=[main.DUPLICATE_GROUPS, main.DUPLICATE_DIRECTORIES])
+    mock_collection.find_one = AsyncMock(return_value={"_id": "total", "files": 0, "size": 0})
+
+    with TestClient(app) as startup_client:
+        assert startup_client.get("/version").status_code == 200
+
+    created = [call.args[0][0].document["name"] for call in mock_collection.create_indexes.call_args_list]
+    assert created == [index.document["name"] for index in main.FILE_INDEXES + main.DIRECTORY_INDEXES]
+
+def test_engine_per_worker(monkeypatch):
+    from config import load_settings
+
+    monkeypatch.setenv("SERVER_WORKERS", "4")
+    monkeypatch.setenv("MONGODB_MAX_POOL_SIZE", "50")
+    monkeypatch.setenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000")
+    loaded = load_settings()
+    assert loaded.server.workers == 4
+    assert loaded.pool.uri_options() == {"maxPoolSize": 50, "serverSelectionTimeoutMS": 5000}
+
+    assert main.pool_uri("mongodb://db:27017", {"maxPoolSize": 50}) == "mongodb://db:27017/?maxPoolSize=50"
+    assert (main.pool_uri("mongodb://db:27017/files_db?maxPoolSize=10&authSource=admin", {"maxPoolSize": 50})
+            == "mongodb://db:27017/files_db?maxPoolSize=50&authSource=admin")
+
+    # Startup creates the worker's engine and shutdown closes it
+    mock_engine = MagicMock()
+    mock_collection = MagicMock()
+    mock_engine._db.__getitem__.return_value = mock_collection
+    mock_collection.create_indexes = AsyncMock(return_value=[])
+    mock_engine._db.list_collection_names = AsyncMock(return_value=[main.DUPLICATE_GROUPS, main.DUPLICATE_DIRECTORIES])
+    mock_collection.find_one = AsyncMock(return_value={"_id": "total", "files": 0, "size": 0})
+    with patch("main.engine", None), patch("main.create_engine", return_value=mock_engine):
+        with TestClient(app) as startup_client:
+            assert main.engine is mock_engine
+            assert startup_client.get("/version").status_code == 200
+        assert main.engine is None
+    mock_engine._client.close.assert_called_once()
+
+def test_mongodb_table_with_pool_options_only(monkeypatch, tmp_path):
+    from config import load_settings, Settings
+
+    config_dir = tmp_path / ".config" / "filizer"
+    config_dir.mkdir(parents=True)
+    (config_dir / "server-conf.toml").write_text("[mongodb]\nmax_pool_size = 50\n")
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.delenv("MONGODB_URL", raising=False)
+    monkeypatch.delenv("MONGODB_DB_NAME", raising=False)
+
+    loaded = load_settings()
+    assert loaded.pool.max_pool_size == 50
+    assert loaded.mongodb_url == Settings.model_fields["mongodb_url"].default
+    assert loaded.db_name == Settings.model_fields["db_name"].default
+
+def metric_value(text, sample):
+    """The value of one exposition line, 0 when the series is absent."""
+    for line in text.splitlines():
+        if line.startswith(sample + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return 0
+
+@patch("main.engine")
+def test_metrics(mock_engine, tmp_path):
+    import json
+    import os
+    import time
+    from types import SimpleNamespace
+    import metrics
+
+    mock_engine.find_one = AsyncMock(return_value=None)
+
+    requests = 'filizer_http_requests_total{route="/version",method="GET",status="200"}'
+    before = metric_value(client.get("/metrics").text, requests)
+    assert client.get("/version").status_code == 200
+    response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    assert metric_value(text, requests) == before + 1
+    assert metric_value(text, 'filizer_http_request_duration_seconds_count{route="/version",method="GET"}') >= 1
+    assert metric_value(text, 'filizer_http_request_duration_seconds_bucket{route="/version",method="GET",le="+Inf"}') >= 1
+    # Paths are reported by route template, not by the id requested
+    assert client.get(f"/api/v1/files/{ObjectId()}").status_code == 404
+    assert 'filizer_http_requests_total{route="/api/v1/files/{id}",method="GET",status="404"}' in client.get("/metrics").text
+    assert "filizer_http_requests_in_flight 1" in client.get("/metrics").text
+
+    # Commands are attributed to the route being served when the driver sends them
+    listener = metrics.CommandMetrics()
+    token = metrics.current_scope.set({"route": SimpleNamespace(path="/reports")})
+    listener.started(SimpleNamespace(command_name="find", command={"find": "duplicate_groups"}, connection_id=("db", 1), request_id=7))
+    listener.started(SimpleNamespace(command_name="update", command={"update": "files", "updates": [{}, {}, {}]},
+                                     connection_id=("db", 1), request_id=8))
+    metrics.current_scope.reset(token)
+    listener.succeeded(SimpleNamespace(connection_id=("db", 1), request_id=7, duration_micros=2500,
+                                       reply={"cursor": {"firstBatch": [{}, {}]}}))
+    listener.failed(SimpleNamespace(connection_id=("db", 1), request_id=8, duration_micros=1000))
+    text = metrics.registry.render()
+    labels = 'command="find",collection="duplicate_groups",route="/reports"'
+    assert metric_value(text, f"filizer_mongodb_command_duration_seconds_sum{{{labels}}}") >= 0.0025
+    assert metric_value(text, f'filizer_mongodb_command_documents_bucket{{{labels},le="1"}}') == 0
+    assert metric_value(text, f'filizer_mongodb_command_documents_bucket{{{labels},le="10"}}') >= 1
+    assert metric_value(text, 'filizer_mongodb_command_failures_total{command="update",collection="files",route="/reports"}') >= 1
+
+    # Other workers' snapshots are added to this worker's series
+    other = metrics.registry.snapshot()
+    (tmp_path / "worker-1.json").write_text(json.dumps(other))
+    with patch.object(main.settings.metrics, "dir", str(tmp_path)):
+        merged = client.get("/metrics").text
+    assert metric_value(merged, requests) >= 2 * (before + 1)
+
+    # A snapshot not refreshed for several intervals is from a worker that is gone
+    stale = time.time() - metrics.STALE_INTERVALS * main.settings.metrics.interval - 1
+    os.utime(tmp_path / "worker-1.json", (stale, stale))
+    with patch.object(main.settings.metrics, "dir", str(tmp_path)):
+        alone = client.get("/metrics").text
+    assert metric_value(alone, requests) < 2 * (before + 1)
+
+    # A worker publishes its snapshot while running and withdraws it on shutdown
+    mock_collection = MagicMock()
+    mock_engine._db.__getitem__.return_value = mock_collection
+    mock_collection.create_indexes = AsyncMock(return_value=[])
+    mock_engine._db.list_collection_names = AsyncMock(return_value=[main.DUPLICATE_GROUPS, main.DUPLICATE_DIRECTORIES])
+    mock_collection.find_one = AsyncMock(return_value={"_id": "total", "files": 0, "size": 0})
+    with patch.object(main.settings.metrics, "dir", str(tmp_path)):
+        with TestClient(app) as startup_client:
+            assert startup_client.get("/version").status_code == 200
+            assert metrics.snapshot_path(str(tmp_path)).exists()
+    assert not metrics.snapshot_path(str(tmp_path)).exists()
+@patch("main.engine")
+def test_index_stats(mock_engine):
+    from datetime import datetime
+
+    mock_collection = MagicMock()
+    mock_engine._db.__getitem__.return_value = mock_collection
+    mock_cursor = AsyncMock()
+    mock_collection.aggregate.return_value = mock_cursor
+    mock_cursor.to_list.return_value = [
+        {"name": "size", "key": {"size": 1}, "accesses": {"ops": 3, "since": datetime(2026, 1, 1)}},
+        {"name": "_id_", "key": {"_id": 1}, "accesses": {"ops": 10, "since": datetime(2026, 1, 1)}},
+    ]
+
+    response = client.get("/api/v1/indexes")
+    assert response.status_code == 200
+    data = response.json()
+    assert [index["name"] for index in data] == ["_id_", "size"]
+    assert data[1]["ops"] == 3
+    assert mock_collection.aggregate.call_args.args[0] == [{"$indexStats": {}}]
+
+
+@patch("main.engine")
+def test_create_file_upsert(mock_engine):
+    mock_collection = MagicMock()
+    mock_engine._db.__getitem__.return_value = mock_collection
+    mock_report_refresh(mock_collection)
+    inserted_id = ObjectId()
+    mock_collection.find_one = AsyncMock(return_value={"_id": inserted_id})
+
+    file_data = {
+        "name": "a.txt",
+        "size": 1,
+        "kind": ".txt",
+        "md5": "aaa",
+        "parent_dir": "d",
+        "full_path": "$d/a.txt",
+        "host": "nas",
+        "duplicate_status": "NONE",
+    }
+    stored = {**FileModel(**file_data).model_dump(mode="json", exclude={"id"}), "_id": inserted_id}
+
+    data = client.post("/api/v1/files/", json=file_data).json()
+    assert data["result"] == "inserted"
+    assert data["file"]["id"] == str(inserted_id)
+
+    mock_collection.find_one_and_update.return_value = dict(stored, size=2)
+    assert client.post("/api/v1/files/", json=file_data).json()["result"] == "updated"
+
+    mock_collection.find_one_and_update.return_value = stored
+    writes = mock_collection.bulk_write.call_count
+    assert client.post("/api/v1/files/", json=file_data).json()["result"] == "unchanged"
+    # An unchanged record touches neither the reports nor the stats
+    assert mock_collection.bulk_write.call_count == writes
+
+    query, pipeline = mock_collection.find_one_and_update.call_args.args
+    assert query == {"host": "nas", "full_path": "$d/a.txt"}
+    # The replaced version comes from the write itself, not from a separate read
+    assert mock_collection.find_one_and_update.call_args.kwargs["upsert"] is True
+    assert mock_collection.find_one_and_update.call_args.kwargs["return_document"] == ReturnDocument.BEFORE
+    update = pipeline[0]["$set"]
+    assert update["full_path"] == {"$literal": "$d/a.txt"}
+    assert update["action"] == {"$ifNull": ["$action", {"$literal": None}]}
+
+@patch("main.engine")
+def test_get_files_paginated(mock_engine):
+    mock_collection = MagicMock()
+    mock_engine._db.__getitem__.return_value = mock_collection
+    ids = [ObjectId() for _ in range(3)]
+    mock_cursor = AsyncMock()
+    mock_cursor.to_list.return_value = [{"_id": i, "name": f"f{n}", "md5": "aaa"} for n, i in enumerate(ids)]
+    mock_collection.find.return_value = mock_cursor
+
+    response = client.get(f"/api/v1/files/?md5_eq=aaa&fields=name,md5&limit=2&after={ids[0]}")
+    assert response.status_code == 200
+    assert response.json() == [{"id": str(ids[0]), "name": "f0", "md5": "aaa"}, {"id": str(ids[1]), "name": "f1", "md5": "aaa"}]
+    assert response.headers["X-Next-Cursor"] == str(ids[1])
+    query, projection = mock_collection.find.call_args.args
+    # Validation by digest skips deleted copies, as /files/lookup does
+    assert query == {"$and": [{"$and": [{"$and": [{"md5": {"$eq": "aaa"}}]}, {"vanished_at": None}]},
+                              {"_id": {"$gt": ids[0]}}]}
+    assert projection == {"_id": 1, "name": 1, "md5": 1}
+    # One extra record is fetched to tell whether another page follows
+    assert mock_collection.find.call_args.kwargs["limit"] == 3
+
+    client.get(f"/api/v1/files/?fields=name&limit={main.MAX_PAGE_SIZE * 10}")
+    assert mock_collection.find.call_args.kwargs["limit"] == main.MAX_PAGE_SIZE + 1
+    # Listings still include vanished records
+    assert mock_collection.find.call_args.args[0] == {}
+
+    assert client.get("/api/v1/files/?fields=name,secret").status_code == 400
+    assert client.get("/api/v1/files/?after=not-an-id").status_code == 400
+
+@patch("main.engine")
+def test_get_files_ndjson(mock_engine):
+    import json
+
+    mock_collection = MagicMock()
+    mock_engine._db.__getitem__.return_value = mock_collection
+    ids = [ObjectId() for _ in range(3)]
+    mock_cursor = MagicMock()
+    mock_cursor.__aiter__.return_value = [{"_id": i, "size": n} for n, i in enumerate(ids)]
+    mock_collection.find.return_value = mock_cursor
+
+    response = client.get("/api/v1/files/?fields=size", headers={"Accept": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines == [{"id": str(i), "size": n} for n, i in enumerate(ids)]
+    assert mock_collection.find.call_args.kwargs["limit"] == 0
+
+@patch("main.engine")
+def test_ingest_files_ndjson(mock_engine):
+    import json
+
+    mock_collection = MagicMock()
+    mock_engine._db.__getitem__.return_value = mock_collection
+    mock_report_refresh(mock_collection)
+    mock_collection.bulk_write = AsyncMock(side_effect=lambda operations, ordered: MagicMock(bulk_api_result={
+        "nUpserted": len(operations), "nModified": 0, "nMatched": 0,
+        "upserted": [{"index": i, "_id": ObjectId()} for i in range(len(operations))],
+    }))
+    record = {"name": "a.txt", "size": 1, "kind": ".txt", "md5": "aaa", "parent_dir": "d", "duplicate_status": "NONE"}
+    lines = [json.dumps(dict(record, full_path=f"/d/{i}")) for i in range(5)]
+    lines[1] = "{not json"
+    lines[3] = json.dumps({"name": "missing fields"})
+    lines.insert(4, "x" * 300)
+    body = ("\n".join(lines) + "\n\n").encode()
+
+    def chunks():
+        # Split mid-line to exercise incremental parsing
+        for start in range(0, len(body), 7):
+            yield body[start:start + 7]
+
+    with patch("main.INGEST_BATCH_SIZE", 2), patch("main.MAX_INGEST_LINE", 200):
+        response = client.post("/api/v1/files/ingest", content=chunks())
+    assert response.status_code == 200
+    data = response.json()
+    assert data["inserted"] == 3
+    assert data["failed"] == 3
+    assert [error["line"] for error in data["errors"]] == [2, 4, 5]
+    assert "exceeds" in data["errors"][2]["error"]
+    # Written in bounded batches as the body arrives; each also updates the stats and reports
+    assert [len(call.args[0]) for call in mock_collection.bulk_write.call_args_list[::3]] == [2, 1]
+
+@patch("main.engine")
+def test_mark_vanished(mock_engine):
+    mock_collection = MagicMock()
+    mock_engine._db.__getitem__.return_value = mock_collection
+    mock_report_refresh(mock_collection)
+    mock_collection.find.return_value = AsyncMock()
+    vanished_id = ObjectId()
+    mock_collection.find.return_value.to_list.return_value = [{"_id": vanished_id, "md5": "aaa", "hash_algo": "md5", "size": 7}]
+    mock_collection.update_many = AsyncMock(return_value=MagicMock(modified_count=1))
+
+    response = client.post("/api/v1/files/vanished", json={"host": "nas", "full_paths": ["/d/a.txt"]})
+    assert response.status_code == 200
+    assert response.json() == {"marked": 1, "directories_removed": 0}
+    query, update = mock_collection.update_many.call_args.args
+    assert query == {"host": "nas", "full_path": {"$in": ["/d/a.txt"]}, "vanished_at": None}
+    assert "vanished_at" in update["$set"]
+    # The vanished file leaves its duplicate group
+    update = group_updates(mock_collection)["md5:aaa"]
+    assert update["count"] == {"$add": [{"$ifNull": ["$count", 0]}, -1]}
+    assert update["total_size"] == {"$add": [{"$ifNull": ["$total_size", 0]}, -7]}
+    assert update["files"]["$slice"][0]["$concatArrays"][1] == {"$literal": []}
+
+@patch("main.engine")
+def test_mark_vanished_directories(mock_engine):
+    from collections import defaultdict
+
+    collections = defaultdict(MagicMock)
+    mock_engine._db.__getitem__.side_effect = collections.__getitem__
+    files = collections[main.FileModel._collection]
+    directories = collections[main.DirectoryModel._collection]
+    for collection in (files, directories, collections[main.DUPLICATE_GROUPS], collections[main.DUPLICATE_DIRECTORIES]):
+        mock_report_refresh(collection)
+    files.update_many = AsyncMock(return_value=MagicMock(modified_count=2))
+    directories.find.return_value = AsyncMock()
+    directories.find.return_value.to_list.return_value = [{"_id": ObjectId(), "merkle": "tree", "hash_algo": "md5"}]
+    directories.delete_many = AsyncMock(return_value=MagicMock(deleted_count=1))
+
+    response = client.post("/api/v1/files/vanished", json={"host": "nas", "full_paths": [], "directories": ["/d/old.dir/"]})
+    assert response.status_code == 200
+    assert response.json() == {"marked": 2, "directories_removed": 1}
+    query = files.update_many.call_args.args[0]
+    assert query["$or"] == [{"full_path": {"$in": []}}, {"full_path": {"$regex": r"^/d/old\.dir/"}}]
+    # Directory records of the subtree are deleted and leave their duplicate directory groups
+    assert directories.delete_many.call_args.args[0] == {"host": "nas", "$or": [
+        {"full_path": {"$in": ["/d/old.dir"]}}, {"full_path": {"$regex": r"^/d/old\.dir/"}},
+    ]}
+    update = group_updates(collections[main.DUPLICATE_DIRECTORIES])["md5:tree"]
+    assert update["count"] == {"$add": [{"$ifNull": ["$count", 0]}, -1]}
+
+@patch("main.engine")
+def test_report_actions(mock_engine):
+    mock_collection = MagicMock()
+    mock_engine._db.__getitem__.return_value = mock_collection
+    mock_report_refresh(mock_collection)
+    mock_collection.find.return_value = AsyncMock()
+    mock_collection.find.return_value.to_list.return_value = [{"md5": "aaa", "hash_algo": "md5"}]
+    mock_collection.bulk_write = AsyncMock(return_value=MagicMock(matched_count=2, modified_count=2))
+
+    reports = [
+        {"host": "nas", "full_path": "/d/a.txt", "action": "rm", "status": "done"},
+        {"host": "nas", "full_path": "/d/b.txt", "action": "cp", "action_args": "/backup/b.txt",
+         "status": "failed", "error": "No space left on device"},
+    ]
+    response = client.post("/api/v1/files/actions/report", json=reports)
+    assert response.status_code == 200
+    assert response.json() == {"matched": 2, "modified": 2}
+
+    removed, failed = mock_collection.bulk_write.call_args_list[0].args[0]
+    assert removed._filter == {"host": "nas", "full_path": "/d/a.txt"}
+    assert removed._doc["$set"]["action_status"] == "done"
+    assert "vanished_at" in removed._doc["$set"]
+    assert failed._doc["$set"]["action_error"] == "No space left on device"
+    assert "vanished_at" not in failed._doc["$set"]
+    # Only the removed file's duplicate group is recomputed
+    assert mock_collection.find.call_args.args[0] == {"$or": [{"host": "nas", "full_path": "/d/a.txt"}], "vanished_at": None}
+
+@patch.dict(main._stats_cache, stats=None, expires=0.0)
+@patch("main.engine")
+def test_rebuild_stats(mock_engine):
+    mock_collection = MagicMock()
+    mock_engine._db.__getitem__.return_value = mock_collection
+    mock_collection.aggregate.return_value = AsyncMock()
+    mock_collection.aggregate.return_value.to_list.return_value = [{
+        "total": [{"_id": "total", "files": 3, "size": 30}],
+        "kind": [{"_id": "kind/.txt", "files": 3, "size": 30}],
+        "duplicate_status": [{"_id": "duplicate_status/NONE", "files": 3, "size": 30}],
+    }]
+    mock_collection.delete_many = AsyncMock()
+    mock_collection.bulk_write = AsyncMock()
+    mock_collection.find.return_value = AsyncMock()
+    mock_collection.find.return_value.to_list.return_value = []
+
+    response = client.post("/api/v1/stats/rebuild")
+    assert response.status_code == 200
+    ids = ["total", "kind/.txt", "duplicate_status/NONE"]
+    # Buckets of kinds and statuses that no longer occur are dropped
+    mock_collection.delete_many.assert_awaited_once_with({"_id": {"$nin": ids}})
+    assert [op._filter["_id"] for op in mock_collection.bulk_write.call_args.args[0]] == ids
+
+def test_token_auth():
+    from config import ApiKey, AuthConfig, hash_api_key
+    from pydantic import ValidationError
+
+    auth = AuthConfig(enabled=True, api_keys=[ApiKey(name="scanner", hash=hash_api_key("tok-123"))])
+    assert auth.api_keys[0].hash.startswith("sha256$")
+    with pytest.raises(ValidationError):
+        ApiKey(name="scanner", hash="pbkdf2_sha256$1$00$ff")
+    main.matching_api_key.cache_clear()
+    overrides = app.dependency_overrides.copy()
+    app.dependency_overrides.pop(get_current_username)
+    try:
+        with patch.object(main.settings, "auth", auth), patch("main.check_api_key", wraps=main.check_api_key) as check:
+            assert client.get("/version", headers={"Authorization": "Bearer tok-123"}).status_code == 200
+            assert client.get("/version", headers={"Authorization": "Bearer tok-123"}).status_code == 200
+            # The second request is answered from the LRU without hashing again
+            assert check.call_count == 1
+
+            response = client.get("/version", headers={"Authorization": "Bearer wrong"})
+            assert response.status_code == 401
+            assert response.headers["WWW-Authenticate"] == "Bearer"
+            # Rejected tokens are not cached, so they cannot evict verified ones
+            assert client.get("/version", headers={"Authorization": "Bearer wrong"}).status_code == 401
+            assert check.call_count == 3
+            assert main.matching_api_key.cache_info().currsize == 1
+            # Basic credentials remain a fallback
+            assert client.get("/version", auth=("admin", "secret")).status_code == 200
+            assert client.get("/version").status_code == 401
+    finally:
+        app.dependency_overrides.update(overrides)
+        main.matching_api_key.cache_clear()
+
+@patch("main.engine")
+def test_version_check_memoized(mock_engine):
+    mock_collection = MagicMock()
+    mock_engine._db.__getitem__.return_value = mock_collection
+    mock_collection.find.return_value = AsyncMock()
+    mock_collection.find.return_value.to_list.return_value = []
+    main.check_client_version.cache_clear()
+
+    with patch("main.semver.compare", wraps=main.semver.compare) as compare:
+        for _ in range(3):
+            response = client.post("/api/v1/files/lookup", json={"md5s": []})
+            assert response.status_code == 200
+            assert response.headers["X-Server-Version"] == main.VERSION
+        assert compare.call_count == 1
+
+        # Handlers returning their own Response carry the header too
+        for fmt in ("json", "ndjson"):
+            response = client.get(f"/api/v1/files/?format={fmt}")
+            assert response.status_code == 200
+            assert response.headers["X-Server-Version"] == main.VERSION
+
+        response = client.post("/api/v1/files/lookup", json={"md5s": []}, headers={"X-Client-Version": "0.0.1"})
+        assert response.status_code == 426
+        response = client.post("/api/v1/files/lookup", json={"md5s": []}, headers={"X-Client-Version": "banana"})
+        assert response.status_code == 400
@@ -4,10 +4,11 @@ from fastapi.testclient import TestClient
 from main import app
 
 from fastapi.testclient import TestClient
-from unittest.mock import AsyncMock
+from unittest.mock import AsyncMock, MagicMock
 import main
 
 # Mock DB calls to avoid Event Loop issues with global AsyncDbEngine
+main.engine = MagicMock()
 main.engine.find_many = AsyncMock(return_value=[])
 main.engine.save = AsyncMock(return_value=None)
 main.engine.find_one = AsyncMock(return_value=None)
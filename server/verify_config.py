@@ -3,7 +3,7 @@ import secrets
 import shutil
 from pathlib import Path
 from fastapi.testclient import TestClient
-from unittest.mock import AsyncMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 import config
 
 # Mock DB calls globally before import main (though we import main inside test to allow reloading?)
@@ -14,6 +14,7 @@ import importlib
 import main
 from main import app
 
+main.engine = MagicMock()
 main.engine.find_many = AsyncMock(return_value=[])
 main.engine.save = AsyncMock(return_value=None)
 main.engine.find_one = AsyncMock(return_value=None)
@@ -37,6 +38,7 @@ def reload_app():
     importlib.reload(config)
     importlib.reload(main)
     # Re-apply mocks after reload
+    main.engine = MagicMock()
     main.engine.find_many = AsyncMock(return_value=[])
     main.engine.save = AsyncMock(return_value=None)
     main.engine.find_one = AsyncMock(return_value=None)